@@ -1,16 +1,27 @@
 """ Agent for code analyzer """
 """ Testing"""
 import anthropic
+import asyncio
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dotenv import load_dotenv
 
 from tools.modify import modify_code_file
+from tools.edit import edit_code_file
 from tools.read import read_code_file
 from tools.write import create_code_file
 from tools.search import search_similar_code
+from tools.structure import expand_codebase_structure
 
-from utils.prompts import system_prompt
+from utils.prompts import get_system_prompt
+from utils.context import ConversationContext
+from utils.registry import get_anthropic_client
+from utils.file_cache import file_cache
+from utils.telemetry import activate, span, start_trace, record_usage
 
 load_dotenv()
 
@@ -19,11 +30,31 @@ ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 CODE_REPO_PATH = os.getenv("CODE_REPO_PATH")
 print("CODE_REPO_PATH", CODE_REPO_PATH)
 
+AGENT_MODEL = "claude-3-7-sonnet-20250219"
+
+# Tool calls of one turn run concurrently on this pool
+TOOL_WORKERS = int(os.getenv("CODERAG_TOOL_WORKERS", "8"))
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="coderag-tool")
+
+# Tools that write the file named by their file_path input
+WRITE_TOOLS = {"modify_code_file", "create_code_file", "edit_code_file"}
+FILE_TOOLS = WRITE_TOOLS | {"read_code_file"}
+
+# One lock per written file, so concurrent writers never interleave
+_file_locks = {}
+_file_locks_lock = threading.Lock()
+
+# Model requests streaming at once across every conversation in the process
+MAX_LLM_CALLS = int(os.getenv("CODERAG_MAX_LLM_CALLS", "8"))
+_llm_slots = threading.BoundedSemaphore(MAX_LLM_CALLS)
+# Threads reading the model streams, one per slot
+_llm_executor = ThreadPoolExecutor(max_workers=MAX_LLM_CALLS, thread_name_prefix="coderag-llm")
+
 
 tools = [    
     {
         "name": "read_code_file",
-        "description": "Read and retrieve code content from a file. Can read either the entire file or a specific range of lines. Useful for inspecting existing code, understanding context, or verifying file contents. Returns the file content as a string.",
+        "description": "Read and retrieve code content from a file. Can read either the entire file or a specific range of lines. Useful for inspecting existing code, understanding context, or verifying file contents. Returns the file content as a string, followed by a [Version: ...] line identifying the file's current content for edit_code_file.",
         "input_schema": {
             "type": "object",
             "properties": {
@@ -61,6 +92,63 @@ tools = [
             "required": ["file_path", "new_code"]
         }
     },
+    {
+        "name": "edit_code_file",
+        "description": "Edit part of an existing code file without resending the whole file. Applies one or more edits together: replace a range of lines, insert lines after a given line, or replace a unique exact snippet. Line numbers and search texts refer to the file as it is before this call, and edits must not overlap. Pass the version reported by your last read or edit of the file to detect conflicting changes. Only the changed code is re-indexed. Returns the new version and the edited regions with a few lines of context. Prefer this over modify_code_file for changes that do not touch most of the file.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "file_path": {
+                    "type": "string",
+                    "description": "Path to the file to edit (relative or absolute)"
+                },
+                "edits": {
+                    "type": "array",
+                    "description": "Edits to apply together",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "type": {
+                                "type": "string",
+                                "enum": ["replace", "insert", "search_replace"],
+                                "description": "replace: lines start_line-end_line become new_code (empty new_code deletes them). insert: new_code goes after line (0 for the top of the file). search_replace: the single exact occurrence of search becomes replace."
+                            },
+                            "start_line": {
+                                "type": "integer",
+                                "description": "First line to replace (1-based, inclusive)"
+                            },
+                            "end_line": {
+                                "type": "integer",
+                                "description": "Last line to replace (1-based, inclusive)"
+                            },
+                            "line": {
+                                "type": "integer",
+                                "description": "Line after which to insert (0 inserts at the top)"
+                            },
+                            "new_code": {
+                                "type": "string",
+                                "description": "Code for replace and insert edits"
+                            },
+                            "search": {
+                                "type": "string",
+                                "description": "Exact text to find, occurring exactly once in the file"
+                            },
+                            "replace": {
+                                "type": "string",
+                                "description": "Text that replaces search"
+                            }
+                        },
+                        "required": ["type"]
+                    }
+                },
+                "expected_version": {
+                    "type": "string",
+                    "description": "Version of the file the edits were written against, from the last read or edit"
+                }
+            },
+            "required": ["file_path", "edits"]
+        }
+    },
     {
         "name": "create_code_file",
         "description": "Create a new file or overwrite an existing one with provided code. This tool handles file creation, directory validation, and writes the specified content. Useful for generating new source files, configuration files, or documentation. Returns the path of the created file.",
@@ -92,83 +180,351 @@ tools = [
             },
             "required": ["query"]
         }
+    },
+    {
+        "name": "expand_codebase_structure",
+        "description": "Show the detailed structure of a directory or Python file in the codebase: classes, class attributes, methods, functions with their parameters, docstrings, return expressions and imports. The codebase structure in the system prompt may only be an outline for large codebases; use this tool to drill into the part you need. Large directories are shown at reduced detail; expand a subdirectory or file for more.",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "path": {
+                    "type": "string",
+                    "description": "Directory or Python file to expand (relative to the codebase root or absolute)"
+                }
+            },
+            "required": ["path"]
+        }
     }
 ]
 
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+TOOL_NAMES = {tool["name"] for tool in tools}
+
+client = get_anthropic_client()
 
 def process_tool_call(tool_name, tool_input):
+    # Unknown names share one span name, keeping the metric labels bounded
+    with span(f"tool.{tool_name if tool_name in TOOL_NAMES else 'unknown'}"):
+        return _call_tool(tool_name, tool_input)
+
+def _call_tool(tool_name, tool_input):
     if tool_name == "read_code_file":
-        return read_code_file(**tool_input)
+        content = read_code_file(**tool_input)
+        # The version lets edit_code_file detect changes made after this read
+        version = file_cache.version(_tool_file_path(tool_name, tool_input))
+        return f"{content}\n[Version: {version}]"
     elif tool_name == "modify_code_file":
         return modify_code_file(**tool_input)
+    elif tool_name == "edit_code_file":
+        return edit_code_file(**tool_input)
     elif tool_name == "create_code_file":
         return create_code_file(**tool_input)
     elif tool_name == "search_similar_code":
         return search_similar_code(**tool_input)
+    elif tool_name == "expand_codebase_structure":
+        return expand_codebase_structure(**tool_input)
     return None
 
-def chat(user_message, messages=None):
+def _tool_file_path(tool_name, tool_input):
+    """Return the absolute path a file tool call touches, resolved like the tools do, or None."""
+    if tool_name not in FILE_TOOLS or not isinstance(tool_input.get("file_path"), str):
+        return None
+    file_path = tool_input["file_path"]
+    if not os.path.isabs(file_path):
+        file_path = os.path.join(os.getenv("CODE_REPO_PATH") or "", file_path.lstrip('/'))
+    return os.path.normpath(file_path)
+
+def _file_lock(file_path):
+    with _file_locks_lock:
+        return _file_locks.setdefault(file_path, threading.Lock())
+
+def _run_tool_use(tool_use, parent=None):
+    """Run one tool_use block and return its tool_result block, traced under the parent span."""
+    file_path = _tool_file_path(tool_use.name, tool_use.input)
+    with activate(parent), span("agent.process_tool_call", tool=tool_use.name) as call:
+        try:
+            if tool_use.name in WRITE_TOOLS and file_path:
+                with _file_lock(file_path):
+                    tool_result = process_tool_call(tool_use.name, tool_use.input)
+            else:
+                tool_result = process_tool_call(tool_use.name, tool_use.input)
+            return {"type": "tool_result", "tool_use_id": tool_use.id, "content": str(tool_result)}
+        except Exception as e:
+            call.set(error=str(e))
+            return {"type": "tool_result", "tool_use_id": tool_use.id,
+                    "content": f"Error: {str(e)}", "is_error": True}
+
+class ToolScheduler:
+    def __init__(self, executor=None, parent=None):
+        """
+        Run the tool calls of one turn as they arrive, keeping file accesses ordered.
+
+        Calls start immediately unless they touch a file with an earlier,
+        unfinished call of this turn: a write waits for every earlier call on
+        its file, and a read waits for the last earlier write. Everything else
+        runs concurrently on the executor.
+
+        Args:
+            executor (Executor, optional): Pool running the calls. Defaults to the shared tool pool.
+            parent (Span, optional): Span the calls are traced under
+        """
+        self.executor = executor or _tool_executor
+        self.parent = parent
+        self._futures = []
+        # Per file: the last write and the calls issued since
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, tool_use) -> Future:
+        """Schedule one tool_use block; the future resolves to its tool_result block."""
+        file_path = _tool_file_path(tool_use.name, tool_use.input)
+        with self._lock:
+            deps = []
+            if file_path is not None:
+                pending = self._pending.setdefault(file_path, [])
+                if tool_use.name in WRITE_TOOLS:
+                    deps = list(pending)
+                elif pending and pending[0][0]:
+                    deps = [pending[0]]
+            future = self._after([dep for _, dep in deps], _run_tool_use, tool_use, self.parent)
+            if file_path is not None:
+                if tool_use.name in WRITE_TOOLS:
+                    self._pending[file_path] = [(True, future)]
+                else:
+                    self._pending[file_path].append((False, future))
+            self._futures.append(future)
+        return future
+
+    def _after(self, deps, func, *args) -> Future:
+        """Submit func once every future in deps is done."""
+        if not deps:
+            return self.executor.submit(func, *args)
+        result = Future()
+        remaining = [len(deps)]
+        remaining_lock = threading.Lock()
+
+        def on_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            inner = self.executor.submit(func, *args)
+            inner.add_done_callback(lambda done: result.set_result(done.result()))
+
+        for dep in deps:
+            dep.add_done_callback(on_done)
+        return result
+
+    def results(self):
+        """Wait for every scheduled call and return the tool_result blocks in submission order."""
+        return [future.result() for future in self._futures]
+
+def _create_message_stream(request):
+    return client.messages.stream(
+        model=AGENT_MODEL,
+        temperature=0,
+        max_tokens=64000,
+        **request
+    )
+
+def _pump_message_stream(request, scheduler, call, events, stopped):
+    """
+    Read one model response into a queue of turn events, then release its LLM slot.
+
+    Runs on its own thread, so the slot taken by chat_stream is held only
+    while the API streams, however slowly the turn's consumer takes the
+    events. Each tool_use block is submitted to the scheduler as soon as it
+    is complete. A None event marks the end of the response.
+
+    Returns:
+        tuple: (final message, submitted tool_use blocks); the message is None if stopped early
+    """
+    tool_uses = []
+    try:
+        with call, _create_message_stream(request) as stream:
+            for event in stream:
+                if stopped.is_set():
+                    return None, tool_uses
+                if "first_event_ms" not in call.attributes:
+                    call.set(first_event_ms=round((time.perf_counter() - call.start) * 1000, 3))
+                if event.type == "text":
+                    events.put({"type": "text", "text": event.text})
+                elif event.type == "content_block_stop" and event.content_block.type == "tool_use":
+                    tool_use = event.content_block
+                    tool_uses.append(tool_use)
+                    scheduler.submit(tool_use)
+                    events.put({"type": "tool_use", "id": tool_use.id, "name": tool_use.name,
+                                "input": tool_use.input})
+            response = stream.get_final_message()
+            call.set(stop_reason=response.stop_reason)
+            record_usage(AGENT_MODEL, getattr(response, "usage", None), call)
+        return response, tool_uses
+    finally:
+        _llm_slots.release()
+        events.put(None)
+
+def chat_stream(user_message, messages=None, context=None):
+    """
+    Run one user turn with streaming, yielding events as they happen.
+
+    Text deltas are yielded as soon as the API sends them. Each tool call
+    is started the moment its input block is complete, while the model is
+    still writing the rest of the response; its result is yielded once the
+    response has finished and every call of the turn has returned, also
+    when the response then stops on end_turn or max_tokens.
+
+    Events are dicts with a "type" key:
+        {"type": "text", "text": str}: a text delta
+        {"type": "tool_use", "id", "name", "input"}: a tool call was started
+        {"type": "tool_result", "tool_use_id", "name", "content", "is_error"}: a tool call finished
+        {"type": "done", "text": str, "stop_reason": str, "usage": dict, "trace_id": str}: the turn is over
+
+    Every turn is recorded as a trace: one span per model call, with its
+    token usage, and one per tool call with the embedding, search and
+    vector store work done inside it. See utils.telemetry.get_trace.
+
+    Args:
+        user_message (str): The user's message
+        messages (list, optional): Conversation history, extended in place
+        context (ConversationContext, optional): Session context; takes precedence over messages
+            and keeps token usage and compaction state across turns
+
+    Yields:
+        dict: Events of the turn
+    """
+    if context is None:
+        context = ConversationContext(messages)
+    context.add_user(user_message)
+
+    # Spans are parented explicitly: this generator may resume on a different thread at every step
+    trace = start_trace("agent.chat", model=AGENT_MODEL)
+    error = None
+    try:
+        # Built per turn so edits made by the tools show up in the structure
+        with trace.root.child("agent.system_prompt"):
+            system_prompt = get_system_prompt()
+        while True:
+            scheduler = ToolScheduler(parent=trace.root)
+            request = context.request(system_prompt, tools)
+            events = queue.Queue()
+            stopped = threading.Event()
+            queued = time.perf_counter()
+            _llm_slots.acquire()
+            call = trace.root.child("llm.messages", model=AGENT_MODEL)
+            call.set(slot_wait_ms=round((call.start - queued) * 1000, 3))
+            try:
+                pump = _llm_executor.submit(_pump_message_stream, request, scheduler, call, events, stopped)
+            except BaseException:
+                _llm_slots.release()
+                raise
+            try:
+                while True:
+                    event = events.get()
+                    if event is None:
+                        break
+                    yield event
+                response, tool_uses = pump.result()
+            finally:
+                # Ends the model stream right away if the consumer stopped early
+                stopped.set()
+            context.record_usage(getattr(response, "usage", None))
+            context.add_assistant(response.content)
+
+            # Calls already ran while the response streamed, whatever it stopped on: their
+            # results must follow the tool_use blocks or every later request is rejected
+            if tool_uses or any(block.type == "tool_use" for block in response.content):
+                with trace.root.child("agent.tool_results"):
+                    tool_results = scheduler.results()
+                # A block cut off by max_tokens never completed and was not run
+                started = {tool_use.id for tool_use in tool_uses}
+                for block in response.content:
+                    if block.type == "tool_use" and block.id not in started:
+                        tool_uses.append(block)
+                        tool_results.append({"type": "tool_result", "tool_use_id": block.id, "is_error": True,
+                                             "content": "Error: the tool call was cut off and did not run"})
+                # Every result goes back in a single user message, added before they are
+                # yielded so the history stays valid if the consumer stops here
+                context.add_user(tool_results)
+                for tool_use, tool_result in zip(tool_uses, tool_results):
+                    yield {
+                        "type": "tool_result",
+                        "tool_use_id": tool_use.id,
+                        "name": tool_use.name,
+                        "content": tool_result["content"],
+                        "is_error": tool_result.get("is_error", False)
+                    }
+
+            if response.stop_reason != "tool_use":
+                final_response = "".join(block.text for block in response.content if block.type == "text")
+                trace.finish()
+                yield {"type": "done", "text": final_response, "stop_reason": response.stop_reason,
+                       "usage": dict(context.usage), "trace_id": trace.trace_id}
+                return
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Also reached when the consumer stops early and closes the stream
+        trace.finish(error)
+
+async def achat_stream(user_message, messages=None, context=None, executor=None):
+    """
+    Async iterator version of chat_stream, for embedding the agent in an event loop.
+
+    The blocking stream runs in a worker thread; events are handed over
+    one at a time, so the loop is never blocked on the API or the tools.
+    If the consumer stops early (closes the iterator or is cancelled), the
+    turn is closed as soon as the step in progress returns, which ends the
+    model stream.
+
+    Args:
+        executor (Executor, optional): Pool stepping the stream. Defaults to the loop's default executor.
+    """
+    loop = asyncio.get_running_loop()
+    events = chat_stream(user_message, messages, context)
+    done = object()
+    step = None
+    try:
+        while True:
+            step = loop.run_in_executor(executor, next, events, done)
+            # Shielded so a cancelled consumer does not abandon a step still running in the thread
+            event = await asyncio.shield(step)
+            if event is done:
+                return
+            yield event
+    finally:
+        if step is None or step.done():
+            events.close()
+        else:
+            step.add_done_callback(lambda _: loop.run_in_executor(executor, events.close))
+
+def chat(user_message, messages=None, context=None):
     print(f"\n{'='*50}\nUser Message: {user_message}\n{'='*50}")
     
     # Initialize or update messages list
-    if messages is None:
-        messages = []
-    messages.append({"role": "user", "content": user_message})
+    if context is None:
+        context = ConversationContext(messages)
+    messages = context.messages
     
     try:
-        response = client.messages.create(
-            system=system_prompt,
-            model="claude-3-7-sonnet-20250219",
-            temperature=0,
-            max_tokens=64000,
-            tools=tools,
-            messages=messages
-        )
-        print(f"\nInitial Response:")
-        print(f"Stop Reason: {response.stop_reason}")
-        print(f"Content: {response.content}")
-        while response.stop_reason == "tool_use":
-            tool_use = next(block for block in response.content if block.type == "tool_use")
-            tool_name = tool_use.name
-            tool_input = tool_use.input
-            print(f"\nTool Used: {tool_name}")
-            print(f"Tool Input:")
-            print(json.dumps(tool_input, indent=2))
-            tool_result = process_tool_call(tool_name, tool_input)
-            print(f"\nTool Result:")
-            print(json.dumps(tool_result, indent=2))
-            messages.extend([
-                {"role": "assistant", "content": response.content},
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": tool_use.id,
-                            "content": str(tool_result)
-                        }
-                    ]
-                }
-            ])
-            response = client.messages.create(
-                system=system_prompt,
-                model="claude-3-7-sonnet-20250219",
-                temperature=0,
-                max_tokens=64000,
-                tools=tools,
-                messages=messages
-            )
-            # print(f"\nFollow-up Response:")
-            # print(f"Stop Reason: {response.stop_reason}")
-            # print(f"Content: {response.content}")
-        # Extract final text response
         final_response = None
-        final_response = next(
-            (block.text for block in response.content if hasattr(block, "text")),
-            None,
-        )
-        print(f"\nFinal Response: {final_response}")
+        print()
+        for event in chat_stream(user_message, context=context):
+            if event["type"] == "text":
+                # Render text as it arrives instead of after the whole turn
+                print(event["text"], end="", flush=True)
+            elif event["type"] == "tool_use":
+                print(f"\n\nTool Used: {event['name']}")
+                print(f"Tool Input:")
+                print(json.dumps(event["input"], indent=2))
+            elif event["type"] == "tool_result":
+                print(f"\nTool Result ({event['name']}):")
+                print(event["content"])
+            elif event["type"] == "done":
+                final_response = event["text"]
+                usage = event["usage"]
+                print(f"\n\nStop Reason: {event['stop_reason']}")
+                print(f"Session tokens: {usage['input_tokens']} input, {usage['cache_read_input_tokens']} cache read, "
+                      f"{usage['cache_creation_input_tokens']} cache write, {usage['output_tokens']} output")
         return final_response, messages
     except Exception as e:
         print(f"Error occurred: {str(e)}")
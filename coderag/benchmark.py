@@ -0,0 +1,510 @@
+""" Offline benchmark of indexing and search with deterministic stand-ins for the models and APIs """
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import numpy as np
+
+# Dimension of all-MiniLM-L6-v2, the embedding model the stand-in replaces
+EMBEDDING_DIMENSIONS = 384
+BENCHMARK_COLLECTION = "coderag-benchmark"
+
+# Vocabulary of the synthetic repository; every function is named verb_adjective_noun
+_VERBS = [
+    ("load", "loaded"), ("save", "saved"), ("parse", "parsed"), ("validate", "validated"),
+    ("render", "rendered"), ("compute", "computed"), ("merge", "merged"), ("filter", "filtered"),
+    ("encode", "encoded"), ("decode", "decoded"), ("fetch", "fetched"), ("normalize", "normalized"),
+    ("schedule", "scheduled"), ("export", "exported"), ("archive", "archived"), ("sync", "synced"),
+    ("resolve", "resolved"), ("cancel", "cancelled"), ("approve", "approved"), ("index", "indexed"),
+]
+_ADJECTIVES = [
+    "pending", "monthly", "remote", "cached", "default", "stale", "primary", "partial", "expired",
+    "shared", "weekly", "draft", "secure", "legacy", "nested", "external", "active", "raw", "signed",
+    "bulk",
+]
+_NOUNS = [
+    "invoice", "customer", "order", "payment", "shipment", "report", "session", "token", "profile",
+    "comment", "product", "coupon", "refund", "ticket", "warehouse", "vendor", "budget", "schedule",
+    "address", "review", "cart", "subscription", "account", "message", "upload", "receipt", "quota",
+    "template", "webhook", "ledger",
+]
+_FUNCTIONS_PER_FILE = 6
+_METHODS_PER_CLASS = 2
+_FILES_PER_PACKAGE = 25
+
+_FUNCTION_QUERIES = [
+    "where is the {adjective} {noun} {past}",
+    "how do we {verb} {adjective} {noun}s",
+    "code that can {verb} the {adjective} {noun}",
+]
+_CLASS_QUERIES = [
+    "class managing {adjective} {noun} objects",
+    "which class keeps track of {adjective} {noun}s",
+]
+
+def _features(text: str):
+    """Search terms of a text and the character trigrams of each, so inflections still overlap."""
+    from embedding.lexical import tokenize
+    features = []
+    for token in tokenize(text):
+        features.append(token)
+        padded = f"#{token}#"
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+class HashingEmbeddingModel:
+    def __init__(self, dimensions: int = EMBEDDING_DIMENSIONS):
+        """
+        Deterministic stand-in for the SentenceTransformer model.
+
+        Terms and trigrams are hashed into a fixed number of signed buckets
+        and the vector is normalized, so texts sharing words end up close.
+
+        Args:
+            dimensions (int): Size of the vectors
+        """
+        self.dimensions = dimensions
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in _features(text):
+            bucket = zlib.crc32(feature.encode("utf-8"))
+            vector[bucket % self.dimensions] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            return self._vector(sentences)
+        if not sentences:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        return np.stack([self._vector(sentence) for sentence in sentences])
+
+class OverlapReranker:
+    """Stand-in for the ColBERT reranker scoring documents by the share of query features they contain."""
+
+    def rank(self, query: str, docs, doc_ids=None):
+        doc_ids = list(range(len(docs))) if doc_ids is None else doc_ids
+        wanted = set(_features(query))
+        results = []
+        for doc_id, doc in zip(doc_ids, docs):
+            score = len(wanted & set(_features(doc))) / len(wanted) if wanted else 0.0
+            results.append(SimpleNamespace(document=SimpleNamespace(doc_id=doc_id, text=doc), score=score))
+        results.sort(key=lambda result: -result.score)
+        return SimpleNamespace(results=results)
+
+class FakeHydeClient:
+    def __init__(self, latency: float = 0.0):
+        """
+        Stand-in for the synchronous Anthropic client used by HyDE.
+
+        The hypothetical answer restates the question, so it is deterministic
+        and only as useful as the query itself.
+
+        Args:
+            latency (float): Seconds each call sleeps, to mimic the API round trip
+        """
+        self.latency = latency
+        self.messages = SimpleNamespace(create=self._create)
+
+    def _create(self, messages, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        match = re.search(r'question about code: "(.*?)"\n', prompt, re.DOTALL)
+        question = match.group(1) if match else prompt
+        text = f"This code is used to {question}. It implements the logic for {question}."
+        return SimpleNamespace(content=[SimpleNamespace(text=text)])
+
+def describe_code(code: str) -> str:
+    """Deterministic summary of a chunk: its header line, docstring and identifiers."""
+    lines = [line.strip() for line in code.splitlines() if line.strip()]
+    header = lines[0] if lines else ""
+    docstring = re.search(r'"""(.*?)"""', code, re.DOTALL)
+    identifiers = sorted(set(re.findall(r"[A-Za-z_][A-Za-z0-9_]{2,}", code)))[:24]
+    parts = [header]
+    if docstring:
+        parts.append(docstring.group(1).strip())
+    parts.append("Uses " + ", ".join(identifiers))
+    return "\n".join(parts)
+
+def make_fake_summarizer(latency: float = 0.0):
+    """Build a drop-in for generate_code_summary_async that never calls the API."""
+    async def generate_code_summary_async(code: str, client=None):
+        if latency:
+            await asyncio.sleep(latency)
+        return describe_code(code)
+    return generate_code_summary_async
+
+class StageTimer:
+    def __init__(self):
+        """Accumulate calls and wall time per stage across threads."""
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, items: int = 0) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(stage, {"calls": 0, "items": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["items"] += items
+            stats["seconds"] += seconds
+
+    def wrap(self, stage: str, function, count=None):
+        """
+        Time every call of a function under a stage.
+
+        Args:
+            stage (str): Stage name in the report
+            function: Callable to time
+            count (optional): Callable mapping (args, result) to the number of items processed
+        """
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            result = function(*args, **kwargs)
+            self.add(stage, time.perf_counter() - started, count(args, result) if count else 0)
+            return result
+        return timed
+
+    def wrap_async(self, stage: str, function):
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started, 1)
+        return timed
+
+    def report(self) -> dict:
+        with self._lock:
+            return {stage: {**stats, "seconds": round(stats["seconds"], 4)}
+                    for stage, stats in sorted(self._stats.items())}
+
+def generate_repo(directory: str, num_files: int, num_queries: int, seed: int = 0):
+    """
+    Write a synthetic Python repository and a labeled query set for it.
+
+    Every module has a constant, a chain of functions calling each other and
+    a class with a few methods. All names are unique verb_adjective_noun
+    combinations, and each query targets one function or class by
+    paraphrasing its name.
+
+    Args:
+        directory (str): Directory to write the repository to
+        num_files (int): Number of modules
+        num_queries (int): Number of labeled queries
+        seed (int): Seed of the generator
+
+    Returns:
+        list: Queries as {"query", "file", "name"}, with file relative to directory
+    """
+    rng = random.Random(seed)
+    names_per_file = _FUNCTIONS_PER_FILE + _METHODS_PER_CLASS + 1
+    combinations = [(verb, adjective, noun) for verb in _VERBS for adjective in _ADJECTIVES for noun in _NOUNS]
+    if num_files * names_per_file > len(combinations):
+        raise ValueError(f"At most {len(combinations) // names_per_file} synthetic files are supported")
+    names = iter(rng.sample(combinations, num_files * names_per_file))
+    targets = []
+
+    for index in range(num_files):
+        relative_path = os.path.join(f"pkg{index // _FILES_PER_PACKAGE:02d}", f"module_{index:04d}.py")
+        functions = [next(names) for _ in range(_FUNCTIONS_PER_FILE)]
+        methods = [next(names) for _ in range(_METHODS_PER_CLASS)]
+        _, class_adjective, class_noun = next(names)
+        constant = f"MAX_{functions[0][2].upper()}_ITEMS"
+
+        lines = [
+            f'"""Synthetic module {index} of the benchmark repository."""',
+            "import json",
+            "from typing import Dict, List",
+            "",
+            f"{constant} = {rng.randint(10, 500)}",
+            "",
+        ]
+        previous = None
+        for (verb, past), adjective, noun in functions:
+            name = f"{verb}_{adjective}_{noun}"
+            lines += [
+                "",
+                f"def {name}(items: List[Dict], limit: int = {constant}) -> List[Dict]:",
+                f'    """{verb.capitalize()} the {adjective} {noun} records and return at most limit of them."""',
+                f'    selected = [item for item in items if item.get("{noun}_id") and item.get("{adjective}")]',
+                "    if len(selected) > limit:",
+                "        selected = selected[:limit]",
+                f"    return {previous}(selected, limit)" if previous else "    return selected",
+                "",
+            ]
+            targets.append(("function", name, relative_path, verb, past, adjective, noun))
+            previous = name
+
+        class_name = f"{class_adjective.capitalize()}{class_noun.capitalize()}Manager"
+        lines += [
+            "",
+            f"class {class_name}:",
+            f'    """Keeps track of {class_adjective} {class_noun} objects."""',
+            "",
+            "    def __init__(self, path: str):",
+            "        self.path = path",
+            "        self.items = []",
+        ]
+        for (verb, _), adjective, noun in methods:
+            lines += [
+                "",
+                f"    def {verb}_{adjective}_{noun}(self, item: Dict) -> None:",
+                f'        """{verb.capitalize()} one {adjective} {noun} of this manager."""',
+                f'        item["{noun}_state"] = "{adjective}"',
+                "        self.items.append(item)",
+            ]
+        targets.append(("class", class_name, relative_path, None, None, class_adjective, class_noun))
+        lines += [
+            "",
+            "",
+            'if __name__ == "__main__":',
+            f"    print(json.dumps({previous}([]), indent=2))",
+            "",
+        ]
+
+        path = os.path.join(directory, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines))
+
+    queries = []
+    for kind, name, relative_path, verb, past, adjective, noun in rng.sample(targets, min(num_queries, len(targets))):
+        template = rng.choice(_FUNCTION_QUERIES if kind == "function" else _CLASS_QUERIES)
+        query = template.format(verb=verb, past=past, adjective=adjective, noun=noun)
+        queries.append({"query": query, "file": relative_path, "name": name})
+    return queries
+
+def _percentiles(values):
+    if not values:
+        return {}
+    values = np.asarray(values)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "mean": round(float(values.mean()), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+def _peak_rss_mb():
+    """Peak resident set size of this process, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def _use_scratch_stores(cache_dir: str, summary_policy: str = "llm") -> None:
+    """
+    Point every on-disk cache and index at cache_dir and pin the summary policy;
+    both are read by the modules when first imported.
+
+    The policy defaults to llm: every synthetic chunk is small enough for a
+    heuristic summary, which would leave the summarize stage and
+    --summary-latency measuring nothing.
+    """
+    os.environ["CODERAG_SUMMARY_POLICY"] = summary_policy
+    os.environ["CODERAG_VECTOR_STORE"] = "local"
+    os.environ["CODERAG_CACHE_DIR"] = cache_dir
+    os.environ["CODERAG_SUMMARY_CACHE_PATH"] = os.path.join(cache_dir, "summaries.sqlite3")
+    os.environ["CODERAG_STRUCTURE_CACHE_PATH"] = os.path.join(cache_dir, "structure.sqlite3")
+    os.environ["CODERAG_LOCAL_VECTOR_STORE_DIR"] = os.path.join(cache_dir, "vectors")
+    os.environ["CODERAG_LEXICAL_INDEX_DIR"] = os.path.join(cache_dir, "lexical")
+    os.environ["CODERAG_MANIFEST_DIR"] = os.path.join(cache_dir, "manifests")
+    # Chunks sent to the fake summarizer still make it construct an API client, which needs a key
+    os.environ.setdefault("ANTHROPIC_API_KEY", "offline-benchmark")
+
+def run_benchmark(repo: str, queries, top_k: int = 5, repeats: int = 1, batch_size: int = None,
+                  summary_latency: float = 0.0, hyde_latency: float = 0.0, use_hyde: bool = True,
+                  use_lexical: bool = True) -> dict:
+    """
+    Index a repository from scratch and run the labeled queries against it.
+
+    The caches and indexes must already point at a scratch directory (see
+    _use_scratch_stores); the models and API clients are replaced by the
+    deterministic stand-ins of this module.
+
+    Args:
+        repo (str): Repository to index
+        queries (list): Labeled queries as {"query", "file", "name"}, file relative to repo
+        top_k (int): Results per search, and the k of recall@k
+        repeats (int): Times every query is run for the latency figures
+        batch_size (int, optional): Chunks encoded and upserted together
+        summary_latency (float): Seconds each fake summary call takes
+        hyde_latency (float): Seconds each fake HyDE call takes
+        use_hyde (bool): Search with hypothetical answers
+        use_lexical (bool): Fuse in the lexical index
+
+    Returns:
+        dict: Indexing and search results
+    """
+    from utils.registry import register
+    from embedding import embedd, pipeline, summarizer
+    from embedding.embedd import CodeEmbedder, EMBED_BATCH_SIZE
+
+    register(("embedding_model", "all-MiniLM-L6-v2"), HashingEmbeddingModel())
+    register("reranker", OverlapReranker())
+    register("anthropic_client", FakeHydeClient(hyde_latency))
+
+    index_timer = StageTimer()
+    summarizer.generate_code_summary_async = index_timer.wrap_async("summarize", make_fake_summarizer(summary_latency))
+    pipeline.process_file = index_timer.wrap("parse", pipeline.process_file, lambda args, result: len(result[1]))
+
+    embedder = CodeEmbedder(collection_name=BENCHMARK_COLLECTION, backend="local")
+    embedder.encode_chunks = index_timer.wrap("encode", embedder.encode_chunks, lambda args, result: len(result[0]))
+    embedder.write_chunks = index_timer.wrap("write", embedder.write_chunks, lambda args, result: len(args[0]))
+
+    started = time.perf_counter()
+    diff = embedder.embed_directory(repo, batch_size=batch_size or EMBED_BATCH_SIZE, incremental=False)
+    index_seconds = time.perf_counter() - started
+    stages = index_timer.report()
+    files = len(diff["added"])
+    chunks = stages.get("write", {}).get("items", 0)
+    index = {
+        "files": files,
+        "chunks": chunks,
+        "seconds": round(index_seconds, 4),
+        "files_per_sec": round(files / index_seconds, 2) if index_seconds else None,
+        "chunks_per_sec": round(chunks / index_seconds, 2) if index_seconds else None,
+        "stages": stages,
+        # Chunks summarized from their own name, signature and docstring versus by the model
+        "summary_policies": {policy: summarizer.SUMMARIES.value(policy=policy) for policy in ("heuristic", "llm")},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+    search_timer = StageTimer()
+    embedder._vector_query = search_timer.wrap("vector_query", embedder._vector_query)
+    embedder.generate_hypothetical_answer = search_timer.wrap("hyde", embedder.generate_hypothetical_answer)
+    embedder.rerank_documents = search_timer.wrap("rerank", embedder.rerank_documents)
+    embedder.lexical_index.search = search_timer.wrap("lexical_query", embedder.lexical_index.search)
+
+    latencies, hits, reciprocal_ranks = [], 0, []
+    for repeat in range(repeats):
+        for labeled in queries:
+            # Every run pays for HyDE, as a query the agent has not asked before would
+            with embedd._hyde_cache_lock:
+                embedd._hyde_cache.clear()
+            started = time.perf_counter()
+            results = embedder.search(labeled["query"], n_results=top_k, use_hyde=use_hyde,
+                                      use_lexical=use_lexical, use_cache=False)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if repeat:
+                continue
+            found = [(os.path.relpath(metadata.get("file_path", ""), repo), metadata.get("name"))
+                     for metadata in results["metadatas"][0]]
+            target = (os.path.normpath(labeled["file"]), labeled["name"])
+            rank = found.index(target) + 1 if target in found else None
+            hits += rank is not None
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+
+    search = {
+        "queries": len(queries),
+        "repeats": repeats,
+        "top_k": top_k,
+        "latency_ms": _percentiles(latencies),
+        f"recall_at_{top_k}": round(hits / len(queries), 4) if queries else None,
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4) if reciprocal_ranks else None,
+        "stages": search_timer.report(),
+    }
+    embedder.close()
+    return {"index": index, "search": search}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--repo", help="Repository to index instead of a synthetic one")
+    parser.add_argument("--queries", help="JSON file of labeled queries [{query, file, name}] for --repo")
+    parser.add_argument("--generate", metavar="DIR",
+                        help="Only write the synthetic repository and its queries.json to DIR")
+    parser.add_argument("--files", type=int, default=200, help="Modules in the synthetic repository")
+    parser.add_argument("--num-queries", type=int, default=100, help="Labeled queries for the synthetic repository")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic repository")
+    parser.add_argument("--top-k", type=int, default=5, help="Results per search, the k of recall@k")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of every query for the latency figures")
+    parser.add_argument("--batch-size", type=int, help="Chunks encoded and upserted together")
+    parser.add_argument("--summary-latency", type=float, default=0.0, help="Seconds per fake summary call")
+    parser.add_argument("--summary-policy", choices=("llm", "tiered", "heuristic"), default="llm",
+                        help="How chunks are summarized; llm sends every chunk to the fake summarizer")
+    parser.add_argument("--hyde-latency", type=float, default=0.0, help="Seconds per fake HyDE call")
+    parser.add_argument("--no-hyde", action="store_true", help="Search without HyDE")
+    parser.add_argument("--no-lexical", action="store_true", help="Search without the lexical index")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if args.generate:
+        queries = generate_repo(args.generate, args.files, args.num_queries, args.seed)
+        with open(os.path.join(args.generate, "queries.json"), "w", encoding="utf-8") as file:
+            json.dump(queries, file, indent=2)
+        print(f"Wrote {args.files} files and {len(queries)} queries to {args.generate}")
+        return
+
+    scratch = tempfile.mkdtemp(prefix="coderag-benchmark-")
+    try:
+        _use_scratch_stores(os.path.join(scratch, "cache"), args.summary_policy)
+        if args.repo:
+            repo = os.path.abspath(args.repo)
+            queries = []
+            if args.queries:
+                with open(args.queries, "r", encoding="utf-8") as file:
+                    queries = json.load(file)
+        else:
+            repo = os.path.join(scratch, "repo")
+            queries = generate_repo(repo, args.files, args.num_queries, args.seed)
+
+        # Progress output of the indexer goes to stderr, keeping stdout for the report
+        with redirect_stdout(sys.stderr):
+            from utils.registry import shutdown
+            try:
+                results = run_benchmark(
+                    repo, queries, top_k=args.top_k, repeats=args.repeats, batch_size=args.batch_size,
+                    summary_latency=args.summary_latency, hyde_latency=args.hyde_latency,
+                    use_hyde=not args.no_hyde, use_lexical=not args.no_lexical
+                )
+            finally:
+                shutdown()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report = {
+        "config": {
+            "repo": args.repo or "synthetic",
+            "files": None if args.repo else args.files,
+            "seed": None if args.repo else args.seed,
+            "batch_size": args.batch_size,
+            "summary_policy": args.summary_policy,
+            "summary_latency": args.summary_latency,
+            "hyde_latency": args.hyde_latency,
+            "use_hyde": not args.no_hyde,
+            "use_lexical": not args.no_lexical,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        **results,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""On-disk, content-addressed cache for LLM generated code summaries."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CODERAG_CACHE_DIR = os.getenv("CODERAG_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "coderag"))
+SUMMARY_CACHE_PATH = os.getenv("CODERAG_SUMMARY_CACHE_PATH", os.path.join(CODERAG_CACHE_DIR, "summaries.sqlite3"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("CODERAG_SUMMARY_CACHE_MAX_ENTRIES", "200000"))
+
+# Eviction needs a COUNT(*) over the table, so only check every N writes
+_EVICTION_CHECK_INTERVAL = 256
+
+def summary_cache_key(code: str, model: str, system_prompt: str) -> str:
+    """
+    Build the cache key for a summary.
+
+    The key covers everything that determines the summary text, so changing
+    the summarizer model or prompt naturally misses the old entries.
+
+    Args:
+        code (str): Code that is being summarized
+        model (str): Summarizer model name
+        system_prompt (str): System prompt sent with the code
+
+    Returns:
+        str: Hex digest identifying the summary
+    """
+    digest = hashlib.sha256()
+    for part in (model, system_prompt, code):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class SummaryCache:
+    def __init__(self, path: str = SUMMARY_CACHE_PATH,
+                 max_entries: int = SUMMARY_CACHE_MAX_ENTRIES):
+        """
+        SQLite backed summary cache with least-recently-used eviction.
+
+        Connections are opened lazily per thread and per process, so a single
+        instance can be shared by worker threads and survives being forked
+        into a multiprocessing pool.
+
+        Args:
+            path (str): Location of the SQLite database file
+            max_entries (int): Maximum number of summaries kept on disk
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return the connection for the current thread, creating it if needed."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS summaries_last_used ON summaries(last_used)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str):
+        """
+        Look up a cached summary.
+
+        Args:
+            key (str): Key built with summary_cache_key
+
+        Returns:
+            str | None: Cached summary, or None on a miss
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, summary: str) -> None:
+        """
+        Store a summary, evicting the least recently used entries when full.
+
+        Args:
+            key (str): Key built with summary_cache_key
+            summary (str): Summary text to store
+        """
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO summaries (key, summary, last_used) VALUES (?, ?, ?)",
+            (key, summary, time.time())
+        )
+        self._writes += 1
+        if self._writes % _EVICTION_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Trim the cache down to max_entries.
+
+        Returns:
+            int: Number of evicted summaries
+        """
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        conn.execute(
+            """DELETE FROM summaries WHERE key IN (
+                SELECT key FROM summaries ORDER BY last_used ASC LIMIT ?
+            )""",
+            (excess,)
+        )
+        return excess
+
+    def clear(self) -> None:
+        """Remove every cached summary."""
+        self._connect().execute("DELETE FROM summaries")
+
+_summary_cache = None
+
+def get_summary_cache() -> SummaryCache:
+    """Return the process-wide summary cache."""
+    global _summary_cache
+    if _summary_cache is None:
+        _summary_cache = SummaryCache()
+    return _summary_cache
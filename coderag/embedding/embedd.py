@@ -1,94 +1,263 @@
 import os
 import sys
-# Add the project root directory to Python path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
-
-import turbopuffer as tpuf
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict
-from coderag.embedding.summarizer import process_directory
-import anthropic
+# Add the package directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from embedding.summarizer import find_python_files, make_doc_id
+from embedding.pipeline import IndexingPipeline
+from embedding.manifest import IndexManifest
+from embedding.lexical import LexicalIndex, reciprocal_rank_fusion
+from embedding.rerank import rerank
+from embedding.search_cache import search_cache, normalize_query, invalidate_file, invalidate_index
+from utils.registry import get_anthropic_client, get_embedding_model, get_vector_store
+from utils.telemetry import metrics, span, propagate, record_usage
 from dotenv import load_dotenv
-from rerankers import Reranker
 
 load_dotenv()
 
-# Get TurboPuffer API key and set base URL
-TURBOPUFFER_API_KEY = os.getenv("TURBOPUFFER_API_KEY")
-tpuf.api_base_url = "https://gcp-us-central1.turbopuffer.com"
+EMBED_BATCH_SIZE = int(os.getenv("CODERAG_EMBED_BATCH_SIZE", "64"))
+UPSERT_MAX_BYTES = int(os.getenv("CODERAG_UPSERT_MAX_BYTES", str(8 * 1024 * 1024)))
+HYBRID_SEARCH = os.getenv("CODERAG_HYBRID_SEARCH", "true").lower() == "true"
+# Candidates fetched from each retriever, as a multiple of the requested results
+SEARCH_CANDIDATE_MULTIPLIER = int(os.getenv("CODERAG_SEARCH_CANDIDATE_MULTIPLIER", "3"))
+
+# Run HyDE speculatively next to the raw-query search, falling back to raw results after the deadline
+HYDE_SPECULATIVE = os.getenv("CODERAG_HYDE_SPECULATIVE", "true").lower() == "true"
+HYDE_TIMEOUT = float(os.getenv("CODERAG_HYDE_TIMEOUT", "3.0"))
+HYDE_CACHE_SIZE = int(os.getenv("CODERAG_HYDE_CACHE_SIZE", "1024"))
+HYDE_MODEL = "claude-3-5-sonnet-20240620"
+
+SEARCH_CACHE_LOOKUPS = metrics.counter("coderag_search_cache_lookups_total",
+                                       "Searches answered from the search cache or computed", ("result",))
+HYDE_TIMEOUTS = metrics.counter("coderag_hyde_timeouts_total", "Searches that fell back to raw query results")
+HYDE_FAILURES = metrics.counter("coderag_hyde_failures_total",
+                                "Speculative searches whose HyDE generation raised, served from raw query results")
+
+# Runs the lexical query and HyDE generation while the vector query is in flight
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="coderag-search")
+
+# Hypothetical answers memoized per normalized query
+_hyde_cache = OrderedDict()
+_hyde_cache_lock = threading.Lock()
+
+def chunk_attributes(chunk: Dict) -> Dict[str, str]:
+    """Flatten a chunk into the string attributes stored next to its vector."""
+    attributes = {
+        "type": chunk["type"] or "",
+        "name": chunk["name"] or "",
+        "file_path": chunk["file_path"] or "",
+        "docstring": chunk["docstring"] or "",
+        "code": chunk["code"] or "",
+        "summary": chunk.get("summary") or ""
+    }
+    
+    # Add additional metadata if it exists
+    if "metadata" in chunk:
+        attributes.update({k: ','.join(v) if isinstance(v, list) else (str(v) if v is not None else "")
+                           for k, v in chunk["metadata"].items()})
+    
+    # Add parameters if it's a function
+    if chunk["type"] == "function":
+        attributes["parameters"] = ','.join(chunk["parameters"]) if chunk.get("parameters") else ""
+    return attributes
+
+def _payload_batches(rows: List[Dict], vectors: List[List[float]], max_payload_bytes: int):
+    """
+    Split rows into contiguous ranges whose estimated request size stays under the limit.
+
+    Yields:
+        tuple: (start, end) slice bounds of each batch
+    """
+    start = 0
+    size = 0
+    for i, (row, vector) in enumerate(zip(rows, vectors)):
+        # Rough JSON size: attribute text plus ~10 bytes per serialized float
+        row_size = sum(len(k) + len(v.encode('utf-8')) for k, v in row.items()) + 10 * len(vector)
+        if i > start and size + row_size > max_payload_bytes:
+            yield start, i
+            start, size = i, 0
+        size += row_size
+    if start < len(rows):
+        yield start, len(rows)
 
 class CodeEmbedder:
     def __init__(self, collection_name: str = "sephora-tiktok-trends", 
-                 model_name: str = "all-MiniLM-L6-v2"):
-        """Initialize TurboPuffer namespace and sentence transformer."""
-        self.namespace = tpuf.Namespace(
-            name=collection_name,
-            api_key=TURBOPUFFER_API_KEY
-        )
-        self.model = SentenceTransformer(model_name)
+                 model_name: str = "all-MiniLM-L6-v2", backend: str = None):
+        """
+        Initialize the vector store namespace and sentence transformer.
 
-    def embed_directory(self, directory_path: str) -> None:
+        Args:
+            collection_name (str): Namespace holding the code chunks
+            model_name (str): SentenceTransformer model used for embeddings
+            backend (str, optional): "turbopuffer" or "local". Defaults to CODERAG_VECTOR_STORE.
+        """
+        self.collection_name = collection_name
+        self.namespace = get_vector_store(collection_name, backend)
+        self.lexical_index = LexicalIndex(collection_name)
+        self.model = get_embedding_model(model_name)
+
+    def close(self) -> None:
+        """Release the lexical index; the model and vector store are shared and stay loaded."""
+        self.lexical_index.close()
+
+    def embed_directory(self, directory_path: str, batch_size: int = EMBED_BATCH_SIZE,
+                        incremental: bool = True) -> Dict[str, List[str]]:
         """
-        Process a directory and embed all code chunks into TurboPuffer.
+        Process a directory and embed its code chunks into the vector store.
+
+        With incremental indexing only files that were added or changed since
+        the last run (according to the index manifest) are chunked and embedded,
+        and vectors of removed or changed files are deleted first.
         
         Args:
             directory_path (str): Path to directory containing Python files
+            batch_size (int): Number of chunks, gathered across files, encoded and upserted together
+            incremental (bool): Only process the files that differ from the manifest
+
+        Returns:
+            Dict[str, List[str]]: Paths that were added, changed, removed or left unchanged
         """
-        # Process all Python files in directory
-        file_chunks = process_directory(directory_path)
-        
-        for file_path, chunks in file_chunks.items():
-            self.embed_chunks(chunks)
-            
-    def embed_chunks(self, chunks: List[Dict]) -> None:
-        """Embed summaries of code chunks into TurboPuffer."""
-        for chunk in chunks:
-            # Debug print to verify summaries
-            print("\n=== Embedding New Chunk ===")
-            print(f"File: {chunk['file_path']}")
-            print(f"Type: {chunk['type']}")
-            print(f"Name: {chunk['name']}")
-            print("Summary:", chunk.get("summary", "NO SUMMARY FOUND"))
-            print("=" * 50)
-            
-            # Create shorter document ID using just filename instead of full path
-            filename = os.path.basename(chunk['file_path'])
-            doc_id = f"{filename}_{chunk['type']}_{chunk['name']}"
-            
-            # If ID is still too long, hash it
-            if len(doc_id.encode('utf-8')) >= 64:
-                import hashlib
-                doc_id = hashlib.md5(doc_id.encode('utf-8')).hexdigest()
-            
-            # Prepare metadata - wrap each value in a list
-            metadata = {
-                "type": [chunk["type"] or ""],
-                "name": [chunk["name"] or ""],
-                "file_path": [chunk["file_path"] or ""],
-                "docstring": [chunk["docstring"] or ""],
-                "code": [chunk["code"] or ""],
-                "summary": [chunk.get("summary", "")]
+        directory_path = os.path.abspath(directory_path)
+        manifest = IndexManifest.for_collection(self.collection_name)
+        py_files = find_python_files(directory_path)
+
+        if incremental:
+            diff = manifest.diff(directory_path, py_files)
+        else:
+            known = [path for path in py_files if path in manifest.files]
+            diff = {
+                "added": [path for path in py_files if path not in manifest.files],
+                "changed": known,
+                "removed": manifest.diff(directory_path, py_files)["removed"],
+                "unchanged": []
             }
+
+        # Drop stale vectors before new ones are written, since chunk IDs can be reused
+        for file_path in diff["removed"] + diff["changed"]:
+            self.delete_file_embeddings(file_path)
+        for file_path in diff["removed"]:
+            manifest.remove(file_path)
+
+        # Stream added and changed files through parse, summarize, encode and upsert
+        pipeline = IndexingPipeline(self, manifest, batch_size=batch_size)
+        try:
+            with span("embedder.index_files", files=len(diff["added"]) + len(diff["changed"])):
+                pipeline.run(diff["added"] + diff["changed"])
+        finally:
+            manifest.save()
+            # New and changed files can match any query; removed ones only stale their own hits
+            if diff["added"] or diff["changed"]:
+                invalidate_index()
+            for file_path in diff["removed"]:
+                invalidate_file(file_path)
+
+        print(
+            f"Indexed {directory_path}: {len(diff['added'])} added, {len(diff['changed'])} changed, "
+            f"{len(diff['removed'])} removed, {len(diff['unchanged'])} unchanged"
+        )
+        return diff
+
+    def delete_file_embeddings(self, file_path: str) -> int:
+        """
+        Delete all embeddings for a specific file.
+
+        Args:
+            file_path (str): Path to the file whose embeddings should be deleted
+
+        Returns:
+            int: Number of deleted rows
+        """
+        self.lexical_index.delete_file(file_path)
+        return self.namespace.delete_by_filter(['file_path', 'Eq', file_path])
+
+    def delete_chunk_embeddings(self, file_path: str, doc_ids: List[str]) -> int:
+        """
+        Delete the embeddings of individual chunks of a file.
+
+        Args:
+            file_path (str): Path of the file the chunks belong to
+            doc_ids (List[str]): Document IDs of the chunks
+
+        Returns:
+            int: Number of deleted rows
+        """
+        if not doc_ids:
+            return 0
+        self.lexical_index.delete_documents(file_path, doc_ids)
+        # IDs are built from the file name only, so also match the path
+        return self.namespace.delete_by_filter(['And', [['id', 'In', list(doc_ids)], ['file_path', 'Eq', file_path]]])
             
-            # Add additional metadata if it exists
-            if "metadata" in chunk:
-                processed_metadata = {k: [','.join(v) if isinstance(v, list) else (str(v) if v is not None else "")]
-                                    for k, v in chunk["metadata"].items()}
-                metadata.update(processed_metadata)
-            
-            # Add parameters if it's a function
-            if chunk["type"] == "function":
-                metadata["parameters"] = [','.join(chunk["parameters"]) if chunk.get("parameters") else ""]
-            
-            # Generate embedding for the summary
-            summary = chunk.get("summary", "")
-            embedding = self.model.encode(summary).tolist()
-            
-            # Individual upsert to TurboPuffer
+    def embed_chunks(self, chunks: List[Dict], batch_size: int = EMBED_BATCH_SIZE,
+                     max_payload_bytes: int = UPSERT_MAX_BYTES) -> List[str]:
+        """
+        Embed summaries of code chunks into the vector store.
+
+        All summaries are encoded in a single batched call and written with one
+        columnar upsert per payload-sized batch.
+
+        Args:
+            chunks (List[Dict]): Chunks produced by the summarizer
+            batch_size (int): Encoder batch size
+            max_payload_bytes (int): Approximate upper bound on the size of one upsert request
+
+        Returns:
+            List[str]: Document IDs of the embedded chunks
+        """
+        if not chunks:
+            return []
+        ids, vectors, rows = self.encode_chunks(chunks, batch_size=batch_size)
+        self.write_chunks(ids, vectors, rows, max_payload_bytes=max_payload_bytes)
+        return ids
+
+    def encode_chunks(self, chunks: List[Dict], batch_size: int = EMBED_BATCH_SIZE):
+        """
+        Encode chunk summaries in one batched call.
+
+        Args:
+            chunks (List[Dict]): Chunks with summaries
+            batch_size (int): Encoder batch size
+
+        Returns:
+            tuple: (ids, vectors, rows) ready for write_chunks
+        """
+        # Chunks sharing an ID overwrote each other when upserted one by one;
+        # keep that last-write-wins behaviour within a single batch
+        chunks = list({make_doc_id(chunk): chunk for chunk in chunks}.values())
+
+        summaries = [chunk.get("summary") or "" for chunk in chunks]
+        with span("embedder.encode", texts=len(summaries)):
+            embeddings = self.model.encode(summaries, batch_size=batch_size)
+
+        ids = [make_doc_id(chunk) for chunk in chunks]
+        rows = [chunk_attributes(chunk) for chunk in chunks]
+        vectors = [embedding.tolist() for embedding in embeddings]
+        return ids, vectors, rows
+
+    def write_chunks(self, ids: List[str], vectors: List[List[float]], rows: List[Dict],
+                     max_payload_bytes: int = UPSERT_MAX_BYTES) -> None:
+        """Upsert encoded chunks, one columnar request per payload-sized batch."""
+        for start, end in _payload_batches(rows, vectors, max_payload_bytes):
+            self._upsert(ids[start:end], vectors[start:end], rows[start:end])
+            with span("lexical.add_documents", documents=end - start):
+                self.lexical_index.add_documents(ids[start:end], rows[start:end])
+
+    def _upsert(self, ids: List[str], vectors: List[List[float]], rows: List[Dict]) -> None:
+        """Write one batch of rows to the vector store as a single columnar upsert."""
+        # Every attribute column must have one value per row
+        columns = sorted({key for row in rows for key in row})
+        attributes = {key: [row.get(key, "") for row in rows] for key in columns}
+
+        print(f"Upserting {len(ids)} chunks to {self.namespace.name}")
+        with span("vector_store.upsert", documents=len(ids)):
             self.namespace.upsert(
-                ids=[doc_id],
-                vectors=[embedding],
-                attributes=metadata,
+                ids=ids,
+                vectors=vectors,
+                attributes=attributes,
                 distance_metric='cosine_distance',
                 schema={
                     "summary": {
@@ -109,71 +278,197 @@ class CodeEmbedder:
         Returns:
             str: Hypothetical code summary
         """
+        key = normalize_query(query)
+        with _hyde_cache_lock:
+            if key in _hyde_cache:
+                _hyde_cache.move_to_end(key)
+                return _hyde_cache[key]
+
         hyde_prompt = f"""Given this question about code: "{query}"
         Write a brief technical summary that would answer this question, as if describing a relevant code snippet.
         Focus on implementation details and keep it concise (2-3 sentences)."""
         
-        client = anthropic.Anthropic()
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20240620",
-            temperature=0,
-            max_tokens=4096,
-            messages=[{"role": "user", "content": hyde_prompt}]
-        )
+        client = get_anthropic_client()
+        with span("embedder.hyde", model=HYDE_MODEL) as current:
+            response = client.messages.create(
+                model=HYDE_MODEL,
+                temperature=0,
+                max_tokens=4096,
+                messages=[{"role": "user", "content": hyde_prompt}]
+            )
+            record_usage(HYDE_MODEL, getattr(response, "usage", None), current)
         
-        return response.content[0].text
+        hypothetical_answer = response.content[0].text
+        with _hyde_cache_lock:
+            _hyde_cache[key] = hypothetical_answer
+            while len(_hyde_cache) > HYDE_CACHE_SIZE:
+                _hyde_cache.popitem(last=False)
+        return hypothetical_answer
     
-    def rerank_documents(self, query: str, docs: List[str]) -> List[int]:
+    def _vector_query(self, text: str, top_k: int):
+        """Encode text and return the closest chunks from the vector store."""
+        with span("embedder.encode", texts=1):
+            query_embedding = self.model.encode(text).tolist()
+        with span("vector_store.query", top_k=top_k):
+            return self.namespace.query(
+                vector=query_embedding,
+                top_k=top_k,
+                distance_metric="cosine_distance",
+                include_attributes=True,
+                include_vectors=False
+            )
+
+    def _lexical_query(self, query: str, top_k: int):
+        with span("lexical.query", top_k=top_k):
+            return self.lexical_index.search(query, top_k)
+
+    def rerank_documents(self, query: str, docs: List[str]) -> List[Tuple[int, float]]:
         """
         Rerank documents based on relevance to the query.
         
         Args:
             query (str): Search query
+            docs (List[str]): Candidate documents
             
         Returns:
-            List[int]: List of reranked indices
-        """
-        ranker = Reranker("answerdotai/answerai-colbert-small-v1", model_type='colbert', verbose=0)
-        # Get the reranked results and convert to list
-        reranked = list(ranker.rank(query=query, docs=docs))
-        # Create a mapping of original positions to new positions
-        original_indices = list(range(len(docs)))
-        return [original_indices[i] for i in range(len(reranked))]
-
-    def search(self, query: str, n_results: int = 7, use_hyde: bool = True) -> Dict:
-        """Search for code chunks using TurboPuffer."""
-        if use_hyde:
+            List[Tuple[int, float]]: (original index, score) pairs, most relevant first
+        """
+        with span("embedder.rerank", documents=len(docs)):
+            return rerank(query, docs)
+
+    def search(self, query: str, n_results: int = 7, use_hyde: bool = True,
+               use_lexical: bool = HYBRID_SEARCH, speculative_hyde: bool = HYDE_SPECULATIVE,
+               hyde_timeout: float = HYDE_TIMEOUT, use_cache: bool = True) -> Dict:
+        """
+        Search for code chunks, answering repeated searches from the search cache.
+
+        Results are cached per normalized query and options, and dropped when
+        a file they contain is re-indexed. Results computed without HyDE
+        because it missed its deadline are not cached.
+
+        Args:
+            query (str): Natural language or identifier query
+            n_results (int): Number of results to return
+            use_hyde (bool): Search with a hypothetical answer to the query
+            use_lexical (bool): Fuse in results from the lexical index
+            speculative_hyde (bool): Run HyDE concurrently with a raw-query search instead of blocking on it
+            hyde_timeout (float): Seconds to wait for HyDE in speculative mode
+            use_cache (bool): Read and populate the search cache
+
+        Returns:
+            Dict: ids, documents, metadatas, distances and rerank scores of
+            the results. Lexical-only hits have a distance of None.
+        """
+        options = {
+            "collection": self.collection_name,
+            "n_results": n_results,
+            "use_hyde": use_hyde,
+            "use_lexical": use_lexical,
+        }
+        if use_cache:
+            cached = search_cache.get(query, **options)
+            SEARCH_CACHE_LOOKUPS.inc(result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
+        version = search_cache.version()
+
+        with span("embedder.search", n_results=n_results, use_hyde=use_hyde, use_lexical=use_lexical):
+            results = self._search(query, n_results, use_hyde, use_lexical, speculative_hyde, hyde_timeout)
+
+        with _hyde_cache_lock:
+            hyde_complete = not use_hyde or normalize_query(query) in _hyde_cache
+        if use_cache and hyde_complete:
+            files = [metadata.get("file_path", "") for metadata in results['metadatas'][0]]
+            search_cache.put(query, results, files, version, **options)
+        return results
+
+    def _search(self, query: str, n_results: int, use_hyde: bool, use_lexical: bool,
+                speculative_hyde: bool, hyde_timeout: float) -> Dict:
+        """
+        Search for code chunks without consulting the search cache.
+
+        The vector query and, when enabled, a BM25 query over identifiers and
+        code run in parallel. Their rankings are merged with reciprocal rank
+        fusion and the fused candidates are reranked.
+
+        With speculative HyDE the raw query is searched immediately while the
+        hypothetical answer is generated; the HyDE results are fused in if
+        they arrive within hyde_timeout seconds, otherwise the raw results
+        are used and the answer is still memoized for the next search. If
+        generating the answer fails, the raw results are used as well.
+
+        Args:
+            query (str): Natural language or identifier query
+            n_results (int): Number of results to return
+            use_hyde (bool): Search with a hypothetical answer to the query
+            use_lexical (bool): Fuse in results from the lexical index
+            speculative_hyde (bool): Run HyDE concurrently with a raw-query search instead of blocking on it
+            hyde_timeout (float): Seconds to wait for HyDE in speculative mode
+
+        Returns:
+            Dict: ids, documents, metadatas, distances and rerank scores of
+            the results. Lexical-only hits have a distance of None.
+        """
+        started = time.monotonic()
+        candidates = n_results * SEARCH_CANDIDATE_MULTIPLIER
+        # Submitted with the current span so their spans land in the same trace
+        lexical_future = (_search_executor.submit(propagate(self._lexical_query), query, candidates)
+                          if use_lexical else None)
+        
+        vector_rankings = []
+        if use_hyde and speculative_hyde:
+            hyde_future = _search_executor.submit(propagate(self.generate_hypothetical_answer), query)
+            raw_results = self._vector_query(query, candidates)
+            hypothetical_answer = None
+            try:
+                remaining = max(0.0, hyde_timeout - (time.monotonic() - started))
+                hypothetical_answer = hyde_future.result(timeout=remaining)
+            except FutureTimeoutError:
+                print(f"HyDE exceeded {hyde_timeout}s, using raw query results")
+                HYDE_TIMEOUTS.inc()
+            except Exception as e:
+                # API, rate limit or auth errors must not fail a search that already has results
+                print(f"HyDE failed ({type(e).__name__}: {e}), using raw query results")
+                HYDE_FAILURES.inc()
+            if hypothetical_answer is not None:
+                vector_rankings.append(self._vector_query(hypothetical_answer, candidates))
+            vector_rankings.append(raw_results)
+        elif use_hyde:
             hypothetical_answer = self.generate_hypothetical_answer(query)
-            query_embedding = self.model.encode(hypothetical_answer).tolist()
+            vector_rankings.append(self._vector_query(hypothetical_answer, candidates))
         else:
-            query_embedding = self.model.encode(query).tolist()
-        
-        # Query TurboPuffer
-        results = self.namespace.query(
-            vector=query_embedding,
-            top_k=n_results,
-            distance_metric="cosine_distance",
-            include_attributes=True,
-            include_vectors=False
-        )
+            vector_rankings.append(self._vector_query(query, candidates))
         
-        # print(results)
+        hits = {}
+        rankings = []
+        for results in vector_rankings:
+            for result in results:
+                attributes, dist = hits.get(result.id, (result.attributes, result.dist))
+                hits[result.id] = (attributes, min(dist, result.dist))
+            rankings.append([result.id for result in results])
+        if lexical_future is not None:
+            lexical_results = lexical_future.result()
+            for doc_id, _, attributes in lexical_results:
+                hits.setdefault(doc_id, (attributes, None))
+            rankings.append([doc_id for doc_id, _, _ in lexical_results])
         
-        # Extract data from results
-        docs = [result.attributes.get("summary", [""])[0] for result in results]
-        ids = [result.id for result in results]
-        attributes = [result.attributes for result in results]
-        distances = [result.dist for result in results]
+        # Extract data from the fused results
+        ids = reciprocal_rank_fusion(rankings)[:candidates]
+        attributes = [hits[doc_id][0] for doc_id in ids]
+        distances = [hits[doc_id][1] for doc_id in ids]
+        docs = [attrs.get("summary", "") for attrs in attributes]
         
         # Rerank the documents
-        reranked_indices = self.rerank_documents(query, docs)
+        reranked = self.rerank_documents(query, docs)[:n_results]
+        reranked_indices = [i for i, _ in reranked]
         
         # Reorder results
         return {
             'ids': [ids[i] for i in reranked_indices],
             'documents': [[docs[i] for i in reranked_indices]],
             'metadatas': [[attributes[i] for i in reranked_indices]],
-            'distances': [distances[i] for i in reranked_indices]
+            'distances': [distances[i] for i in reranked_indices],
+            'scores': [score for _, score in reranked]
         }
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+"""Chunk-level re-indexing of a single modified file."""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from utils.parser import parser, read_source, reparse, get_structure_cache
+from embedding.summarizer import chunk_tree, summarize_chunks, make_doc_id
+from embedding.manifest import IndexManifest
+from embedding.embedd import chunk_attributes
+
+# Files whose last indexed tree and chunks are kept in memory
+INCREMENTAL_STATE_SIZE = int(os.getenv("CODERAG_INCREMENTAL_STATE_SIZE", "64"))
+
+class FileState:
+    """A file as it was last parsed: its content, tree and chunk fingerprints."""
+    __slots__ = ("content_hash", "code_bytes", "tree", "fingerprints")
+
+    def __init__(self, content_hash: str, code_bytes: bytes, tree, fingerprints: Dict[str, Dict]):
+        self.content_hash = content_hash
+        self.code_bytes = code_bytes
+        self.tree = tree
+        self.fingerprints = fingerprints
+
+_states = OrderedDict()
+_states_lock = threading.Lock()
+
+def _fingerprints(chunks) -> Dict[str, Dict]:
+    """
+    Map each chunk's document ID to the attributes stored for it, minus the summary and how it was made.
+
+    Chunks with equal fingerprints produce identical rows in the index, so
+    only chunks whose fingerprint changed have to be written again.
+    """
+    fingerprints = {}
+    for chunk in chunks:
+        attributes = chunk_attributes(chunk)
+        del attributes["summary"]
+        attributes.pop("summary_policy", None)
+        fingerprints[make_doc_id(chunk)] = attributes
+    return fingerprints
+
+def _remember(file_path: str, state: FileState) -> None:
+    with _states_lock:
+        _states[file_path] = state
+        _states.move_to_end(file_path)
+        while len(_states) > INCREMENTAL_STATE_SIZE:
+            _states.popitem(last=False)
+
+def snapshot_file(file_path: str, defer_parse: bool = False):
+    """
+    Capture a file's current state before it is overwritten.
+
+    The state kept from the last edit is reused when the file has not changed
+    since; otherwise the file is parsed and chunked (without summarizing).
+
+    Args:
+        file_path (str): Absolute path of the file
+        defer_parse (bool): Only read the file now and leave parsing to reindex_file,
+            keeping the snapshot as cheap as a read
+
+    Returns:
+        FileState: State of the file on disk, or None if it does not exist
+    """
+    if not os.path.exists(file_path):
+        return None
+    content_hash, code_bytes = read_source(file_path)
+    # Taken out of the cache, since reindex_file edits the tree in place
+    with _states_lock:
+        state = _states.pop(file_path, None)
+    if state is not None and state.content_hash == content_hash:
+        return state
+    if defer_parse:
+        return FileState(content_hash, code_bytes, None, None)
+    return _parse_state(file_path, content_hash, code_bytes)
+
+def _parse_state(file_path: str, content_hash: str, code_bytes: bytes) -> FileState:
+    tree = parser.parse(code_bytes)
+    chunks, _ = chunk_tree(file_path, code_bytes, tree)
+    return FileState(content_hash, code_bytes, tree, _fingerprints(chunks))
+
+def reindex_file(embedder, file_path: str, previous: FileState = None) -> Dict[str, int]:
+    """
+    Bring the index of one file up to date after it was rewritten.
+
+    The new content is reparsed incrementally from the previous tree, and
+    chunks are matched to the previous ones by document ID. Only chunks that
+    are new or whose stored attributes changed are summarized, encoded and
+    upserted; chunks that disappeared are deleted by ID. Everything else
+    keeps its vector. Chunks that only moved reuse their cached summary, so
+    the number of LLM calls equals the number of chunks whose code changed.
+
+    If the index does not hold exactly the previous version of the file
+    (per the manifest), all of the file's rows are replaced instead.
+
+    Args:
+        embedder (CodeEmbedder): Embedder owning the indexes
+        file_path (str): Absolute path of the rewritten file
+        previous (FileState, optional): State returned by snapshot_file before the write
+
+    Returns:
+        Dict[str, int]: Number of chunks in the file, and of chunks written and deleted
+    """
+    manifest = IndexManifest.for_collection(embedder.collection_name)
+    entry = manifest.files.get(file_path)
+    if previous is not None and previous.tree is None:
+        previous = _parse_state(file_path, previous.content_hash, previous.code_bytes)
+
+    stat = os.stat(file_path)
+    content_hash, code_bytes = read_source(file_path)
+    if previous is not None:
+        tree = reparse(code_bytes, previous.code_bytes, previous.tree)
+    else:
+        tree = parser.parse(code_bytes)
+    chunks, record = chunk_tree(file_path, code_bytes, tree)
+    get_structure_cache().put(file_path, stat, content_hash, record)
+
+    current = {make_doc_id(chunk): chunk for chunk in chunks}
+    fingerprints = _fingerprints(current.values())
+
+    # The previous chunks are only a valid baseline if they are what the index holds
+    if previous is not None and entry is not None and entry["hash"] == previous.content_hash:
+        dirty = [chunk for doc_id, chunk in current.items()
+                 if previous.fingerprints.get(doc_id) != fingerprints[doc_id]]
+        stale = (set(entry.get("chunk_ids", [])) | set(previous.fingerprints)) - set(current)
+        deleted = embedder.delete_chunk_embeddings(file_path, sorted(stale))
+    else:
+        dirty = list(current.values())
+        deleted = embedder.delete_file_embeddings(file_path)
+
+    summarize_chunks(dirty)
+    failed = [make_doc_id(chunk) for chunk in dirty if chunk["summary"] is None]
+    embedder.embed_chunks([chunk for chunk in dirty if chunk["summary"] is not None])
+
+    if failed:
+        # Drop the outdated rows and leave the file out of the manifest, so the next index run retries it
+        embedder.delete_chunk_embeddings(file_path, failed)
+        manifest.remove(file_path)
+    else:
+        manifest.record(file_path, list(current))
+    manifest.save()
+    _remember(file_path, FileState(content_hash, code_bytes, tree, fingerprints))
+
+    return {"chunks": len(current), "written": len(dirty) - len(failed), "deleted": deleted}
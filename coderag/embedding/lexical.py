@@ -0,0 +1,205 @@
+"""Local BM25 index over code identifiers, call sites, docstrings and code tokens."""
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from embedding.cache import CODERAG_CACHE_DIR
+
+LEXICAL_INDEX_DIR = os.getenv("CODERAG_LEXICAL_INDEX_DIR", os.path.join(CODERAG_CACHE_DIR, "lexical"))
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+# How many times a field's tokens are counted, so a name match outranks a code mention
+_FIELD_WEIGHTS = {
+    "name": 3,
+    "function_calls": 2,
+    "class_instances": 2,
+    "parameters": 2,
+    "docstring": 1,
+    "code": 1,
+}
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase search terms.
+
+    Each identifier is kept whole and also broken into its snake_case and
+    camelCase parts, so `delete_file_embeddings` matches both the exact name
+    and a query for "embeddings".
+    """
+    tokens = []
+    for identifier in _IDENTIFIER.findall(text or ""):
+        lowered = identifier.lower()
+        tokens.append(lowered)
+        parts = [part.lower() for piece in identifier.split("_") for part in _CAMEL_PART.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+def document_terms(attributes: Dict[str, str]) -> Counter:
+    """Return weighted term frequencies of a chunk's attributes."""
+    terms = Counter()
+    for field, weight in _FIELD_WEIGHTS.items():
+        for token in tokenize(attributes.get(field, "")):
+            terms[token] += weight
+    return terms
+
+class LexicalIndex:
+    def __init__(self, name: str, directory: str = LEXICAL_INDEX_DIR):
+        """
+        BM25 inverted index persisted in SQLite.
+
+        Documents are stored with their attributes so lexical-only hits can be
+        returned without a round-trip to the vector store.
+
+        Args:
+            name (str): Namespace name, used as the database file name
+            directory (str): Directory holding the lexical indexes
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """CREATE TABLE IF NOT EXISTS docs (
+                doc_id TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                attributes TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS docs_file_path ON docs(file_path);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc_id TEXT NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc_id ON postings(doc_id);"""
+        )
+
+    def _remove_docs(self, doc_ids: List[str]) -> None:
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._db.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", batch)
+            self._db.execute(f"DELETE FROM docs WHERE doc_id IN ({placeholders})", batch)
+
+    def add_documents(self, ids: List[str], rows: List[Dict[str, str]]) -> None:
+        """
+        Index documents, replacing any previous version with the same ID.
+
+        Args:
+            ids (List[str]): Document IDs, as used in the vector store
+            rows (List[Dict[str, str]]): Flattened chunk attributes
+        """
+        docs = []
+        postings = []
+        for doc_id, row in zip(ids, rows):
+            terms = document_terms(row)
+            docs.append((doc_id, row.get("file_path", ""), sum(terms.values()), json.dumps(row)))
+            postings.extend((term, doc_id, tf) for term, tf in terms.items())
+        with self._lock, self._db:
+            self._remove_docs(list(ids))
+            self._db.executemany("INSERT INTO docs (doc_id, file_path, length, attributes) VALUES (?, ?, ?, ?)", docs)
+            self._db.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)", postings)
+
+    def delete_documents(self, file_path: str, doc_ids: List[str]) -> int:
+        """
+        Remove documents of a file by ID.
+
+        Returns:
+            int: Number of removed documents
+        """
+        wanted = set(doc_ids)
+        with self._lock, self._db:
+            doc_ids = [doc_id for (doc_id,) in self._db.execute(
+                "SELECT doc_id FROM docs WHERE file_path = ?", (file_path,)) if doc_id in wanted]
+            self._remove_docs(doc_ids)
+        return len(doc_ids)
+
+    def delete_file(self, file_path: str) -> int:
+        """
+        Remove every document of a file.
+
+        Returns:
+            int: Number of removed documents
+        """
+        with self._lock, self._db:
+            doc_ids = [doc_id for (doc_id,) in self._db.execute(
+                "SELECT doc_id FROM docs WHERE file_path = ?", (file_path,))]
+            self._remove_docs(doc_ids)
+        return len(doc_ids)
+
+    def close(self) -> None:
+        """Close the database connection."""
+        self._db.close()
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float, Dict]]:
+        """
+        Rank documents against a query with BM25.
+
+        Args:
+            query (str): Free text or identifier query
+            top_k (int): Number of results
+
+        Returns:
+            List[Tuple[str, float, Dict]]: (doc_id, score, attributes), best first
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            num_docs, avg_length = self._db.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not num_docs:
+                return []
+
+            scores = Counter()
+            for term in terms:
+                postings = self._db.execute(
+                    "SELECT postings.doc_id, postings.tf, docs.length FROM postings "
+                    "JOIN docs ON docs.doc_id = postings.doc_id WHERE postings.term = ?",
+                    (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf, length in postings:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            best = scores.most_common(top_k)
+            if not best:
+                return []
+            placeholders = ",".join("?" * len(best))
+            attributes = dict(self._db.execute(
+                f"SELECT doc_id, attributes FROM docs WHERE doc_id IN ({placeholders})",
+                [doc_id for doc_id, _ in best]
+            ))
+        return [(doc_id, score, json.loads(attributes[doc_id])) for doc_id, score in best]
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """
+    Merge several rankings of document IDs.
+
+    Args:
+        rankings (List[List[str]]): Document IDs, best first, one list per retriever
+        k (int): Damping constant; larger values flatten the contribution of top ranks
+
+    Returns:
+        List[str]: Document IDs ordered by fused score
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return [doc_id for doc_id, _ in scores.most_common()]
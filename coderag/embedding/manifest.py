@@ -0,0 +1,101 @@
+"""Persisted record of which files are in the index and the chunks they produced."""
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+from embedding.cache import CODERAG_CACHE_DIR
+
+MANIFEST_DIR = os.getenv("CODERAG_MANIFEST_DIR", os.path.join(CODERAG_CACHE_DIR, "manifests"))
+
+def file_content_hash(file_path: str) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class IndexManifest:
+    def __init__(self, path: str):
+        """
+        Index manifest stored as JSON.
+
+        Each entry maps a file path to its size, mtime, content hash and the
+        IDs of the chunks that were upserted for it.
+
+        Args:
+            path (str): Location of the manifest file
+        """
+        self.path = path
+        self.files: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.files = json.load(file).get("files", {})
+
+    @classmethod
+    def for_collection(cls, collection_name: str) -> "IndexManifest":
+        """Load the manifest belonging to a vector namespace."""
+        return cls(os.path.join(MANIFEST_DIR, f"{collection_name}.json"))
+
+    def diff(self, directory_path: str, file_paths: List[str]) -> Dict[str, List[str]]:
+        """
+        Compare the files currently on disk with the manifest.
+
+        Size and mtime are checked first; the content hash is only computed
+        when they differ, so touched-but-identical files are not re-indexed.
+
+        Args:
+            directory_path (str): Directory that was walked
+            file_paths (List[str]): Python files currently in the directory
+
+        Returns:
+            Dict[str, List[str]]: Paths grouped into added, changed, removed and unchanged
+        """
+        result = {"added": [], "changed": [], "removed": [], "unchanged": []}
+        current = set(file_paths)
+
+        for file_path in file_paths:
+            entry = self.files.get(file_path)
+            if entry is None:
+                result["added"].append(file_path)
+                continue
+            stat = os.stat(file_path)
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                result["unchanged"].append(file_path)
+            elif entry["hash"] == file_content_hash(file_path):
+                # Content is identical, just remember the new stat
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+                result["unchanged"].append(file_path)
+            else:
+                result["changed"].append(file_path)
+
+        prefix = os.path.join(directory_path, "")
+        for file_path in self.files:
+            if file_path.startswith(prefix) and file_path not in current:
+                result["removed"].append(file_path)
+        return result
+
+    def record(self, file_path: str, chunk_ids: List[str]) -> None:
+        """Store the current state of a file after it has been indexed."""
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": file_content_hash(file_path),
+            "chunk_ids": chunk_ids
+        }
+
+    def remove(self, file_path: str) -> None:
+        """Forget a file that is no longer indexed."""
+        self.files.pop(file_path, None)
+
+    def save(self) -> None:
+        """Atomically write the manifest to disk."""
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"files": self.files}, file)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,222 @@
+"""Streaming parse -> summarize -> encode -> upsert indexing pipeline."""
+import asyncio
+import os
+import queue
+import threading
+from typing import List
+
+import anthropic
+
+from embedding.summarizer import (
+    process_file,
+    summarize_chunks_async,
+    make_summary_limiter,
+    make_doc_id
+)
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("CODERAG_PIPELINE_QUEUE_SIZE", "32"))
+PIPELINE_PARSE_WORKERS = int(os.getenv("CODERAG_PIPELINE_PARSE_WORKERS", "4"))
+PIPELINE_FLUSH_INTERVAL = float(os.getenv("CODERAG_PIPELINE_FLUSH_INTERVAL", "1.0"))
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class IndexingPipeline:
+    def __init__(self, embedder, manifest, batch_size: int, queue_size: int = PIPELINE_QUEUE_SIZE,
+                 parse_workers: int = PIPELINE_PARSE_WORKERS, max_concurrency: int = None,
+                 flush_interval: float = PIPELINE_FLUSH_INTERVAL):
+        """
+        Index files by streaming them through four stages connected by bounded queues.
+
+        Files are parsed by a pool of threads, summarized concurrently on an
+        event loop, encoded in batches and upserted as soon as a batch is
+        ready. Every queue is bounded, so a slow stage blocks the ones before
+        it and peak memory depends on the queue sizes rather than the repo size.
+
+        Args:
+            embedder (CodeEmbedder): Embedder used for encoding and upserts
+            manifest (IndexManifest): Manifest updated as files land in the index
+            batch_size (int): Number of chunks encoded and upserted together
+            queue_size (int): Capacity of each inter-stage queue, in files
+            parse_workers (int): Number of parsing threads
+            max_concurrency (int, optional): Maximum summary calls in flight
+            flush_interval (float): Seconds to wait for more files before writing a partial batch
+        """
+        self.embedder = embedder
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.parse_workers = max(1, parse_workers)
+        self.max_concurrency = max_concurrency
+        self.flush_interval = flush_interval
+
+        self._parsed = queue.Queue(maxsize=queue_size)
+        self._summarized = queue.Queue(maxsize=queue_size)
+        self._encoded = queue.Queue(maxsize=max(1, queue_size // 4))
+        self._stop = threading.Event()
+        self._errors: List[Exception] = []
+        self.indexed_files: List[str] = []
+
+    def run(self, file_paths: List[str]) -> List[str]:
+        """
+        Index the given files and block until every stage has finished.
+
+        Args:
+            file_paths (List[str]): Files to chunk, summarize and embed
+
+        Returns:
+            List[str]: Files that were fully written to the index
+        """
+        if not file_paths:
+            return []
+
+        files = queue.Queue()
+        for file_path in file_paths:
+            files.put(file_path)
+
+        parsers = [
+            threading.Thread(target=self._guard, args=(self._parse_stage, files), daemon=True)
+            for _ in range(self.parse_workers)
+        ]
+        stages = parsers + [
+            threading.Thread(target=self._guard, args=(self._summarize_stage, len(parsers)), daemon=True),
+            threading.Thread(target=self._guard, args=(self._encode_stage,), daemon=True),
+            threading.Thread(target=self._guard, args=(self._upsert_stage,), daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+
+        if self._errors:
+            raise self._errors[0]
+        return self.indexed_files
+
+    def _guard(self, stage, *args) -> None:
+        """Run a stage, stopping the whole pipeline if it fails."""
+        try:
+            stage(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+            # Unblock neighbours waiting on a full or empty queue
+            for q in (self._parsed, self._summarized, self._encoded):
+                try:
+                    q.put_nowait(_DONE)
+                except queue.Full:
+                    pass
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        """Blocking put that gives up once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue, timeout: float = 0.1):
+        """Blocking get that returns _DONE once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=timeout)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _parse_stage(self, files: queue.Queue) -> None:
+        """Parse and chunk files without summarizing them."""
+        try:
+            while not self._stop.is_set():
+                try:
+                    file_path = files.get_nowait()
+                except queue.Empty:
+                    break
+                file_path, chunks = process_file(file_path, summarize=False)
+                if not self._put(self._parsed, (file_path, chunks)):
+                    break
+        finally:
+            self._put(self._parsed, _DONE)
+
+    def _summarize_stage(self, num_parsers: int) -> None:
+        """Summarize the chunks of many files concurrently on a private event loop."""
+        asyncio.run(self._summarize_files(num_parsers))
+
+    async def _summarize_files(self, num_parsers: int) -> None:
+        loop = asyncio.get_running_loop()
+        limiter = make_summary_limiter(self.max_concurrency)
+        client = anthropic.AsyncAnthropic(max_retries=0)
+        # Bound the number of files held by this stage
+        in_flight = asyncio.Semaphore(self.queue_size)
+        tasks = set()
+
+        async def summarize_file(file_path, chunks):
+            try:
+                await summarize_chunks_async(chunks, limiter, client)
+                if any(chunk["summary"] is None for chunk in chunks):
+                    # Left out of the manifest so the next run retries it
+                    print(f"Skipping {file_path}: not every chunk could be summarized")
+                    return
+                await loop.run_in_executor(None, self._put, self._summarized, (file_path, chunks))
+            finally:
+                in_flight.release()
+
+        finished_parsers = 0
+        try:
+            while finished_parsers < num_parsers and not self._stop.is_set():
+                item = await loop.run_in_executor(None, self._get, self._parsed)
+                if item is _DONE:
+                    finished_parsers += 1
+                    continue
+                await in_flight.acquire()
+                task = asyncio.create_task(summarize_file(*item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            await loop.run_in_executor(None, self._put, self._summarized, _DONE)
+
+    def _encode_stage(self) -> None:
+        """Group summarized files into batches and encode each batch in one call."""
+        pending = []
+
+        def flush():
+            chunks = [chunk for _, file_chunks in pending for chunk in file_chunks]
+            files = [(file_path, file_chunks) for file_path, file_chunks in pending]
+            encoded = self.embedder.encode_chunks(chunks, batch_size=self.batch_size) if chunks else None
+            pending.clear()
+            return self._put(self._encoded, (files, encoded))
+
+        try:
+            while not self._stop.is_set():
+                try:
+                    item = self._summarized.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    # Nothing new arrived, write what we have so it becomes searchable
+                    if pending and not flush():
+                        break
+                    continue
+                if item is _DONE:
+                    if pending:
+                        flush()
+                    break
+                pending.append(item)
+                if sum(len(chunks) for _, chunks in pending) >= self.batch_size and not flush():
+                    break
+        finally:
+            self._put(self._encoded, _DONE)
+
+    def _upsert_stage(self) -> None:
+        """Write encoded batches and record their files in the manifest."""
+        while not self._stop.is_set():
+            item = self._get(self._encoded)
+            if item is _DONE:
+                break
+            files, encoded = item
+            if encoded:
+                self.embedder.write_chunks(*encoded)
+            for file_path, chunks in files:
+                self.manifest.record(file_path, [make_doc_id(chunk) for chunk in chunks])
+                self.indexed_files.append(file_path)
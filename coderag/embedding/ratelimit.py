@@ -0,0 +1,89 @@
+"""Concurrency, rate limiting and retry policy for async LLM calls."""
+import asyncio
+import random
+import time
+
+import anthropic
+
+# HTTP statuses Anthropic uses for "rate limited" and "overloaded"
+RETRYABLE_STATUS_CODES = (429, 529)
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        """
+        Async token bucket.
+
+        Args:
+            rate_per_minute (float): Sustained number of acquisitions per minute
+            capacity (float, optional): Burst size. Defaults to one second worth of tokens, at least 1.
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _is_retryable(error: Exception) -> bool:
+    """Check whether an API error is a rate limit or overload response."""
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, anthropic.APIConnectionError)
+
+class AsyncCallLimiter:
+    def __init__(self, max_concurrency: int, requests_per_minute: float = 0,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        """
+        Bound the number of in-flight calls, their rate, and retry throttled ones.
+
+        Must be created and used inside a single event loop.
+
+        Args:
+            max_concurrency (int): Maximum number of calls in flight at once
+            requests_per_minute (float): Request rate limit, 0 disables it
+            max_retries (int): Retries on 429/529 and connection errors
+            base_delay (float): Backoff before the first retry in seconds
+            max_delay (float): Upper bound on a single backoff in seconds
+        """
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    async def call(self, func, *args, **kwargs):
+        """
+        Run an async API call under the limits, retrying with jittered backoff.
+
+        Args:
+            func: Coroutine function performing the call
+            *args, **kwargs: Arguments forwarded to func
+
+        Returns:
+            Whatever func returns
+        """
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                if self._bucket:
+                    await self._bucket.acquire()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+            # Full jitter: sleep outside the semaphore so other calls can proceed
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,188 @@
+"""Background re-indexing of files written by the agent, debounced per file."""
+import os
+import threading
+import time
+from typing import Iterable, Set
+
+from utils.registry import get_code_embedder
+from embedding.incremental import reindex_file
+from embedding.search_cache import invalidate_file, invalidate_index
+from utils.telemetry import span
+
+# Seconds a file must go without writes before it is re-indexed
+REINDEX_DEBOUNCE = float(os.getenv("CODERAG_REINDEX_DEBOUNCE", "0.5"))
+# Upper bound on how long repeated writes can postpone a file's re-index
+REINDEX_MAX_DELAY = float(os.getenv("CODERAG_REINDEX_MAX_DELAY", "5.0"))
+
+class _Job:
+    __slots__ = ("previous", "is_new", "first", "due")
+
+    def __init__(self, previous, is_new: bool, first: float):
+        self.previous = previous
+        self.is_new = is_new
+        self.first = first
+        self.due = first
+
+class ReindexQueue:
+    def __init__(self, debounce: float = REINDEX_DEBOUNCE, max_delay: float = REINDEX_MAX_DELAY):
+        """
+        Re-index written files on a background thread instead of in the write tool.
+
+        A write enqueues its file and returns. Writes to the same file within
+        the debounce window are coalesced into one re-index, diffed against
+        the state from before the first of them (which is what the index
+        still holds). Files are re-indexed one at a time, in due order.
+
+        A file is dirty from its first queued write until its re-index has
+        finished. flush() waits for dirty files, so readers of the index only
+        pay for pending work they actually depend on.
+
+        Args:
+            debounce (float): Quiet period after a write before the file is re-indexed
+            max_delay (float): Longest time a file can stay queued under continuous writes
+        """
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._jobs = {}
+        self._running = None
+        self._running_is_new = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def needs_snapshot(self, file_path: str) -> bool:
+        """Whether a write to file_path must capture the previous state, i.e. none is queued yet."""
+        with self._cond:
+            return file_path not in self._jobs
+
+    def enqueue(self, file_path: str, previous=None, is_new: bool = False) -> None:
+        """
+        Queue a re-index of a file that was just written.
+
+        Args:
+            file_path (str): Absolute path of the written file
+            previous (FileState, optional): Snapshot taken before the write; ignored if
+                the file is already queued, since the queued snapshot is the older baseline
+            is_new (bool): The file did not exist before, so any search could now match it
+        """
+        with self._cond:
+            now = time.monotonic()
+            job = self._jobs.get(file_path)
+            if job is None:
+                job = self._jobs[file_path] = _Job(previous, is_new, now)
+            job.is_new = job.is_new or is_new
+            job.due = min(now + self.debounce, job.first + self.max_delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="coderag-reindex", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _dirty(self) -> Set[str]:
+        dirty = set(self._jobs)
+        if self._running is not None:
+            dirty.add(self._running)
+        return dirty
+
+    def dirty_files(self) -> Set[str]:
+        """Files whose index does not reflect their last write yet."""
+        with self._cond:
+            return self._dirty()
+
+    def new_files(self) -> Set[str]:
+        """Dirty files that are not in the index at all yet."""
+        with self._cond:
+            new = {file_path for file_path, job in self._jobs.items() if job.is_new}
+            if self._running is not None and self._running_is_new:
+                new.add(self._running)
+            return new
+
+    def flush(self, file_paths: Iterable[str] = None, timeout: float = None) -> bool:
+        """
+        Re-index the given dirty files (all by default) now and wait until they are done.
+
+        Args:
+            file_paths (Iterable[str], optional): Files to wait for
+            timeout (float, optional): Seconds to wait at most
+
+        Returns:
+            bool: True if none of the files is dirty anymore
+        """
+        with self._cond:
+            targets = self._dirty() if file_paths is None else set(file_paths)
+            for file_path in targets:
+                job = self._jobs.get(file_path)
+                if job is not None:
+                    job.due = 0
+            self._cond.notify_all()
+            with span("reindex.flush", files=len(targets)):
+                return self._cond.wait_for(lambda: not (targets & self._dirty()), timeout)
+
+    def close(self, timeout: float = None) -> None:
+        """Re-index everything still queued and stop the worker."""
+        with self._cond:
+            self._closed = True
+            thread = self._thread
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+    def _next_job(self):
+        """Wait for the next due job and mark it running; None once closed and drained."""
+        with self._cond:
+            while True:
+                if not self._jobs:
+                    if self._closed:
+                        self._thread = None
+                        return None
+                    self._cond.wait()
+                    continue
+                file_path, job = min(self._jobs.items(), key=lambda item: item[1].due)
+                delay = job.due - time.monotonic()
+                if delay <= 0 or self._closed:
+                    del self._jobs[file_path]
+                    self._running, self._running_is_new = file_path, job.is_new
+                    return file_path, job
+                self._cond.wait(delay)
+
+    def _run(self) -> None:
+        while True:
+            next_job = self._next_job()
+            if next_job is None:
+                return
+            file_path, job = next_job
+            try:
+                with span("reindex.file"):
+                    self._reindex(file_path, job)
+            except Exception as e:
+                print(f"Error re-indexing {file_path}: {str(e)}")
+            finally:
+                with self._cond:
+                    self._running = None
+                    self._running_is_new = False
+                    self._cond.notify_all()
+
+    @staticmethod
+    def _reindex(file_path: str, job: _Job) -> None:
+        embedder = get_code_embedder()
+        if not os.path.exists(file_path):
+            embedder.delete_file_embeddings(file_path)
+            invalidate_file(file_path)
+            return
+        stats = reindex_file(embedder, file_path, job.previous)
+        # New or re-embedded code can match any cached search, not only those that returned the file
+        if job.is_new or stats["written"]:
+            invalidate_index()
+        else:
+            invalidate_file(file_path)
+        print(f"Re-indexed {file_path}: {stats['written']} of {stats['chunks']} chunks written, "
+              f"{stats['deleted']} deleted")
+
+reindex_queue = ReindexQueue()
+
+def queue_reindex(file_path: str, previous=None, is_new: bool = False) -> None:
+    """Queue a background re-index of a file the agent just wrote."""
+    reindex_queue.enqueue(file_path, previous, is_new)
+
+def flush_reindex(file_paths: Iterable[str] = None, timeout: float = None) -> bool:
+    """Wait until the given files (all by default) are re-indexed."""
+    return reindex_queue.flush(file_paths, timeout)
@@ -0,0 +1,33 @@
+"""Process-wide ColBERT reranker."""
+import os
+import threading
+from typing import List, Tuple
+
+from dotenv import load_dotenv
+
+from utils.registry import get_reranker
+
+load_dotenv()
+
+RERANKER_MODEL = os.getenv("CODERAG_RERANKER_MODEL", "answerdotai/answerai-colbert-small-v1")
+
+# Serializes forward passes through the shared model
+_rank_lock = threading.Lock()
+
+def rerank(query: str, docs: List[str]) -> List[Tuple[int, float]]:
+    """
+    Rerank documents against a query.
+
+    Args:
+        query (str): Search query
+        docs (List[str]): Candidate documents
+
+    Returns:
+        List[Tuple[int, float]]: (index into docs, score), most relevant first
+    """
+    if not docs:
+        return []
+    ranker = get_reranker()
+    with _rank_lock:
+        ranked = ranker.rank(query=query, docs=docs, doc_ids=list(range(len(docs))))
+    return [(result.document.doc_id, result.score) for result in ranked.results]
@@ -0,0 +1,126 @@
+"""LRU cache of search results, invalidated by index generation counters."""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+SEARCH_CACHE_SIZE = int(os.getenv("CODERAG_SEARCH_CACHE_SIZE", "256"))
+
+def normalize_query(query: str) -> str:
+    """Lowercase a query and collapse its whitespace."""
+    return " ".join(query.lower().split())
+
+class SearchCache:
+    def __init__(self, max_entries: int = SEARCH_CACHE_SIZE):
+        """
+        Search result cache keyed by normalized query, search options and index generation.
+
+        Every file has a generation counter, and the index as a whole has
+        one too. A cached result remembers the generation of each file it
+        returned; bumping a file drops exactly the results that contain it
+        (the file was deleted), while bumping the index (new or re-embedded
+        code, full re-index) drops everything since any query could now
+        match something new, including queries that never returned the file.
+
+        Args:
+            max_entries (int): Maximum number of cached results
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._keys_by_file: Dict[str, set] = {}
+        self._file_generations: Dict[str, int] = {}
+        self.index_generation = 0
+        # Incremented on every invalidation, so results computed across one are not cached
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _key(self, query: str, options: Dict):
+        return (normalize_query(query), tuple(sorted(options.items())), self.index_generation)
+
+    def version(self) -> int:
+        """Return a token to pass to put, taken before a search starts."""
+        return self._version
+
+    def get(self, query: str, **options):
+        """
+        Return the cached result of a search, or None on a miss.
+
+        Args:
+            query (str): Search query
+            **options: Every search option that affects the result
+        """
+        with self._lock:
+            key = self._key(query, options)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, file_generations = entry
+            if any(self._file_generations.get(path, 0) != generation
+                   for path, generation in file_generations.items()):
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, query: str, result: Dict, files: Iterable[str], version: int, **options) -> None:
+        """
+        Cache a search result.
+
+        Args:
+            query (str): Search query
+            result (Dict): Search result
+            files (Iterable[str]): Files the result's chunks come from
+            version (int): Value of version() when the search started
+            **options: Every search option that affects the result
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if version != self._version:
+                # The index changed while this search ran
+                return
+            key = self._key(query, options)
+            files = set(files)
+            self._entries[key] = (result, {path: self._file_generations.get(path, 0) for path in files})
+            self._entries.move_to_end(key)
+            for path in files:
+                self._keys_by_file.setdefault(path, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for path in entry[1]:
+            keys = self._keys_by_file.get(path)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_file[path]
+
+    def invalidate_file(self, file_path: str) -> None:
+        """Bump a file's generation and drop the cached results that include it."""
+        with self._lock:
+            self._file_generations[file_path] = self._file_generations.get(file_path, 0) + 1
+            self._version += 1
+            for key in list(self._keys_by_file.get(file_path, ())):
+                self._drop(key)
+
+    def invalidate_index(self) -> None:
+        """Bump the index generation, dropping every cached result."""
+        with self._lock:
+            self.index_generation += 1
+            self._version += 1
+            self._entries.clear()
+            self._keys_by_file.clear()
+
+search_cache = SearchCache()
+
+def invalidate_file(file_path: str) -> None:
+    """Drop cached searches that returned chunks from file_path, e.g. after it was deleted."""
+    search_cache.invalidate_file(file_path)
+
+def invalidate_index() -> None:
+    """Drop every cached search, e.g. after files were added to the index or re-embedded."""
+    search_cache.invalidate_index()
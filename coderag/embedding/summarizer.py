@@ -1,20 +1,123 @@
 """Module for chunking and summarizing Python code at class and function levels."""
 import sys
 import os
-from multiprocessing import Pool
+import asyncio
+import hashlib
 import glob
 
+import anthropic
+
 # Get the parent directory and add it to sys.path
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(parent_dir)
 
 from utils.parser import (
-    PY_LANGUAGE,
     parser,
     get_node_text,
-    get_docstring
+    read_source,
+    extract_symbols,
+    names_in_range,
+    get_structure_cache
+)
+from embedding.utility import (
+    generate_code_summary_async,
+    SUMMARY_MODEL,
+    SUMMARY_SYSTEM_PROMPT
 )
-from embedding.utility import generate_code_summary
+from embedding.cache import get_summary_cache, summary_cache_key
+from embedding.ratelimit import AsyncCallLimiter
+from embedding.summary_policy import choose_summary_policy, heuristic_summary
+from utils.telemetry import metrics, span
+
+SUMMARY_CONCURRENCY = int(os.getenv("CODERAG_SUMMARY_CONCURRENCY", "16"))
+SUMMARY_REQUESTS_PER_MINUTE = float(os.getenv("CODERAG_SUMMARY_REQUESTS_PER_MINUTE", "0"))
+SUMMARY_MAX_RETRIES = int(os.getenv("CODERAG_SUMMARY_MAX_RETRIES", "6"))
+
+SUMMARIES = metrics.counter("coderag_summaries_total", "Chunk summaries by summarization policy", ("policy",))
+SUMMARY_CACHE_LOOKUPS = metrics.counter("coderag_summary_cache_lookups_total",
+                                        "Chunk summaries read from the cache or generated", ("result",))
+
+def make_summary_limiter(max_concurrency=None):
+    """Create the limiter shared by all summary calls of one event loop."""
+    return AsyncCallLimiter(
+        max_concurrency or SUMMARY_CONCURRENCY,
+        requests_per_minute=SUMMARY_REQUESTS_PER_MINUTE,
+        max_retries=SUMMARY_MAX_RETRIES
+    )
+
+async def _summarize_chunk_async(chunk, client, limiter):
+    """Fill in the summary of a chunk, consulting the on-disk cache before calling the API."""
+    cache = get_summary_cache()
+    key = summary_cache_key(chunk["code"], SUMMARY_MODEL, SUMMARY_SYSTEM_PROMPT)
+    summary = cache.get(key)
+    SUMMARY_CACHE_LOOKUPS.inc(result="miss" if summary is None else "hit")
+    if summary is None:
+        # Includes the time spent waiting for the limiter and retrying
+        with span("summarizer.summarize_chunk", type=chunk["type"]):
+            summary = await limiter.call(generate_code_summary_async, chunk["code"], client)
+        cache.put(key, summary)
+    chunk["summary"] = summary
+
+async def summarize_chunks_async(chunks, limiter=None, client=None):
+    """
+    Summarize every chunk that does not have a summary yet, all concurrently.
+
+    Small or self-describing chunks get a deterministic summary from their
+    name, signature, docstring and calls; only the others are sent to the
+    model (see embedding.summary_policy). The policy used is recorded in
+    each chunk's metadata as summary_policy.
+
+    Args:
+        chunks (list): Chunks from any number of files
+        limiter (AsyncCallLimiter, optional): Shared concurrency/rate limiter
+        client (anthropic.AsyncAnthropic, optional): Client used for the calls
+
+    Returns:
+        list: The same chunks, with summaries filled in. Chunks whose summary
+        failed keep a None summary.
+    """
+    pending = []
+    for chunk in chunks:
+        if chunk.get("summary") is not None:
+            continue
+        policy = choose_summary_policy(chunk)
+        chunk.setdefault("metadata", {})["summary_policy"] = policy
+        SUMMARIES.inc(policy=policy)
+        if policy == "heuristic":
+            chunk["summary"] = heuristic_summary(chunk)
+        else:
+            pending.append(chunk)
+    if not pending:
+        return chunks
+
+    limiter = limiter or make_summary_limiter()
+    # Retries are handled by the limiter with jittered backoff
+    client = client or anthropic.AsyncAnthropic(max_retries=0)
+    results = await asyncio.gather(
+        *(_summarize_chunk_async(chunk, client, limiter) for chunk in pending),
+        return_exceptions=True
+    )
+    for chunk, result in zip(pending, results):
+        if isinstance(result, Exception):
+            print(f"Error summarizing {chunk['name']} in {chunk['file_path']}: {str(result)}")
+    return chunks
+
+def summarize_chunks(chunks, max_concurrency=None):
+    """Synchronous wrapper around summarize_chunks_async."""
+    async def _run():
+        return await summarize_chunks_async(chunks, make_summary_limiter(max_concurrency))
+    return asyncio.run(_run())
+
+def make_doc_id(chunk):
+    """Build the vector store document ID of a chunk."""
+    # Create shorter document ID using just filename instead of full path
+    filename = os.path.basename(chunk['file_path'])
+    doc_id = f"{filename}_{chunk['type']}_{chunk['name']}"
+    
+    # If ID is still too long, hash it
+    if len(doc_id.encode('utf-8')) >= 64:
+        doc_id = hashlib.md5(doc_id.encode('utf-8')).hexdigest()
+    return doc_id
 
 def _process_import_node(node, code_bytes, file_path):
     """Process an import statement and create a chunk."""
@@ -87,26 +190,16 @@ def _is_assignment_or_expr(node):
         "augmented_assignment"
     ]
 
-def _process_logical_block(nodes, code_bytes, file_path, start_idx, total_nodes):
+def _process_logical_block(nodes, code_bytes, file_path, start_idx, total_nodes, record):
     """Process a logical block of related statements."""
     block_codes = []
     end_idx = start_idx
     current_context = None
-    function_calls = set()
-    class_instances = set()
     start_line = nodes[start_idx].start_point[0] + 1  # Adding 1 for 1-based line numbering
     
     while end_idx < total_nodes:
         node = nodes[end_idx]
         
-        # Track function calls and class instantiations
-        if node.type == "call":
-            function_name = get_node_text(node.child_by_field_name("function"), code_bytes)
-            function_calls.add(function_name)
-        elif node.type == "class_definition":
-            class_name = get_node_text(node.child_by_field_name("name"), code_bytes)
-            class_instances.add(class_name)
-        
         # Skip if this is part of a previously processed block
         if end_idx > start_idx and node.start_byte < nodes[start_idx].end_byte:
             end_idx += 1
@@ -148,6 +241,10 @@ def _process_logical_block(nodes, code_bytes, file_path, start_idx, total_nodes)
         block_type = current_context if current_context else "code_block"
         end_line = nodes[end_idx - 1].end_point[0] + 1
         
+        # Look up calls and class definitions in the file's symbol record
+        start_byte = nodes[start_idx].start_byte
+        end_byte = nodes[end_idx - 1].end_byte
+        
         # Create a meaningful name based on the content
         if current_context:
             name = f"{current_context}_block"
@@ -156,233 +253,217 @@ def _process_logical_block(nodes, code_bytes, file_path, start_idx, total_nodes)
             first_line = block_codes[0].strip().split('\n')[0]
             name = first_line[:30].replace(' ', '_').lower() + "_block"
         
-        # Generate AI summary of the code block
-        summary = generate_code_summary(combined_code)
-        
         return {
             "type": block_type,
             "name": name,
             "code": combined_code,
-            "summary": summary,
+            "summary": None,
             "file_path": file_path,
             "docstring": "",
             "metadata": {
                 "start_line": start_line,
                 "end_line": end_line,
-                "function_calls": list(function_calls),
-                "class_instances": list(class_instances)
+                "function_calls": names_in_range(record["calls"], start_byte, end_byte),
+                "class_instances": names_in_range(record["classes"], start_byte, end_byte)
             }
         }, end_idx
     
     return None, start_idx
 
-def chunk_code(file_path):
+def chunk_tree(file_path, code_bytes, tree):
     """
-    Chunks a Python file into logical blocks of code.
+    Chunk an already parsed Python file, leaving every summary as None.
+
+    Args:
+        file_path (str): Path stored in the chunks
+        code_bytes (bytes): Source code, as returned by read_source
+        tree: Tree-sitter tree of code_bytes
+
+    Returns:
+        tuple: (chunks, symbol record of the file)
     """
     chunks = []
+    record = extract_symbols(code_bytes, tree.root_node)
+    symbols = {symbol["start_byte"]: symbol for symbol in record["symbols"]}
     
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            code_str = file.read()
-        code_bytes = bytes(code_str, "utf8")
-        tree = parser.parse(code_bytes)
+    last_end = 0
+    nodes = tree.root_node.children
+    i = 0
+    total_nodes = len(nodes)
+    
+    while i < total_nodes:
+        node = nodes[i]
         
-        last_end = 0
-        nodes = tree.root_node.children
-        i = 0
-        total_nodes = len(nodes)
+        # Process imports
+        if node.type in ["import_statement", "import_from_statement"]:
+            import_chunk, new_idx = _process_import_nodes(nodes, code_bytes, file_path, i, total_nodes)
+            if import_chunk:
+                chunks.append(import_chunk)
+                last_end = nodes[new_idx - 1].end_byte
+                i = new_idx
+                continue
         
-        while i < total_nodes:
-            node = nodes[i]
-            
-            # Process imports
-            if node.type in ["import_statement", "import_from_statement"]:
-                import_chunk, new_idx = _process_import_nodes(nodes, code_bytes, file_path, i, total_nodes)
-                if import_chunk:
-                    chunks.append(import_chunk)
-                    last_end = nodes[new_idx - 1].end_byte
-                    i = new_idx
-                    continue
-            
-            # Process classes and functions
-            elif node.type == "class_definition":
-                class_chunk = _process_class(node, code_bytes, file_path)
-                if class_chunk:
-                    chunks.append(class_chunk)
-                    last_end = node.end_byte
-            elif node.type == "function_definition":
-                function_chunk = _process_function(node, code_bytes, file_path)
-                if function_chunk:
-                    chunks.append(function_chunk)
-                    last_end = node.end_byte
-            
-            # Process other code blocks
-            else:
-                logical_chunk, new_idx = _process_logical_block(nodes, code_bytes, file_path, i, total_nodes)
-                if logical_chunk:
-                    chunks.append(logical_chunk)
-                    last_end = nodes[new_idx - 1].end_byte
-                    i = new_idx
-                    continue
-            
-            i += 1
+        # Process classes and functions
+        elif node.type == "class_definition":
+            class_chunk = _process_class(node, symbols[node.start_byte], code_bytes, file_path)
+            if class_chunk:
+                chunks.append(class_chunk)
+                last_end = node.end_byte
+        elif node.type == "function_definition":
+            function_chunk = _process_function(node, symbols[node.start_byte], code_bytes, file_path)
+            if function_chunk:
+                chunks.append(function_chunk)
+                last_end = node.end_byte
+        
+        # Process other code blocks
+        else:
+            logical_chunk, new_idx = _process_logical_block(nodes, code_bytes, file_path, i, total_nodes, record)
+            if logical_chunk:
+                chunks.append(logical_chunk)
+                last_end = nodes[new_idx - 1].end_byte
+                i = new_idx
+                continue
+        
+        i += 1
+    
+    return chunks, record
+
+def chunk_code(file_path, summarize=True):
+    """
+    Chunks a Python file into logical blocks of code.
+
+    Classes, functions and logical blocks are summarized by the LLM unless
+    summarize is False, in which case their summary is left as None for a
+    later summarize_chunks_async pass.
+
+    The file is parsed once; its symbol record is stored in the structure
+    cache, so the codebase structure view does not parse it again.
+    """
+    chunks = []
+    
+    try:
+        with span("summarizer.chunk_code"):
+            stat = os.stat(file_path)
+            content_hash, code_bytes = read_source(file_path)
+            chunks, record = chunk_tree(file_path, code_bytes, parser.parse(code_bytes))
+            get_structure_cache().put(file_path, stat, content_hash, record)
         
     except Exception as e:
         print(f"Error processing file {file_path}: {str(e)}")
-        
+    
+    if summarize:
+        summarize_chunks(chunks)
+        chunks = [chunk for chunk in chunks if chunk["summary"] is not None]
     return chunks
 
-def _process_class(node, code_bytes, file_path):
-    """Process a class node and create a chunk with summary."""
-    name_node = node.child_by_field_name("name")
-    if not name_node:
+def _process_class(node, symbol, code_bytes, file_path):
+    """Process a class node and its symbol record and create a chunk with summary."""
+    if not symbol["name"]:
         return None
-        
-    class_name = get_node_text(name_node, code_bytes)
-    class_code = get_node_text(node, code_bytes)
-    
-    # Get class docstring
-    body_node = node.child_by_field_name("body")
-    docstring = get_docstring(body_node, code_bytes) if body_node else ""
-    
-    # Get line numbers
-    start_line = node.start_point[0] + 1
-    end_line = node.end_point[0] + 1
-    
-    # Find function calls and class instances within the class
-    function_calls = set()
-    class_instances = set()
-    
-    def traverse_node(node):
-        if node.type == "call":
-            function_name = get_node_text(node.child_by_field_name("function"), code_bytes)
-            function_calls.add(function_name)
-        elif node.type == "class_definition":
-            class_name = get_node_text(node.child_by_field_name("name"), code_bytes)
-            class_instances.add(class_name)
-        for child in node.children:
-            traverse_node(child)
-    
-    traverse_node(node)
-    
-    # Generate AI summary of the class
-    summary = generate_code_summary(class_code)
     
     return {
         "type": "class",
-        "name": class_name,
-        "code": class_code,
-        "summary": summary,
+        "name": symbol["name"],
+        "code": get_node_text(node, code_bytes),
+        "summary": None,
         "file_path": file_path,
-        "docstring": docstring,
+        "docstring": symbol["docstring"],
         "metadata": {
-            "start_line": start_line,
-            "end_line": end_line,
-            "function_calls": list(function_calls),
-            "class_instances": list(class_instances)
+            "start_line": symbol["start_line"],
+            "end_line": symbol["end_line"],
+            "function_calls": symbol["calls"],
+            "class_instances": symbol["class_instances"]
         }
     }
 
-def _process_function(node, code_bytes, file_path):
-    """Process a function node and create a chunk with summary."""
-    name_node = node.child_by_field_name("name")
-    if not name_node:
+def _process_function(node, symbol, code_bytes, file_path):
+    """Process a function node and its symbol record and create a chunk with summary."""
+    if not symbol["name"]:
         return None
-        
-    func_name = get_node_text(name_node, code_bytes)
-    func_code = get_node_text(node, code_bytes)
-    
-    # Get function docstring
-    body_node = node.child_by_field_name("body")
-    docstring = get_docstring(body_node, code_bytes) if body_node else ""
-    
-    # Get parameters
-    params = []
-    parameters_node = node.child_by_field_name("parameters")
-    if parameters_node:
-        for param in parameters_node.children:
-            if param.type == "identifier":
-                params.append(get_node_text(param, code_bytes))
-    
-    # Get line numbers
-    start_line = node.start_point[0] + 1
-    end_line = node.end_point[0] + 1
-    
-    # Find function calls and class instances within the function
-    function_calls = set()
-    class_instances = set()
-    
-    def traverse_node(node):
-        if node.type == "call":
-            function_name = get_node_text(node.child_by_field_name("function"), code_bytes)
-            function_calls.add(function_name)
-        elif node.type == "class_definition":
-            class_name = get_node_text(node.child_by_field_name("name"), code_bytes)
-            class_instances.add(class_name)
-        for child in node.children:
-            traverse_node(child)
-    
-    traverse_node(node)
-    
-    # Generate AI summary of the function
-    summary = generate_code_summary(func_code)
     
     return {
         "type": "function",
-        "name": func_name,
-        "code": func_code,
-        "summary": summary,
+        "name": symbol["name"],
+        "code": get_node_text(node, code_bytes),
+        "summary": None,
         "file_path": file_path,
-        "docstring": docstring,
-        "parameters": params,
+        "docstring": symbol["docstring"],
+        "parameters": symbol["params"],
         "metadata": {
-            "start_line": start_line,
-            "end_line": end_line,
-            "function_calls": list(function_calls),
-            "class_instances": list(class_instances)
+            "start_line": symbol["start_line"],
+            "end_line": symbol["end_line"],
+            "function_calls": symbol["calls"],
+            "class_instances": symbol["class_instances"]
         }
     }
 
-def process_file(file_path):
+def process_file(file_path, summarize=True):
     """Process a single file and return its chunks."""
     print(f"Processing file: {file_path}")
     try:
-        chunks = chunk_code(file_path)
+        chunks = chunk_code(file_path, summarize=summarize)
         return file_path, chunks
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
         return file_path, []
 
-def process_directory(directory_path, num_processes=None):
+def find_python_files(directory_path):
+    """Return the paths of all Python files in a directory and its subdirectories."""
+    py_files = []
+    for root, _, files in os.walk(directory_path):
+        for file in files:
+            if file.endswith('.py'):
+                py_files.append(os.path.join(root, file))
+    return py_files
+
+def process_files(py_files, max_concurrency=None):
     """
-    Process all Python files in the given directory and its subdirectories in parallel.
+    Process the given Python files.
+
+    Files are parsed and chunked first, then the chunks of all files are
+    summarized concurrently on one event loop, bounded by the summary
+    concurrency and rate limits rather than the CPU count.
+    
+    Args:
+        py_files (list): Paths of the files to process
+        max_concurrency (int, optional): Maximum summary calls in flight. Defaults to CODERAG_SUMMARY_CONCURRENCY.
+    
+    Returns:
+        dict: Dictionary mapping file paths to their chunks
+    """
+    if not py_files:
+        return {}
+    
+    results = dict(process_file(file_path, summarize=False) for file_path in py_files)
+    all_chunks = [chunk for chunks in results.values() for chunk in chunks]
+    summarize_chunks(all_chunks, max_concurrency)
+    
+    # Leave files with failed summaries out, so the next index run retries them
+    for file_path, chunks in list(results.items()):
+        if any(chunk["summary"] is None for chunk in chunks):
+            print(f"Skipping {file_path}: not every chunk could be summarized")
+            del results[file_path]
+    return results
+
+def process_directory(directory_path, max_concurrency=None):
+    """
+    Process all Python files in the given directory and its subdirectories.
     
     Args:
         directory_path (str): Path to the directory containing Python files
-        num_processes (int, optional): Number of processes to use. Defaults to CPU count.
+        max_concurrency (int, optional): Maximum summary calls in flight. Defaults to CODERAG_SUMMARY_CONCURRENCY.
     
     Returns:
         dict: Dictionary mapping file paths to their chunks
     """
     # Get all Python files in the directory and subdirectories
-    py_files = []
-    for root, _, files in os.walk(directory_path):
-        for file in files:
-            if file.endswith('.py'):
-                py_files.append(os.path.join(root, file))
+    py_files = find_python_files(directory_path)
     
     if not py_files:
         print(f"No Python files found in {directory_path}")
         return {}
     
-    # Create a process pool
-    with Pool(processes=num_processes) as pool:
-        # Process all files in parallel
-        results = pool.map(process_file, py_files)
-    
-    # Convert results to dictionary
-    return dict(results)
+    return process_files(py_files, max_concurrency)
 
 if __name__ == "__main__":
     # Example usage with directory
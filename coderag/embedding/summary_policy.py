@@ -0,0 +1,176 @@
+"""Tiered summarization: deterministic summaries for small or self-describing chunks, the LLM for the rest."""
+import os
+import re
+from typing import Dict, List, Tuple
+
+# "tiered" picks per chunk, "llm" summarizes every chunk with the model, "heuristic" never calls it
+SUMMARY_POLICY = os.getenv("CODERAG_SUMMARY_POLICY", "tiered").lower()
+# Chunks up to this many lines of code and branches get a heuristic summary
+SUMMARY_HEURISTIC_MAX_LINES = int(os.getenv("CODERAG_SUMMARY_HEURISTIC_MAX_LINES", "10"))
+SUMMARY_HEURISTIC_MAX_BRANCHES = int(os.getenv("CODERAG_SUMMARY_HEURISTIC_MAX_BRANCHES", "3"))
+# A docstring of at least this many words describes its chunk well enough for a larger size limit
+SUMMARY_DOCSTRING_MIN_WORDS = int(os.getenv("CODERAG_SUMMARY_DOCSTRING_MIN_WORDS", "12"))
+
+# How much larger than the limits above a chunk with a descriptive docstring may be
+_DOCUMENTED_SIZE_FACTOR = 4
+# Longest docstring text and list of names carried into a heuristic summary
+_MAX_DOCSTRING_CHARS = 600
+_MAX_NAMES = 12
+
+_STRING = re.compile(r'(?s)""".*?"""|\'\'\'.*?\'\'\'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'')
+_BRANCH = re.compile(r"\b(?:if|elif|for|while|except|with|and|or|case|lambda)\b")
+_LEADING_DOCSTRING = re.compile(r'^\s*[rRuU]?("""|\'\'\')(.*?)\1', re.DOTALL)
+_METHOD = re.compile(r"^\s+(?:async\s+)?def\s+(\w+)", re.MULTILINE)
+_ASSIGNED = re.compile(r"^([A-Za-z_][A-Za-z0-9_.]*)\s*(?::[^=\n]+)?=(?!=)", re.MULTILINE)
+_CAMEL_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+_COMMENT = re.compile(r"#[^\n]*")
+
+def _blank(match) -> str:
+    return " " * len(match.group(0))
+
+def _code_lines(code: str) -> List[str]:
+    """Lines of a chunk without string literals (docstrings included), comments and blank lines."""
+    stripped = _STRING.sub('""', code)
+    lines = []
+    for line in stripped.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line and line != '""':
+            lines.append(line)
+    return lines
+
+def _split_header(code: str) -> Tuple[str, str]:
+    """Split a def or class into its signature (up to the colon outside brackets and strings) and its body."""
+    # Blanked to the same length, so brackets and colons in defaults and comments are skipped
+    masked = _STRING.sub(_blank, code)
+    comments = list(_COMMENT.finditer(masked))
+    masked = _COMMENT.sub(_blank, masked)
+    depth = 0
+    for i, char in enumerate(masked):
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif char == ":" and depth == 0:
+            signature = code[:i]
+            for comment in reversed([comment for comment in comments if comment.end() <= i]):
+                signature = signature[:comment.start()] + signature[comment.end():]
+            return " ".join(signature.split()), code[i + 1:]
+    return "", code
+
+def chunk_complexity(chunk: Dict) -> Tuple[int, int]:
+    """
+    Rough size and complexity of a chunk.
+
+    Returns:
+        tuple: (lines of code without the docstring, comments and the def/class line,
+            number of branching keywords and boolean operators)
+    """
+    code = chunk.get("code") or ""
+    if chunk.get("type") in ("function", "class"):
+        code = _split_header(code)[1]
+    lines = _code_lines(code)
+    branches = sum(len(_BRANCH.findall(line)) for line in lines)
+    return len(lines), branches
+
+def choose_summary_policy(chunk: Dict, policy: str = None) -> str:
+    """
+    Decide how a chunk is summarized: "heuristic" or "llm".
+
+    Under the tiered policy a chunk gets a heuristic summary when it is
+    small and simple (a getter, a constant assignment, a short guard), is
+    module-level code without branches (constants, tables), or when a
+    descriptive docstring already says what it does and it is not much
+    larger. Everything else goes to the model.
+
+    Args:
+        chunk (Dict): Chunk from the chunker
+        policy (str, optional): "tiered", "llm" or "heuristic". Defaults to CODERAG_SUMMARY_POLICY.
+    """
+    policy = policy or SUMMARY_POLICY
+    if policy in ("llm", "heuristic"):
+        return policy
+    lines, branches = chunk_complexity(chunk)
+    if lines <= SUMMARY_HEURISTIC_MAX_LINES and branches <= SUMMARY_HEURISTIC_MAX_BRANCHES:
+        return "heuristic"
+    # Module-level assignments without any logic, such as constants and lookup tables
+    if chunk.get("type") == "code_block" and branches == 0:
+        return "heuristic"
+    docstring_words = len((chunk.get("docstring") or "").split())
+    if (docstring_words >= SUMMARY_DOCSTRING_MIN_WORDS
+            and lines <= SUMMARY_HEURISTIC_MAX_LINES * _DOCUMENTED_SIZE_FACTOR
+            and branches <= SUMMARY_HEURISTIC_MAX_BRANCHES * _DOCUMENTED_SIZE_FACTOR):
+        return "heuristic"
+    return "llm"
+
+def _words(identifier: str) -> str:
+    """Split an identifier into lowercase words, e.g. loadUserProfile -> load user profile."""
+    return " ".join(part.lower() for piece in identifier.split("_") for part in _CAMEL_PART.findall(piece))
+
+def _names(names, limit: int = _MAX_NAMES) -> str:
+    names = list(dict.fromkeys(name for name in names if name))
+    listed = ", ".join(names[:limit])
+    return f"{listed} and {len(names) - limit} more" if len(names) > limit else listed
+
+def _as_list(value) -> List[str]:
+    if isinstance(value, str):
+        return [name for name in value.split(",") if name]
+    return list(value or [])
+
+def _first_paragraph(docstring: str) -> str:
+    paragraph = " ".join(docstring.strip().split("\n\n")[0].split())
+    if len(paragraph) > _MAX_DOCSTRING_CHARS:
+        paragraph = paragraph[:_MAX_DOCSTRING_CHARS].rsplit(" ", 1)[0] + "..."
+    return paragraph
+
+def heuristic_summary(chunk: Dict) -> str:
+    """
+    Build a summary from what the chunk states about itself, without calling the model.
+
+    The summary names the kind of chunk, its signature and file, the words
+    of its name, the first paragraph of its docstring, the functions it
+    calls and classes it instantiates, and for small chunks the code itself,
+    so it embeds close to queries about any of them.
+    """
+    code = chunk.get("code") or ""
+    kind = chunk.get("type") or "code"
+    name = chunk.get("name") or ""
+    filename = os.path.basename(chunk.get("file_path") or "")
+    metadata = chunk.get("metadata") or {}
+
+    sentences = []
+    if kind in ("function", "class"):
+        signature, body = _split_header(code)
+        defined_as = f", defined as `{signature}`" if signature else ""
+        sentences.append(f"{kind.capitalize()} {name} ({_words(name)}) in {filename}{defined_as}.")
+    else:
+        body = code
+        label = "Module-level code" if kind == "code_block" else f"Module-level {kind.replace('_', ' ')}"
+        sentences.append(f"{label} in {filename}.")
+        # A module docstring is chunked as a block of its own
+        leading = _LEADING_DOCSTRING.match(code)
+        if leading and leading.group(2).strip():
+            sentences.append(_first_paragraph(leading.group(2)))
+        assigned = _ASSIGNED.findall(code)
+        if assigned:
+            sentences.append(f"Defines {_names(assigned)} ({_words(' '.join(assigned))}).")
+
+    docstring = chunk.get("docstring") or ""
+    if docstring.strip():
+        paragraph = _first_paragraph(docstring)
+        sentences.append(paragraph if paragraph.endswith((".", "!", "?", "...")) else paragraph + ".")
+    if kind == "class":
+        methods = _METHOD.findall(code)
+        if methods:
+            sentences.append(f"Methods: {_names(methods)}.")
+    calls = _as_list(metadata.get("function_calls"))
+    if calls:
+        sentences.append(f"Calls {_names(calls)}.")
+    instances = _as_list(metadata.get("class_instances"))
+    if instances:
+        sentences.append(f"Uses the classes {_names(instances)}.")
+
+    if 0 < len(_code_lines(body)) <= 3:
+        body = _LEADING_DOCSTRING.sub("", body, count=1)
+        lines = [line.strip() for line in body.splitlines() if line.strip() and not line.strip().startswith("#")]
+        sentences.append("Code: " + "; ".join(f"`{line}`" for line in lines))
+    return " ".join(sentences)
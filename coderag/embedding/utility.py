@@ -1,30 +1,59 @@
+import os
+import sys
 import anthropic
 from dotenv import load_dotenv
 
+# Add the package directory to Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.registry import get_anthropic_client
+from utils.telemetry import record_usage
+
 load_dotenv()
 
+SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+
+SUMMARY_SYSTEM_PROMPT = """You are a helpful assistant that generates a summary of the code.\n
+                The summary should be a 3-4 sentence that captures the main idea of the code.\n
+                The summary will be utilized to embed the code and create a vector database of the code.\n
+                And will be used to search for the code in the vector database based on user query to explain or modify the codebase.\n
+                So, make sure to include all the important details of the code in the summary.
+                """
+
 def generate_code_summary(code: str):
     """ Generate a summary of the code """
-    
-    client = anthropic.Anthropic()
+
+    client = get_anthropic_client()
     response = client.messages.create(
-        model="claude-3-5-haiku-20241022",
+        model=SUMMARY_MODEL,
         max_tokens=4096,
         temperature=0,
-        system= """You are a helpful assistant that generates a summary of the code.\n
-                The summary should be a 3-4 sentence that captures the main idea of the code.\n
-                The summary will be utilized to embed the code and create a vector database of the code.\n
-                And will be used to search for the code in the vector database based on user query to explain or modify the codebase.\n
-                So, make sure to include all the important details of the code in the summary. 
-                """,
+        system=SUMMARY_SYSTEM_PROMPT,
         messages=[
             {"role": "user", "content": code}
         ]
     )
+    record_usage(SUMMARY_MODEL, getattr(response, "usage", None))
     summary = response.content[0].text
     return summary
-    
-    
+
+async def generate_code_summary_async(code: str, client: anthropic.AsyncAnthropic = None):
+    """ Generate a summary of the code with the async Anthropic client """
+
+    client = client or anthropic.AsyncAnthropic()
+    response = await client.messages.create(
+        model=SUMMARY_MODEL,
+        max_tokens=4096,
+        temperature=0,
+        system=SUMMARY_SYSTEM_PROMPT,
+        messages=[
+            {"role": "user", "content": code}
+        ]
+    )
+    record_usage(SUMMARY_MODEL, getattr(response, "usage", None))
+    return response.content[0].text
+
+
 
 if __name__ == "__main__":
     code = """
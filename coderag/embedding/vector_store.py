@@ -0,0 +1,368 @@
+"""Vector store backends used by CodeEmbedder."""
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embedding.cache import CODERAG_CACHE_DIR
+
+load_dotenv()
+
+# TurboPuffer API key and base URL
+TURBOPUFFER_API_KEY = os.getenv("TURBOPUFFER_API_KEY")
+TURBOPUFFER_API_BASE_URL = os.getenv("TURBOPUFFER_API_BASE_URL", "https://gcp-us-central1.turbopuffer.com")
+
+VECTOR_STORE_BACKEND = os.getenv("CODERAG_VECTOR_STORE", "turbopuffer")
+LOCAL_VECTOR_STORE_DIR = os.getenv("CODERAG_LOCAL_VECTOR_STORE_DIR", os.path.join(CODERAG_CACHE_DIR, "vectors"))
+
+# Compact once at least this many rows are dead and they outnumber live rows
+_COMPACTION_MIN_DEAD_ROWS = 1024
+
+class QueryResult:
+    """A single query hit, shaped like the rows TurboPuffer returns."""
+    __slots__ = ("id", "dist", "attributes", "vector")
+
+    def __init__(self, id: str, dist: float, attributes: Dict = None, vector: List[float] = None):
+        self.id = id
+        self.dist = dist
+        self.attributes = attributes
+        self.vector = vector
+
+    def __repr__(self):
+        return f"QueryResult(id={self.id!r}, dist={self.dist:.4f})"
+
+class LocalVectorStore:
+    def __init__(self, name: str, directory: str = LOCAL_VECTOR_STORE_DIR):
+        """
+        Vector store kept entirely on local disk.
+
+        Normalized embeddings live in a memory-mapped float16 matrix, one row
+        per document, and the attributes in a small SQLite table keyed by row.
+        Queries score every live row with a single matrix-vector product.
+        Deleted rows are tombstoned and reclaimed by compaction.
+
+        The SQLite transaction is the commit point of every change: vectors
+        are written and flushed first, then the rows are committed together
+        with the matrix size and file name. Compaction writes a new matrix
+        file that its commit switches to, so after a crash at any point
+        every id still maps to its own vector.
+
+        The interface mirrors the subset of turbopuffer.Namespace that
+        CodeEmbedder uses, so the two backends are interchangeable.
+
+        Args:
+            name (str): Namespace name, used as the storage subdirectory
+            directory (str): Root directory holding all local namespaces
+        """
+        self.name = name
+        self.path = os.path.join(directory, name)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.RLock()
+
+        self._db = sqlite3.connect(os.path.join(self.path, "attributes.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS rows (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                attributes TEXT NOT NULL
+            )"""
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value NOT NULL)")
+
+        self.dim = None
+        self.count = 0
+        self._capacity = 0
+        self._matrix = None
+        self._matrix_file = "vectors.f16"
+        # float32 working copy; numpy has no BLAS path for float16 products
+        self._scoring_matrix = None
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        legacy_meta_path = os.path.join(self.path, "meta.json")
+        if not meta and os.path.exists(legacy_meta_path):
+            # Stores written before the metadata moved into SQLite
+            with open(legacy_meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+        if meta:
+            self.dim, self.count, self._capacity = meta["dim"], meta["count"], meta["capacity"]
+            self._matrix_file = meta.get("matrix", self._matrix_file)
+            # Older stores committed rows before recording the size, which could lag behind after a crash
+            row_bytes = self.dim * np.dtype(np.float16).itemsize
+            self._capacity = max(self._capacity, os.path.getsize(self._matrix_path) // row_bytes)
+            max_row = self._db.execute("SELECT MAX(row) FROM rows").fetchone()[0]
+            self.count = max(self.count, max_row + 1 if max_row is not None else 0)
+            self._matrix = np.memmap(self._matrix_path, dtype=np.float16, mode="r+",
+                                     shape=(self._capacity, self.dim))
+        if os.path.exists(legacy_meta_path):
+            with self._db:
+                self._save_meta()
+            os.remove(legacy_meta_path)
+        # Matrix files of a compaction that never committed, or whose old file was not yet removed
+        for name in os.listdir(self.path):
+            if name.startswith("vectors") and name.endswith(".f16") and name != self._matrix_file:
+                os.remove(os.path.join(self.path, name))
+
+        self._row_of = dict(self._db.execute("SELECT id, row FROM rows"))
+        self._id_at = [None] * self.count
+        for doc_id, row in self._row_of.items():
+            self._id_at[row] = doc_id
+        self._live = np.zeros(self._capacity, dtype=bool)
+        if self._row_of:
+            self._live[list(self._row_of.values())] = True
+
+    @property
+    def _matrix_path(self) -> str:
+        return os.path.join(self.path, self._matrix_file)
+
+    def _grow(self, needed: int) -> None:
+        """Make room for at least `needed` rows, doubling the matrix file."""
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, 2 * self._capacity, 1024)
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        with open(self._matrix_path, 'ab') as file:
+            file.truncate(capacity * self.dim * np.dtype(np.float16).itemsize)
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        live = np.zeros(capacity, dtype=bool)
+        live[:self._capacity] = self._live
+        self._live = live
+        self._capacity = capacity
+
+    def _save_meta(self, **changes) -> None:
+        """Record the matrix size and file, with changes applied; call inside the transaction committing the rows."""
+        meta = {"dim": self.dim, "count": self.count, "capacity": self._capacity, "matrix": self._matrix_file}
+        meta.update(changes)
+        self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", list(meta.items()))
+
+    def upsert(self, ids: List[str], vectors: List[List[float]], attributes: Dict[str, List] = None,
+               **kwargs) -> None:
+        """
+        Insert or overwrite documents.
+
+        Args:
+            ids (List[str]): Document IDs
+            vectors (List[List[float]]): One embedding per document
+            attributes (Dict[str, List]): Columnar attributes, one value per document
+            **kwargs: Backend specific options (distance metric, schema) that do not apply locally
+        """
+        if not ids:
+            return
+        attributes = attributes or {}
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+
+            new_ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in self._row_of]
+            self._grow(self.count + len(new_ids))
+            for doc_id in new_ids:
+                self._row_of[doc_id] = self.count
+                self._id_at.append(doc_id)
+                self.count += 1
+
+            rows = [self._row_of[doc_id] for doc_id in ids]
+            self._matrix[rows] = vectors.astype(np.float16)
+            self._live[rows] = True
+            if new_ids:
+                self._scoring_matrix = None
+            elif self._scoring_matrix is not None:
+                self._scoring_matrix[rows] = self._matrix[rows]
+
+            records = []
+            for i, (doc_id, row) in enumerate(zip(ids, rows)):
+                row_attributes = {key: values[i] for key, values in attributes.items()}
+                records.append((row, doc_id, json.dumps(row_attributes)))
+            # Vectors reach the file before the rows pointing at them are committed
+            self._matrix.flush()
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO rows (row, id, attributes) VALUES (?, ?, ?)", records)
+                self._save_meta()
+
+    def query(self, vector: List[float], top_k: int = 10, distance_metric: str = "cosine_distance",
+              include_attributes: bool = True, include_vectors: bool = False, filters=None,
+              **kwargs) -> List[QueryResult]:
+        """
+        Return the top_k documents closest to a vector by cosine distance.
+
+        Args:
+            vector (List[float]): Query embedding
+            top_k (int): Number of results
+            distance_metric (str): Only cosine_distance is supported
+            include_attributes (bool): Attach stored attributes to each result
+            include_vectors (bool): Attach stored vectors to each result
+            filters (list, optional): TurboPuffer style filter restricting the candidates
+
+        Returns:
+            List[QueryResult]: Results ordered by increasing distance
+        """
+        if distance_metric != "cosine_distance":
+            raise ValueError(f"Unsupported distance metric: {distance_metric}")
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        with self._lock:
+            if not self.count:
+                return []
+            if self._scoring_matrix is None:
+                self._scoring_matrix = np.asarray(self._matrix[:self.count], dtype=np.float32)
+            scores = self._scoring_matrix @ query
+            mask = self._live[:self.count]
+            if filters is not None:
+                mask = mask & self._filter_mask(filters)
+            scores = np.where(mask, scores, -np.inf)
+
+            k = min(top_k, int(mask.sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            attributes_by_row = {}
+            if include_attributes:
+                placeholders = ",".join("?" * len(top))
+                attributes_by_row = {
+                    row: json.loads(attributes) for row, attributes in self._db.execute(
+                        f"SELECT row, attributes FROM rows WHERE row IN ({placeholders})",
+                        [int(row) for row in top]
+                    )
+                }
+            return [
+                QueryResult(
+                    id=self._id_at[row],
+                    dist=1.0 - float(scores[row]),
+                    attributes=attributes_by_row.get(int(row)) if include_attributes else None,
+                    vector=self._scoring_matrix[row].tolist() if include_vectors else None
+                )
+                for row in top
+            ]
+
+    def close(self) -> None:
+        """Flush the matrix and close the attribute table."""
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            self._db.close()
+
+    def _filter_sql(self, filters):
+        """Translate a TurboPuffer style filter into a SQL condition and parameters."""
+        if filters[0] in ("And", "Or"):
+            parts = [self._filter_sql(f) for f in filters[1]]
+            sql = f" {filters[0].upper()} ".join(f"({part})" for part, _ in parts)
+            return sql, [param for _, params in parts for param in params]
+        key, op, value = filters
+        column = "id" if key == "id" else f"json_extract(attributes, '$.{key}')"
+        if op == "Eq":
+            return f"{column} = ?", [value]
+        if op == "NotEq":
+            return f"{column} != ?", [value]
+        if op == "In":
+            return f"{column} IN ({','.join('?' * len(value))})", list(value)
+        raise ValueError(f"Unsupported filter operator: {op}")
+
+    def _filter_rows(self, filters) -> List[int]:
+        sql, params = self._filter_sql(filters)
+        return [row for (row,) in self._db.execute(f"SELECT row FROM rows WHERE {sql}", params)]
+
+    def _filter_mask(self, filters) -> np.ndarray:
+        mask = np.zeros(self.count, dtype=bool)
+        rows = self._filter_rows(filters)
+        if rows:
+            mask[rows] = True
+        return mask
+
+    def delete_by_filter(self, filters) -> int:
+        """
+        Delete every document matching a TurboPuffer style filter.
+
+        Returns:
+            int: Number of deleted documents
+        """
+        with self._lock:
+            rows = self._filter_rows(filters)
+            if not rows:
+                return 0
+            placeholders = ",".join("?" * len(rows))
+            with self._db:
+                deleted_ids = [doc_id for (doc_id,) in self._db.execute(
+                    f"SELECT id FROM rows WHERE row IN ({placeholders})", rows)]
+                self._db.execute(f"DELETE FROM rows WHERE row IN ({placeholders})", rows)
+            for doc_id in deleted_ids:
+                self._id_at[self._row_of.pop(doc_id)] = None
+            self._live[rows] = False
+
+            dead = self.count - len(self._row_of)
+            if dead >= _COMPACTION_MIN_DEAD_ROWS and dead > len(self._row_of):
+                self.compact()
+            return len(rows)
+
+    def compact(self) -> None:
+        """Rewrite the matrix and attribute table without tombstoned rows."""
+        with self._lock:
+            if self._matrix is None:
+                return
+            old_rows = np.flatnonzero(self._live[:self.count])
+            new_row_of_old = {int(old): new for new, old in enumerate(old_rows)}
+            records = [
+                (new_row_of_old[row], doc_id, attributes)
+                for row, doc_id, attributes in self._db.execute("SELECT row, id, attributes FROM rows")
+            ]
+
+            # Live vectors go to a new file; the current one stays valid until the commit
+            generation = int(self._matrix_file.split(".")[1]) + 1 if self._matrix_file.count(".") == 2 else 1
+            matrix_file = f"vectors.{generation}.f16"
+            count, capacity = len(old_rows), max(len(old_rows), 1024)
+            matrix = np.memmap(os.path.join(self.path, matrix_file), dtype=np.float16, mode="w+",
+                               shape=(capacity, self.dim))
+            matrix[:count] = self._matrix[old_rows]
+            matrix.flush()
+            with self._db:
+                self._db.execute("DELETE FROM rows")
+                self._db.executemany("INSERT INTO rows (row, id, attributes) VALUES (?, ?, ?)", records)
+                self._save_meta(count=count, capacity=capacity, matrix=matrix_file)
+
+            old_path = self._matrix_path
+            del self._matrix
+            os.remove(old_path)
+            self._matrix, self._matrix_file = matrix, matrix_file
+            self.count, self._capacity = count, capacity
+            self._live = np.zeros(capacity, dtype=bool)
+            self._live[:count] = True
+            self._row_of = {doc_id: row for row, doc_id, _ in records}
+            self._id_at = [None] * self.count
+            for doc_id, row in self._row_of.items():
+                self._id_at[row] = doc_id
+            self._scoring_matrix = None
+
+def create_vector_store(collection_name: str, backend: str = None):
+    """
+    Create the vector store for a namespace.
+
+    Args:
+        collection_name (str): Namespace name
+        backend (str, optional): "turbopuffer" or "local". Defaults to CODERAG_VECTOR_STORE.
+
+    Returns:
+        A turbopuffer.Namespace or LocalVectorStore
+    """
+    backend = backend or VECTOR_STORE_BACKEND
+    if backend == "turbopuffer":
+        # Imported here so the local backend works without the turbopuffer package
+        import turbopuffer as tpuf
+        tpuf.api_base_url = TURBOPUFFER_API_BASE_URL
+        return tpuf.Namespace(
+            name=collection_name,
+            api_key=TURBOPUFFER_API_KEY
+        )
+    if backend == "local":
+        return LocalVectorStore(collection_name)
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -1,16 +1,33 @@
 """ Main file for code analyzer """
 from agent import chat
+from utils.context import ConversationContext
+from utils.registry import warmup, shutdown
+from utils.telemetry import start_profiler, stop_profiler, write_metrics
+from embedding.reindex_queue import reindex_queue
 
 def main():
-    # Initialize conversation history
-    messages = []
+    # Opt-in, see CODERAG_PROFILE_INTERVAL
+    start_profiler()
+
+    # Load models and clients before the first query instead of inside a tool call
+    warmup()
+    
+    # Conversation history, compacted and prompt-cached across turns
+    context = ConversationContext()
     
-    while True:
-        user_input = input("\nEnter your query (or 'exit' to quit): ")
-        if user_input.lower() == "exit":
-            break
-        
-        response, messages = chat(user_input, messages)
+    try:
+        while True:
+            user_input = input("\nEnter your query (or 'exit' to quit): ")
+            if user_input.lower() == "exit":
+                break
+            
+            response, messages = chat(user_input, context=context)
+    finally:
+        # Finish queued re-indexing before the embedder is released
+        reindex_queue.close()
+        shutdown()
+        stop_profiler()
+        write_metrics()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,247 @@
+""" HTTP/WebSocket server hosting many chat sessions over one set of models and indexes """
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import aclosing
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web, WSMsgType
+
+from agent import achat_stream
+from utils.context import ConversationContext
+from utils.registry import warmup, shutdown
+from utils.telemetry import metrics, get_trace, recent_traces, start_profiler, get_profiler, stop_profiler
+from embedding.reindex_queue import reindex_queue
+
+SERVER_HOST = os.getenv("CODERAG_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("CODERAG_SERVER_PORT", "8080"))
+# Threads stepping the blocking agent streams of all sessions
+SERVER_THREADS = int(os.getenv("CODERAG_SERVER_THREADS", "64"))
+# Seconds a session may stay idle before it is dropped
+SESSION_TTL = float(os.getenv("CODERAG_SESSION_TTL", "3600"))
+
+class Session:
+    def __init__(self, session_id: str):
+        """One conversation: its own history and token usage, one turn at a time."""
+        self.id = session_id
+        self.context = ConversationContext()
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_active = time.monotonic()
+
+    def describe(self) -> dict:
+        return {
+            "session_id": self.id,
+            "messages": len(self.context.messages),
+            "usage": dict(self.context.usage),
+            "busy": self.lock.locked()
+        }
+
+class SessionStore:
+    def __init__(self, ttl: float = SESSION_TTL):
+        """
+        In-memory sessions of the server, expired after ttl seconds of inactivity.
+
+        Args:
+            ttl (float): Idle time after which a session is dropped, 0 keeps sessions forever
+        """
+        self.ttl = ttl
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self) -> Session:
+        self.expire()
+        session = Session(uuid.uuid4().hex)
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id: str) -> Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise web.HTTPNotFound(text=json.dumps({"error": f"Unknown session {session_id}"}),
+                                   content_type="application/json")
+        return session
+
+    def delete(self, session_id: str) -> None:
+        self.get(session_id)
+        del self._sessions[session_id]
+
+    def expire(self) -> int:
+        """Drop idle sessions, except those with a turn in progress."""
+        if self.ttl <= 0:
+            return 0
+        cutoff = time.monotonic() - self.ttl
+        expired = [session_id for session_id, session in self._sessions.items()
+                   if session.last_active < cutoff and not session.lock.locked()]
+        for session_id in expired:
+            del self._sessions[session_id]
+        return len(expired)
+
+async def run_turn(app, session: Session, message: str):
+    """
+    Run one user turn of a session, yielding the agent's events.
+
+    Turns of the same session are serialized; turns of different sessions
+    run concurrently, bounded by the agent's limit on in-flight model calls.
+    """
+    async with session.lock:
+        session.touch()
+        try:
+            async for event in achat_stream(message, context=session.context, executor=app["executor"]):
+                yield event
+        finally:
+            session.touch()
+
+def _user_message(payload):
+    """Extract the user message from a request body or WebSocket frame."""
+    message = payload.get("message") if isinstance(payload, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError('Expected a JSON object with a non-empty "message" string')
+    return message
+
+async def health(request):
+    return web.json_response({"status": "ok", "sessions": len(request.app["sessions"])})
+
+async def create_session(request):
+    session = request.app["sessions"].create()
+    return web.json_response(session.describe(), status=201)
+
+async def get_session(request):
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    return web.json_response(session.describe())
+
+async def delete_session(request):
+    request.app["sessions"].delete(request.match_info["session_id"])
+    return web.Response(status=204)
+
+async def post_message(request):
+    """Run a turn and answer with its final text, tool calls and the session's token usage."""
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    try:
+        message = _user_message(await request.json())
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    tool_calls = []
+    try:
+        async with aclosing(run_turn(request.app, session, message)) as events:
+            async for event in events:
+                if event["type"] == "tool_result":
+                    tool_calls.append({"name": event["name"], "is_error": event["is_error"]})
+                elif event["type"] == "done":
+                    return web.json_response({
+                        "session_id": session.id,
+                        "text": event["text"],
+                        "stop_reason": event["stop_reason"],
+                        "tool_calls": tool_calls,
+                        "usage": event["usage"],
+                        "trace_id": event["trace_id"]
+                    })
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=502)
+    return web.json_response({"error": "The turn ended without a response"}, status=502)
+
+async def websocket(request):
+    """
+    Stream turns over a WebSocket.
+
+    Each text frame is a JSON object {"message": str}; every agent event of
+    the turn is sent back as a JSON frame. Connecting to /ws without a
+    session ID starts a new session, announced by a "session" event.
+    """
+    sessions = request.app["sessions"]
+    session_id = request.match_info.get("session_id")
+    session = sessions.get(session_id) if session_id else sessions.create()
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    await ws.send_json({"type": "session", **session.describe()})
+
+    async for frame in ws:
+        if frame.type != WSMsgType.TEXT:
+            continue
+        try:
+            message = _user_message(json.loads(frame.data))
+        except ValueError as e:
+            await ws.send_json({"type": "error", "error": str(e)})
+            continue
+        try:
+            async with aclosing(run_turn(request.app, session, message)) as events:
+                async for event in events:
+                    await ws.send_json(event)
+        except ConnectionResetError:
+            break
+        except Exception as e:
+            await ws.send_json({"type": "error", "error": str(e)})
+    return ws
+
+async def prometheus_metrics(request):
+    return web.Response(text=metrics.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def list_traces(request):
+    """Summaries of the most recent turns, newest first."""
+    return web.json_response([
+        {"trace_id": trace.trace_id, "name": trace.root.name, "started_at": trace.started_at,
+         "duration_ms": round(trace.root.duration * 1000, 3), "error": trace.root.error}
+        for trace in reversed(recent_traces())
+    ])
+
+async def get_trace_detail(request):
+    """The span tree of one turn: model calls with token usage, tool calls and the search work inside them."""
+    trace = get_trace(request.match_info["trace_id"])
+    if trace is None:
+        return web.json_response({"error": f"Unknown trace {request.match_info['trace_id']}"}, status=404)
+    return web.json_response(trace.to_dict(), dumps=lambda data: json.dumps(data, default=str))
+
+async def profile(request):
+    """Collapsed stacks sampled so far, when the profiler is enabled."""
+    profiler = get_profiler()
+    if profiler is None:
+        return web.json_response({"error": "Profiler disabled, set CODERAG_PROFILE_INTERVAL"}, status=404)
+    return web.Response(text=profiler.collapsed(), content_type="text/plain")
+
+async def _startup(app):
+    loop = asyncio.get_running_loop()
+    start_profiler()
+    # Models and clients are loaded once and shared by every session
+    await loop.run_in_executor(app["executor"], warmup)
+
+async def _cleanup(app):
+    loop = asyncio.get_running_loop()
+    # Finish queued re-indexing before the embedder is released
+    await loop.run_in_executor(app["executor"], reindex_queue.close)
+    await loop.run_in_executor(app["executor"], shutdown)
+    app["executor"].shutdown(wait=False)
+    stop_profiler()
+
+def create_app(session_ttl: float = SESSION_TTL, threads: int = SERVER_THREADS) -> web.Application:
+    """Build the server application; models are loaded when it starts."""
+    app = web.Application()
+    app["sessions"] = SessionStore(session_ttl)
+    app["executor"] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="coderag-session")
+    app.on_startup.append(_startup)
+    app.on_cleanup.append(_cleanup)
+    app.router.add_get("/health", health)
+    app.router.add_post("/sessions", create_session)
+    app.router.add_get("/sessions/{session_id}", get_session)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_post("/sessions/{session_id}/messages", post_message)
+    app.router.add_get("/sessions/{session_id}/ws", websocket)
+    app.router.add_get("/ws", websocket)
+    app.router.add_get("/metrics", prometheus_metrics)
+    app.router.add_get("/traces", list_traces)
+    app.router.add_get("/traces/{trace_id}", get_trace_detail)
+    app.router.add_get("/profile", profile)
+    return app
+
+def main():
+    web.run_app(create_app(), host=SERVER_HOST, port=SERVER_PORT)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+This tool is used to edit part of a code file: replace or insert lines, or replace an exact snippet.
+Only the edited part of the file is sent by the model and only changed chunks are re-indexed.
+"""
+
+import bisect
+import os
+from dotenv import load_dotenv
+from utils.file_cache import FileEntry, content_version, invalidate_file_contents
+from embedding.incremental import snapshot_file
+from embedding.reindex_queue import reindex_queue, queue_reindex
+from typing import Dict, List
+
+load_dotenv()
+
+CODE_REPO_PATH = os.getenv("CODE_REPO_PATH")
+
+# Unchanged lines shown around each edited region in the result
+EDIT_CONTEXT_LINES = 2
+
+def _with_newline(code: bytes, needed: bool) -> bytes:
+    """Terminate inserted code with a newline when the text it replaces had one."""
+    if code and needed and not code.endswith(b"\n"):
+        return code + b"\n"
+    return code
+
+def _resolve_edit(entry: FileEntry, data: bytes, edit: Dict, number: int):
+    """
+    Turn one edit into the byte range it replaces in the current file and its replacement.
+
+    Returns:
+        tuple: (start byte, end byte, replacement bytes)
+    """
+    kind = edit.get("type")
+    if kind == "replace":
+        start_line, end_line = edit.get("start_line"), edit.get("end_line")
+        if not isinstance(start_line, int) or not isinstance(end_line, int):
+            raise ValueError(f"Edit {number}: replace needs integer start_line and end_line")
+        if start_line < 1 or end_line > entry.line_count or start_line > end_line:
+            raise ValueError(f"Edit {number}: lines {start_line}-{end_line} are outside the file's "
+                             f"{entry.line_count} lines")
+        start, end = entry.byte_range(start_line - 1, end_line)
+        code = edit.get("new_code", "").encode("utf-8")
+        return start, end, _with_newline(code, data[end - 1:end] in (b"\n", b"\r"))
+
+    if kind == "insert":
+        line = edit.get("line")
+        if not isinstance(line, int) or not 0 <= line <= entry.line_count:
+            raise ValueError(f"Edit {number}: insert needs a line between 0 and {entry.line_count}")
+        start, _ = entry.byte_range(line, line)
+        code = _with_newline(edit.get("new_code", "").encode("utf-8"), True)
+        if code and start == len(data) and data and not data.endswith((b"\n", b"\r")):
+            # Appending after a last line that has no newline
+            code = b"\n" + code
+        return start, start, code
+
+    if kind == "search_replace":
+        search = edit.get("search")
+        if not isinstance(search, str) or not search:
+            raise ValueError(f"Edit {number}: search_replace needs a non-empty search string")
+        needle = search.encode("utf-8")
+        start = data.find(needle)
+        if start < 0:
+            raise ValueError(f"Edit {number}: search text not found; read the file again")
+        if data.find(needle, start + 1) >= 0:
+            raise ValueError(f"Edit {number}: search text occurs more than once; include more context")
+        return start, start + len(needle), edit.get("replace", "").encode("utf-8")
+
+    raise ValueError(f"Edit {number}: unknown type {kind!r}, expected replace, insert or search_replace")
+
+def apply_edits(data: bytes, edits: List[Dict]):
+    """
+    Apply edits to a file's bytes. Line numbers and search texts refer to the
+    content before any of the edits; edits may not overlap.
+
+    Returns:
+        tuple: (new bytes, byte offset of the first change, [(start, end)] byte ranges
+            of the replacements in the new bytes)
+    """
+    if not edits:
+        raise ValueError("No edits given")
+    entry = FileEntry(None, data)
+    resolved = sorted(
+        (_resolve_edit(entry, data, edit, number) + (number,) for number, edit in enumerate(edits, 1)),
+        key=lambda item: (item[0], item[1], item[3])
+    )
+    for previous, current in zip(resolved, resolved[1:]):
+        if current[0] < previous[1]:
+            raise ValueError(f"Edits {previous[3]} and {current[3]} overlap")
+
+    pieces, regions = [], []
+    position = shift = 0
+    for start, end, code, _ in resolved:
+        pieces.append(data[position:start])
+        pieces.append(code)
+        regions.append((start + shift, start + shift + len(code)))
+        shift += len(code) - (end - start)
+        position = end
+    pieces.append(data[position:])
+    return b"".join(pieces), resolved[0][0], regions
+
+def _excerpt(data: bytes, regions) -> str:
+    """Show the edited regions of the new content with a few lines of context."""
+    entry = FileEntry(None, data)
+    starts = entry.line_starts.tolist()
+    windows = []
+    for start, end in regions:
+        first = max(bisect.bisect_right(starts, start) - 1 - EDIT_CONTEXT_LINES, 0)
+        last = min(bisect.bisect_right(starts, max(end - 1, start)) + EDIT_CONTEXT_LINES, entry.line_count)
+        if windows and first <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], last)
+        else:
+            windows.append([first, last])
+    parts = []
+    for first, last in windows:
+        begin, finish = entry.byte_range(first, last)
+        parts.append(f"Lines {first + 1}-{last}:\n{data[begin:finish].decode('utf-8', errors='replace')}")
+    return "\n".join(parts)
+
+def edit_code_file(file_path, edits, expected_version=None):
+    """
+    Edits part of a code file and updates its embeddings.
+
+    Each edit is one of:
+        {"type": "replace", "start_line", "end_line", "new_code"}: replace lines start_line-end_line
+            (1-based, inclusive); an empty new_code deletes them
+        {"type": "insert", "line", "new_code"}: insert new_code after line (0 inserts at the top)
+        {"type": "search_replace", "search", "replace"}: replace the single exact occurrence of search
+
+    Line numbers and search texts all refer to the file before the edits.
+    The file is rewritten from the first changed byte on. Re-indexing is
+    queued in the background and only touches the chunks whose code or
+    position changed; only chunks overlapping an edit need a new summary.
+
+    Parameters:
+        file_path (str): Path to the file to edit (relative or absolute)
+        edits (list): Edits to apply together
+        expected_version (str, optional): Version of the file the edits were written against,
+            as reported by read_code_file or a previous edit
+
+    Returns:
+        str: Success message with the new version and the edited regions
+
+    Raises:
+        FileNotFoundError: If the specified file doesn't exist
+        ValueError: If the file changed since expected_version, or an edit is invalid
+        IOError: If there's an error writing the file
+    """
+    try:
+        # Convert relative path to absolute path if needed
+        if not os.path.isabs(file_path):
+            file_path = os.path.join(os.getenv("CODE_REPO_PATH"), file_path.lstrip('/'))
+
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        version = content_version(data)
+        if expected_version and expected_version != version:
+            raise ValueError(f"{file_path} changed since version {expected_version} (now {version}); "
+                             "read it again before editing")
+
+        new_data, first_change, regions = apply_edits(data, edits)
+
+        # Remember the content the index holds, unless a queued re-index already did
+        previous = None
+        if reindex_queue.needs_snapshot(file_path):
+            previous = snapshot_file(file_path, defer_parse=True)
+
+        # Rewrite only from the first change on
+        with open(file_path, 'r+b') as file:
+            file.seek(first_change)
+            file.write(new_data[first_change:])
+            file.truncate()
+        invalidate_file_contents(file_path)
+
+        # Re-embed only the chunks that changed, off the agent's turn
+        queue_reindex(file_path, previous)
+
+        return (f"File edited at: {file_path}\n"
+                f"Applied {len(edits)} edit(s). Version: {content_version(new_data)}\n\n"
+                f"{_excerpt(new_data, regions)}")
+
+    except FileNotFoundError:
+        raise FileNotFoundError(f"File not found at path: {file_path}")
+    except IOError as e:
+        raise IOError(f"Error editing file {file_path}: {str(e)}")
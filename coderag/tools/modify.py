@@ -1,35 +1,24 @@
 """
-This tool is used to modify a code file by either replacing a range of lines or inserting new code.
+This tool is used to replace the entire content of a code file and queue the update of its embeddings.
 """
 
 import os
 from dotenv import load_dotenv
-from embedding.embedd import CodeEmbedder
-from embedding.summarizer import process_file
-from typing import List, Dict
+from embedding.incremental import snapshot_file
+from embedding.reindex_queue import reindex_queue, queue_reindex
+from utils.file_cache import invalidate_file_contents
 
 load_dotenv()
 
 CODE_REPO_PATH = os.getenv("CODE_REPO_PATH")
 
-def delete_file_embeddings(namespace, file_path: str) -> None:
-    """
-    Delete all embeddings for a specific file from TurboPuffer.
-    
-    Args:
-        namespace: TurboPuffer namespace
-        file_path (str): Path to the file whose embeddings should be deleted
-    """
-    # Delete documents where file_path matches exactly
-    rows_affected = namespace.delete_by_filter(
-        ['file_path', 'Eq', file_path]
-    )
-    
-    print(f"Deleted {rows_affected} embeddings for file: {file_path}")
-
 def modify_code_file(file_path, new_code):
     """
-    Replaces the entire content of a code file and updates its embeddings in TurboPuffer.
+    Replaces the entire content of a code file and updates its embeddings in the search index.
+
+    The index is updated in the background: only the chunks that changed
+    are re-summarized and re-embedded, and the rest of the file's
+    embeddings are left in place.
 
     Parameters:
         file_path (str): Path to the file to modify (relative or absolute)
@@ -47,26 +36,24 @@ def modify_code_file(file_path, new_code):
         if not os.path.isabs(file_path):
             file_path = os.path.join(os.getenv("CODE_REPO_PATH"), file_path.lstrip('/'))
 
-        # Initialize embedder
-        embedder = CodeEmbedder()
-        
-        # Delete existing embeddings for this file
-        delete_file_embeddings(embedder.namespace, file_path)
+        # Remember the content the index holds, unless a queued re-index already did
+        previous = None
+        if reindex_queue.needs_snapshot(file_path):
+            previous = snapshot_file(file_path, defer_parse=True)
             
         # Write new content to file
         with open(file_path, 'w', encoding='utf-8') as file:
             file.write(new_code)
+        invalidate_file_contents(file_path)
         
-        # Process and embed the updated file
-        _, chunks = process_file(file_path)
-        if chunks:
-            embedder.embed_chunks(chunks)
+        # Re-embed only the chunks that changed, off the agent's turn
+        queue_reindex(file_path, previous)
             
         # Read and return the updated content
         with open(file_path, 'r', encoding='utf-8') as file:
             updated_content = file.read()
             
-        return f"File modified and re-embedded successfully at: {file_path}\n", updated_content
+        return f"File modified successfully at: {file_path} (search index update queued)\n", updated_content
         
     except FileNotFoundError:
         raise FileNotFoundError(f"File not found at path: {file_path}")
@@ -116,7 +103,7 @@ if __name__ == "__main__":
         print(content)
         print("-" * 40)
         
-        print("\nVerification complete. You can check the file and TurboPuffer embeddings.")
+        print("\nVerification complete. You can check the file and its search index entries.")
         
     except (FileNotFoundError, IOError) as e:
         print(f"Error: {e}")
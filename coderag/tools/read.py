@@ -5,6 +5,7 @@ It can read the entire file or a specific line range.
 
 import os
 from dotenv import load_dotenv
+from utils.file_cache import file_cache
 
 load_dotenv()
 
@@ -33,26 +34,25 @@ def read_code_file(file_path, start_line=None, end_line=None):
         if not os.path.isabs(file_path):
             file_path = os.path.join(os.getenv("CODE_REPO_PATH"), file_path.lstrip('/'))
         
-        with open(file_path, 'r', encoding='utf-8') as file:
-            if start_line is None and end_line is None:
-                return file.read()
-            
-            # Convert to 0-based indexing
-            start = (start_line - 1) if start_line else 0
-            
-            # Read all lines
-            lines = file.readlines()
+        if start_line is None and end_line is None:
+            return file_cache.read(file_path)
+        
+        # Convert to 0-based indexing
+        start = (start_line - 1) if start_line else 0
+        
+        # Line count comes from the cached line index instead of reading all lines
+        line_count = file_cache.line_count(file_path)
+        
+        if start_line and start_line < 1:
+            raise ValueError("start_line must be greater than 0")
+        if end_line and end_line > line_count:
+            raise ValueError(f"end_line exceeds file length of {line_count} lines")
+        if start_line and end_line and start_line > end_line:
+            raise ValueError("start_line cannot be greater than end_line")
             
-            if start_line and start_line < 1:
-                raise ValueError("start_line must be greater than 0")
-            if end_line and end_line > len(lines):
-                raise ValueError(f"end_line exceeds file length of {len(lines)} lines")
-            if start_line and end_line and start_line > end_line:
-                raise ValueError("start_line cannot be greater than end_line")
-                
-            # Select specified range
-            selected_lines = lines[start:end_line]
-            return ''.join(selected_lines)
+        # Select specified range, reading only its bytes
+        start, end, _ = slice(start, end_line).indices(line_count)
+        return file_cache.read_lines(file_path, start, end)
             
     except FileNotFoundError:
         raise FileNotFoundError(f"File not found at path: {file_path}")
@@ -1,25 +1,50 @@
-from embedding.embedd import CodeEmbedder
+import os
+
+from utils.registry import get_code_embedder
+from embedding.reindex_queue import reindex_queue
+
+# Seconds a search waits for pending re-indexing before it searches the index as it is
+SEARCH_FLUSH_TIMEOUT = float(os.getenv("CODERAG_SEARCH_FLUSH_TIMEOUT", "30"))
+
+def _wait_for_reindex(file_paths):
+    """Wait a bounded time for files to be re-indexed; True if they all are."""
+    if reindex_queue.flush(file_paths, timeout=SEARCH_FLUSH_TIMEOUT):
+        return True
+    print(f"Re-indexing {len(file_paths)} file(s) took over {SEARCH_FLUSH_TIMEOUT}s, searching the current index")
+    return False
 
 def search_similar_code(query):
-    code_embedder = CodeEmbedder()
+    code_embedder = get_code_embedder()
+    
+    # Files written but not indexed yet could match any query
+    new_files = reindex_queue.new_files()
+    if new_files:
+        _wait_for_reindex(new_files)
     results = code_embedder.search(query, n_results=5)
     
+    # Results from files with a pending re-index are stale; wait for those files and search again
+    dirty = {metadata['file_path'] for metadata in results['metadatas'][0]} & reindex_queue.dirty_files()
+    if dirty and _wait_for_reindex(dirty):
+        results = code_embedder.search(query, n_results=5)
+    
     output = []
     for i, (summary, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0]), 1):
         result = f"\n=== Result {i} ===\n"
         result += f"File: {metadata['file_path']}\n"
         result += f"Type: {metadata['type']}\n"
         result += f"Name: {metadata['name']}\n"
+        if metadata.get('start_line'):
+            result += f"Lines: {metadata['start_line']}-{metadata.get('end_line', '')}\n"
         result += "\nSummary:\n"
         result += f"{summary}\n"
         result += "\nCode:\n"
         result += f"{metadata['code']}\n"
         result += "\nDocstring:\n"
-        result += f"{metadata['docstring']}\n"
+        result += f"{metadata.get('docstring', '')}\n"
         result += "\nFunction Calls:\n"
-        result += f"{metadata['function_calls']}\n"
+        result += f"{metadata.get('function_calls', '')}\n"
         result += "\nClass Instances:\n"
-        result += f"{metadata['class_instances']}\n"
+        result += f"{metadata.get('class_instances', '')}\n"
         result += "=" * 50 + "\n"
         output.append(result)
     
@@ -0,0 +1,66 @@
+"""
+This tool is used to expand part of the codebase structure.
+The system prompt may only hold a compressed outline of a large codebase;
+this tool renders a directory or file in more detail on demand.
+"""
+
+import os
+from dotenv import load_dotenv
+from utils.parser import (
+    get_structure_cache,
+    render_codebase_structure,
+    render_file_info
+)
+
+load_dotenv()
+
+CODE_REPO_PATH = os.getenv("CODE_REPO_PATH")
+# Approximate tokens a single expansion may return
+STRUCTURE_EXPAND_TOKEN_BUDGET = int(os.getenv("CODERAG_STRUCTURE_EXPAND_TOKEN_BUDGET", "4000"))
+
+def expand_codebase_structure(path, token_budget=None):
+    """
+    Returns the detailed structure of a directory or Python file in the codebase.
+    Automatically resolves relative paths to absolute paths using CODE_REPO_PATH.
+
+    Directories are rendered at the most detailed level that fits the token
+    budget; a Python file is always rendered in full (classes, attributes,
+    methods, docstrings, returns and imports).
+
+    Parameters:
+        path (str): Directory or Python file to expand (relative or absolute)
+        token_budget (int, optional): Approximate maximum size of the result in tokens.
+            Defaults to CODERAG_STRUCTURE_EXPAND_TOKEN_BUDGET.
+
+    Returns:
+        str: The structure of the directory or file
+
+    Raises:
+        FileNotFoundError: If the path does not exist
+        ValueError: If the path is a file but not a Python file
+    """
+    # Convert relative path to absolute path if needed
+    if not os.path.isabs(path):
+        path = os.path.join(os.getenv("CODE_REPO_PATH"), path.lstrip('/'))
+    path = os.path.normpath(path)
+
+    if os.path.isdir(path):
+        structure, detail = render_codebase_structure(path, token_budget or STRUCTURE_EXPAND_TOKEN_BUDGET)
+        if detail != "full":
+            structure += f"\n\n(Shown at '{detail}' detail to fit the token budget; expand a subdirectory or file for more.)"
+        return structure
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Path not found: {path}")
+    if not path.endswith('.py'):
+        raise ValueError(f"Only directories and Python files can be expanded: {path}")
+
+    record = get_structure_cache().get_many([path])[path]
+    if isinstance(record, Exception):
+        return f"{os.path.basename(path)}\n| Error parsing file: {str(record)}"
+    return f"{os.path.basename(path)}\n{render_file_info(record, '  ')}"
+
+
+if __name__ == "__main__":
+    # Example usage
+    print(expand_codebase_structure(CODE_REPO_PATH or "."))
@@ -1,7 +1,8 @@
 import os
 from dotenv import load_dotenv
-from embedding.embedd import CodeEmbedder
-from embedding.summarizer import process_file
+from embedding.incremental import snapshot_file
+from embedding.reindex_queue import reindex_queue, queue_reindex
+from utils.file_cache import invalidate_file_contents
 
 load_dotenv()
 
@@ -9,7 +10,7 @@ CODE_REPO_PATH = os.getenv("CODE_REPO_PATH")
 
 def create_code_file(file_path, code):
     """
-    Creates a new file at the given file path and embeds it in ChromaDB.
+    Creates a new file at the given file path and queues its embedding.
     Automatically resolves relative paths to absolute paths using CODE_REPO_PATH.
 
     Parameters:
@@ -28,21 +29,25 @@ def create_code_file(file_path, code):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+    # An overwritten file is diffed against the content the index holds
+    is_new_file = not os.path.exists(file_path)
+    previous = None
+    if not is_new_file and reindex_queue.needs_snapshot(file_path):
+        previous = snapshot_file(file_path, defer_parse=True)
+
     # Write the code to the file
     with open(file_path, "w", encoding="utf-8") as f:
         f.write(code)
+    invalidate_file_contents(file_path)
     
-    # Initialize embedder and embed the new file
-    embedder = CodeEmbedder()
-    _, chunks = process_file(file_path)
-    if chunks:
-        embedder.embed_chunks(chunks)
+    # Embed the file in the background; searches wait for it only if they need it
+    queue_reindex(file_path, previous, is_new=is_new_file)
     
     # Read and return the file content
     with open(file_path, "r") as file:
         content = file.read()
 
-    return (f"File created and embedded at: {file_path}\n", content)
+    return (f"File created at: {file_path} (search index update queued)\n", content)
 
 
 # Example usage:
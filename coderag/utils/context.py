@@ -0,0 +1,239 @@
+"""Conversation history with prompt-cache breakpoints, token accounting and compaction."""
+import copy
+import json
+import os
+import re
+
+from utils.parser import estimate_tokens
+
+# Approximate prompt size above which old tool results are compacted
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CODERAG_CONTEXT_TOKEN_BUDGET", "100000"))
+# Tool result messages at the end of the history that are never compacted
+CONTEXT_KEEP_RECENT = int(os.getenv("CODERAG_CONTEXT_KEEP_RECENT", "2"))
+# Tool results and inputs shorter than this are kept as they are
+_COMPACT_MIN_CHARS = 400
+
+_CACHE_CONTROL = {"type": "ephemeral"}
+_SEARCH_LOCATION = re.compile(r"^(File|Type|Name|Lines): .*$", re.MULTILINE)
+_VERSION_FOOTER = re.compile(r"\n\[Version: (\w+)\]$")
+_VERSION = re.compile(r"Version: (\w+)")
+# Tools whose input carries code written to a file
+_WRITE_TOOLS = ("modify_code_file", "create_code_file", "edit_code_file")
+
+def _to_param(block):
+    """Turn an SDK content block into the plain dict sent back to the API."""
+    if isinstance(block, dict):
+        return block
+    if hasattr(block, "model_dump"):
+        return block.model_dump(exclude_none=True)
+    return {key: value for key, value in vars(block).items() if value is not None}
+
+def _as_blocks(content):
+    """Content of a message as a list of blocks."""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content}]
+    return list(content)
+
+def _with_cache_control(message):
+    """Return a copy of a message whose last content block is a cache breakpoint."""
+    message = dict(message)
+    content = [dict(block) for block in _as_blocks(message["content"])]
+    content[-1]["cache_control"] = _CACHE_CONTROL
+    message["content"] = content
+    return message
+
+def _line_count(text):
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+def _compact_tool_result(tool_name, tool_input, content):
+    """
+    Describe an old tool result in a line or two, keeping paths and line ranges.
+
+    Returns:
+        str: Replacement content, or None to keep the result as it is
+    """
+    if len(content) < _COMPACT_MIN_CHARS:
+        return None
+    path = tool_input.get("file_path") or tool_input.get("path")
+    if tool_name == "read_code_file":
+        footer = _VERSION_FOOTER.search(content)
+        if footer:
+            content = content[:footer.start()]
+        start = tool_input.get("start_line") or 1
+        end = tool_input.get("end_line") or start + _line_count(content) - 1
+        version = f" (version {footer.group(1)})" if footer else ""
+        return f"[Compacted: contents of {path}{version}, lines {start}-{end}. Read the file again if you need them.]"
+    if tool_name in _WRITE_TOOLS:
+        version = _VERSION.search(content)
+        version = f" (version {version.group(1)})" if version else ""
+        return f"[Compacted: {path} was written{version}. Read the file again if you need its contents.]"
+    if tool_name == "search_similar_code":
+        locations = "\n".join(match.group(0) for match in _SEARCH_LOCATION.finditer(content))
+        return f"[Compacted search results for {tool_input.get('query')!r}; code elided]\n{locations}"
+    if tool_name == "expand_codebase_structure":
+        return f"[Compacted: structure of {path}. Expand it again if you need it.]"
+    return f"{content[:_COMPACT_MIN_CHARS]}\n[Compacted: {len(content) - _COMPACT_MIN_CHARS} more characters elided]"
+
+class ConversationContext:
+    def __init__(self, messages=None, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 keep_recent: int = CONTEXT_KEEP_RECENT):
+        """
+        Conversation history of one session, shaped for cheap repeated requests.
+
+        Requests carry prompt-cache breakpoints on the tool definitions, the
+        system prompt, the history sent in the previous request and the end
+        of the current history, so each call only pays full price for what
+        was added since the last one. Token usage reported by the API is
+        accumulated per session. When the prompt grows past the budget, tool
+        results older than the most recent ones are replaced by one-line
+        descriptions (paths and line ranges, no file bodies), as are the file
+        contents in old write tool inputs; this happens in one sweep so the
+        cached prefix stays stable between sweeps.
+
+        Args:
+            messages (list, optional): Existing history, used and extended in place
+            token_budget (int): Approximate prompt size that triggers compaction
+            keep_recent (int): Number of latest tool result messages never compacted
+        """
+        self.messages = messages if messages is not None else []
+        self.token_budget = token_budget
+        self.keep_recent = keep_recent
+        self.usage = {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+        self.compactions = 0
+        # tool_use IDs whose results were already compacted
+        self._compacted = set()
+        # Prompt size of the last request and the history length it covered
+        self._last_prompt_tokens = None
+        self._last_message_count = 0
+        # History length sent in the previous request, the stable prefix of the next one
+        self._previous_request_length = 0
+
+    def add_user(self, content) -> None:
+        """
+        Append a user message (text or tool_result blocks).
+
+        A turn that ended on tool results already ends with a user message;
+        the new content is added to it so roles keep alternating.
+        """
+        if self.messages and self.messages[-1]["role"] == "user":
+            last = self.messages[-1]
+            last["content"] = _as_blocks(last["content"]) + _as_blocks(content)
+            return
+        self.messages.append({"role": "user", "content": content})
+
+    def add_assistant(self, content) -> None:
+        """Append an assistant message, converting SDK blocks to plain dicts."""
+        self.messages.append({"role": "assistant", "content": [_to_param(block) for block in content]})
+
+    def record_usage(self, usage) -> None:
+        """Accumulate the token usage of one API response."""
+        if usage is None:
+            return
+        self.usage["requests"] += 1
+        for key in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+            self.usage[key] += getattr(usage, key, None) or 0
+        self._last_prompt_tokens = ((getattr(usage, "input_tokens", None) or 0)
+                                    + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+                                    + (getattr(usage, "cache_read_input_tokens", None) or 0))
+
+    def prompt_tokens(self) -> int:
+        """Approximate size of the history if it were sent now."""
+        if self._last_prompt_tokens is None:
+            return estimate_tokens(json.dumps(self.messages, default=str))
+        added = self.messages[self._last_message_count:]
+        return self._last_prompt_tokens + estimate_tokens(json.dumps(added, default=str))
+
+    def compact(self) -> int:
+        """
+        Replace old tool results and write tool inputs with short descriptions.
+
+        Returns:
+            int: Number of compacted blocks
+        """
+        result_indexes = [index for index, message in enumerate(self.messages)
+                          if message["role"] == "user" and isinstance(message["content"], list)
+                          and any(block.get("type") == "tool_result" for block in message["content"])]
+        protected = result_indexes[-self.keep_recent:] if self.keep_recent > 0 else []
+        end = protected[0] if protected else len(self.messages)
+
+        tool_uses = {}
+        compacted = 0
+        for index, message in enumerate(self.messages[:end]):
+            if not isinstance(message["content"], list):
+                continue
+            for block in message["content"]:
+                if block.get("type") == "tool_use":
+                    tool_uses[block["id"]] = block
+                    # The calls answered by the first protected result message stay intact
+                    if block.get("name") in _WRITE_TOOLS and index < end - 1:
+                        compacted += self._compact_tool_input(block)
+                elif block.get("type") == "tool_result" and block["tool_use_id"] not in self._compacted:
+                    tool_use = tool_uses.get(block["tool_use_id"], {})
+                    content = block.get("content")
+                    if not isinstance(content, str):
+                        continue
+                    replacement = _compact_tool_result(tool_use.get("name"), tool_use.get("input", {}), content)
+                    if replacement is not None:
+                        block["content"] = replacement
+                        self._compacted.add(block["tool_use_id"])
+                        compacted += 1
+
+        if compacted:
+            self.compactions += 1
+            self._last_prompt_tokens = None
+        return compacted
+
+    @staticmethod
+    def _compact_code_fields(fields: dict, keys) -> dict:
+        """Return fields with long code strings under keys replaced by a line count, or None if none are."""
+        replaced = {key: f"[Compacted: {_line_count(fields[key])} lines]" for key in keys
+                    if isinstance(fields.get(key), str) and len(fields[key]) >= _COMPACT_MIN_CHARS}
+        return dict(fields, **replaced) if replaced else None
+
+    @classmethod
+    def _compact_tool_input(cls, block) -> int:
+        tool_input = block.get("input") or {}
+        if isinstance(tool_input.get("edits"), list):
+            edits = [cls._compact_code_fields(edit, ("new_code", "search", "replace")) or edit
+                     if isinstance(edit, dict) else edit for edit in tool_input["edits"]]
+            if edits == tool_input["edits"]:
+                return 0
+            block["input"] = dict(tool_input, edits=edits)
+            return 1
+        compacted = cls._compact_code_fields(tool_input, ("new_code", "code"))
+        if compacted is None:
+            return 0
+        block["input"] = compacted
+        return 1
+
+    def request(self, system_prompt: str, tools: list) -> dict:
+        """
+        Build the system, tools and messages arguments of the next API request.
+
+        Compacts the history first if it has outgrown the budget.
+
+        Returns:
+            dict: Keyword arguments for client.messages.create/stream
+        """
+        if self.prompt_tokens() > self.token_budget:
+            self.compact()
+
+        messages = [dict(message) for message in self.messages]
+        # Breakpoints on the end of the previous request and the end of this one
+        for index in {self._previous_request_length - 1, len(messages) - 1}:
+            if 0 <= index < len(messages) and messages[index]["content"]:
+                messages[index] = _with_cache_control(messages[index])
+        self._previous_request_length = len(messages)
+        self._last_message_count = len(messages)
+
+        tools = copy.copy(tools)
+        if tools:
+            tools[-1] = dict(tools[-1], cache_control=_CACHE_CONTROL)
+        system = [{"type": "text", "text": system_prompt, "cache_control": _CACHE_CONTROL}]
+        return {"system": system, "tools": tools, "messages": messages}
@@ -0,0 +1,169 @@
+"""Line-offset index and bounded LRU of file contents for ranged reads."""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Files whose line index is kept in memory
+FILE_CACHE_SIZE = int(os.getenv("CODERAG_FILE_CACHE_SIZE", "256"))
+# Total bytes of file contents kept in memory; larger files are read by byte range from disk
+FILE_CACHE_BYTES = int(os.getenv("CODERAG_FILE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+def _file_key(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def content_version(data: bytes) -> str:
+    """Short content hash identifying one version of a file."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def _decode(data: bytes) -> str:
+    """Decode like a text-mode read: UTF-8 with universal newlines."""
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+class FileEntry:
+    """The line index of one version of a file and, if it fits the budget, its bytes."""
+    __slots__ = ("key", "version", "line_starts", "line_count", "data")
+
+    def __init__(self, key, data: bytes):
+        self.key = key
+        self.version = content_version(data)
+        # Universal newlines, like a text-mode read: \n, \r\n and a bare \r each end a line
+        raw = np.frombuffer(data, dtype=np.uint8)
+        line_feeds = raw == 0x0A
+        # A \r followed by \n ends its line at the \n
+        carriage_returns = raw == 0x0D
+        carriage_returns[:-1] &= ~line_feeds[1:]
+        newlines = np.flatnonzero(line_feeds | carriage_returns)
+        # Byte offset of every line start, followed by the file size
+        dtype = np.uint32 if len(data) < 2 ** 32 else np.uint64
+        self.line_starts = np.concatenate(([0], newlines + 1, [len(data)])).astype(dtype)
+        if len(data) and data[-1:] not in (b"\n", b"\r"):
+            self.line_count = len(newlines) + 1
+        else:
+            self.line_count = len(newlines)
+            self.line_starts = self.line_starts[:-1]
+        self.data = data
+
+    def byte_range(self, start: int, end: int):
+        """Byte offsets spanning lines [start, end) (0-based), clamped like a list slice."""
+        start = min(max(start, 0), self.line_count)
+        end = min(max(end, start), self.line_count)
+        return int(self.line_starts[start]), int(self.line_starts[end])
+
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else 0
+
+class FileCache:
+    def __init__(self, max_files: int = FILE_CACHE_SIZE, max_bytes: int = FILE_CACHE_BYTES):
+        """
+        Per-file line-offset indexes and a bounded LRU of hot file contents.
+
+        The first read of a file builds the byte offset of every line start.
+        After that a ranged read costs a stat and a read of exactly the bytes
+        of the requested lines, or a slice of the cached contents, instead of
+        reading and splitting the whole file. Entries are keyed by inode,
+        size and mtime, so a file changed behind the cache's back is indexed
+        again; the write tools also invalidate the files they write.
+
+        Args:
+            max_files (int): Maximum number of indexed files
+            max_bytes (int): Maximum total size of cached contents
+        """
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, file_path: str, key):
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None or entry.key != key:
+                return None
+            self._entries.move_to_end(file_path)
+            return entry
+
+    def _store(self, file_path: str, entry: FileEntry) -> None:
+        with self._lock:
+            previous = self._entries.pop(file_path, None)
+            if previous is not None:
+                self._bytes -= previous.size()
+            if entry.data is not None and entry.size() > self.max_bytes:
+                # Too large to hold; keep only the line index
+                entry.data = None
+            self._entries[file_path] = entry
+            self._bytes += entry.size()
+            while len(self._entries) > self.max_files:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size()
+            # Over the byte budget, the oldest entries keep their index but lose their contents
+            for evicted in self._entries.values():
+                if self._bytes <= self.max_bytes:
+                    break
+                self._bytes -= evicted.size()
+                evicted.data = None
+
+    def _load(self, file_path: str) -> FileEntry:
+        with open(file_path, "rb") as file:
+            key = _file_key(os.fstat(file.fileno()))
+            entry = FileEntry(key, file.read())
+        self._store(file_path, entry)
+        return entry
+
+    def _entry(self, file_path: str) -> FileEntry:
+        entry = self._lookup(file_path, _file_key(os.stat(file_path)))
+        return entry if entry is not None else self._load(file_path)
+
+    def read(self, file_path: str) -> str:
+        """Return the whole content of a file."""
+        data = self._entry(file_path).data
+        if data is not None:
+            return _decode(data)
+        with open(file_path, "rb") as file:
+            return _decode(file.read())
+
+    def version(self, file_path: str) -> str:
+        """Return the content version of a file, see content_version."""
+        return self._entry(file_path).version
+
+    def line_count(self, file_path: str) -> int:
+        """Return the number of lines of a file, as readlines() would count them."""
+        return self._entry(file_path).line_count
+
+    def read_lines(self, file_path: str, start: int, end: int = None) -> str:
+        """
+        Return lines [start, end) of a file (0-based, end exclusive), like a slice of readlines().
+
+        Args:
+            file_path (str): Absolute path of the file
+            start (int): Index of the first line
+            end (int, optional): Index after the last line. Defaults to the end of the file.
+        """
+        entry = self._entry(file_path)
+        begin, finish = entry.byte_range(start, entry.line_count if end is None else end)
+        data = entry.data
+        if data is not None:
+            return _decode(data[begin:finish])
+        with open(file_path, "rb") as file:
+            file.seek(begin)
+            chunk = file.read(finish - begin)
+            if _file_key(os.fstat(file.fileno())) == entry.key:
+                return _decode(chunk)
+        # The file changed between the stat and the read; index it again
+        self.invalidate(file_path)
+        return self.read_lines(file_path, start, end)
+
+    def invalidate(self, file_path: str) -> None:
+        """Drop the cached index and contents of a file, e.g. after writing it."""
+        with self._lock:
+            entry = self._entries.pop(file_path, None)
+            if entry is not None:
+                self._bytes -= entry.size()
+
+file_cache = FileCache()
+
+def invalidate_file_contents(file_path: str) -> None:
+    """Forget the cached lines of a file that was just written."""
+    file_cache.invalidate(file_path)
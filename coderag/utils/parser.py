@@ -1,10 +1,30 @@
 import tree_sitter_python as tspython
 from tree_sitter import Language, Parser
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import hashlib
+import json
+import multiprocessing
 import os
+import sqlite3
+import threading
+
+from embedding.cache import CODERAG_CACHE_DIR
 
 PY_LANGUAGE = Language(tspython.language())
 parser = Parser(PY_LANGUAGE)
 
+STRUCTURE_CACHE_PATH = os.getenv("CODERAG_STRUCTURE_CACHE_PATH", os.path.join(CODERAG_CACHE_DIR, "structure.sqlite3"))
+# Below this many uncached files, parsing in-process beats starting a pool
+STRUCTURE_PARALLEL_THRESHOLD = int(os.getenv("CODERAG_STRUCTURE_PARALLEL_THRESHOLD", "32"))
+# Pool workers are never forked from this process: its other threads may hold locks a fork would copy
+_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+# Approximate tokens the codebase structure may take up in the system prompt
+STRUCTURE_TOKEN_BUDGET = int(os.getenv("CODERAG_STRUCTURE_TOKEN_BUDGET", "8000"))
+
+# Structure detail levels, most detailed first
+STRUCTURE_DETAIL_LEVELS = ("full", "symbols", "names", "modules", "directories")
+
 def get_node_text(node, code_bytes):
     """Helper function to get node text"""
     return code_bytes[node.start_byte:node.end_byte].decode("utf-8")
@@ -47,120 +67,508 @@ def get_assignments(body_node, code_bytes):
                     ))
     return assignments
 
-def get_file_info(code_bytes, root_node, indent=""):
-    """Extract detailed information about a single Python file."""
-    info = []
-    
+# One query over the whole tree replaces walking every subtree in Python
+_SYMBOL_QUERY = PY_LANGUAGE.query("""
+(call function: (_) @call)
+(class_definition name: (identifier) @class_name)
+""")
+
+def read_source(path):
+    """
+    Read a Python file the way the chunker and structure view both expect.
+
+    Returns:
+        tuple: (content hash of the raw bytes, UTF-8 code bytes with newlines normalized)
+    """
+    with open(path, 'rb') as file:
+        raw = file.read()
+    content_hash = hashlib.sha256(raw).hexdigest()
+    # Same result as reading in text mode, so invalid UTF-8 still fails here
+    code_str = raw.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+    return content_hash, bytes(code_str, "utf8")
+
+def _point(code_bytes, offset):
+    """Return the (row, column) tree-sitter point of a byte offset."""
+    row = code_bytes.count(b"\n", 0, offset)
+    return row, offset - (code_bytes.rfind(b"\n", 0, offset) + 1)
+
+def _common_prefix_length(a, b, limit):
+    """Length of the common prefix of two byte strings, by binary search over C-level comparisons."""
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def source_edit(old_bytes, new_bytes):
+    """
+    Describe the change between two versions of a file as one tree-sitter edit.
+
+    The edit spans from the first to the last differing byte, found by
+    trimming the common prefix and suffix.
+
+    Returns:
+        dict: Keyword arguments for Tree.edit, or None if the contents are identical
+    """
+    if old_bytes == new_bytes:
+        return None
+    limit = min(len(old_bytes), len(new_bytes))
+    start = _common_prefix_length(old_bytes, new_bytes, limit)
+    suffix = _common_prefix_length(old_bytes[::-1], new_bytes[::-1], limit - start)
+    old_end = len(old_bytes) - suffix
+    new_end = len(new_bytes) - suffix
+    return {
+        "start_byte": start,
+        "old_end_byte": old_end,
+        "new_end_byte": new_end,
+        "start_point": _point(old_bytes, start),
+        "old_end_point": _point(old_bytes, old_end),
+        "new_end_point": _point(new_bytes, new_end),
+    }
+
+def reparse(new_bytes, old_bytes=None, old_tree=None):
+    """
+    Parse code, reusing the unchanged subtrees of a previous parse when there is one.
+
+    Args:
+        new_bytes (bytes): Code to parse
+        old_bytes (bytes, optional): Code old_tree was parsed from
+        old_tree (optional): Previous tree; it is edited in place and must not be reused
+
+    Returns:
+        The tree of new_bytes
+    """
+    if old_tree is None or old_bytes is None:
+        return parser.parse(new_bytes)
+    edit = source_edit(old_bytes, new_bytes)
+    if edit is None:
+        return old_tree
+    old_tree.edit(**edit)
+    return parser.parse(new_bytes, old_tree)
+
+def get_parameters(parameters_node, code_bytes):
+    """Extract the plain identifier parameters of a parameters node"""
+    params = []
+    if parameters_node:
+        for param in parameters_node.children:
+            if param.type == "identifier":
+                params.append(get_node_text(param, code_bytes))
+    return params
+
+def _ranges(node):
+    return {
+        "start_byte": node.start_byte,
+        "end_byte": node.end_byte,
+        "start_line": node.start_point[0] + 1,
+        "end_line": node.end_point[0] + 1,
+    }
+
+def _function_record(node, code_bytes):
+    name_node = node.child_by_field_name("name")
+    body_node = node.child_by_field_name("body")
+    record = {
+        "kind": "function",
+        "name": get_node_text(name_node, code_bytes) if name_node else "",
+        "params": get_parameters(node.child_by_field_name("parameters"), code_bytes),
+        "docstring": get_docstring(body_node, code_bytes),
+        "returns": get_return_info(body_node, code_bytes),
+    }
+    record.update(_ranges(node))
+    return record
+
+def names_in_range(index, start_byte, end_byte):
+    """
+    Return the unique names of a call or class index inside a byte range, in source order.
+
+    Args:
+        index (list): Sorted [start_byte, name] pairs, e.g. record["calls"] from extract_symbols
+        start_byte (int): Start of the range
+        end_byte (int): End of the range (exclusive)
+    """
+    # A one-element list sorts before every [start_byte, name] pair with that start
+    lo = bisect.bisect_left(index, [start_byte])
+    hi = bisect.bisect_left(index, [end_byte])
+    return list(dict.fromkeys(name for _, name in index[lo:hi]))
+
+def extract_symbols(code_bytes, root_node):
+    """
+    Extract a compact symbol record of a file in a single pass.
+
+    The record lists the top-level classes (with attributes and methods),
+    functions and imports in source order, each with its byte and line range
+    and the call sites and class definitions found anywhere inside it, plus
+    file-wide indexes of both for code outside those symbols. It is
+    JSON-serializable, so the structure cache can store it and both the
+    structure view and the chunker can reuse it.
+
+    Args:
+        code_bytes (bytes): Source code
+        root_node: Root node of the tree-sitter tree of code_bytes
+
+    Returns:
+        dict: {"symbols": [...], "calls": [[start_byte, callee], ...], "classes": [[start_byte, name], ...]}
+    """
+    matches = _SYMBOL_QUERY.captures(root_node)
+    # Lists rather than tuples, so fresh records compare like ones loaded from JSON
+    calls = sorted([node.start_byte, get_node_text(node, code_bytes)] for node in matches.get("call", []))
+    classes = sorted([node.start_byte, get_node_text(node, code_bytes)] for node in matches.get("class_name", []))
+
+    symbols = []
     for child in root_node.children:
         if child.type == "class_definition":
             name_node = child.child_by_field_name("name")
-            class_name = get_node_text(name_node, code_bytes) if name_node else ""
-            info.append(f"{indent}Class: {class_name}")
-            
             body_node = child.child_by_field_name("body")
-            docstring = get_docstring(body_node, code_bytes)
-            if docstring:
-                info.append(f"{indent}  ├── Docstring: {docstring}")
+            record = {
+                "kind": "class",
+                "name": get_node_text(name_node, code_bytes) if name_node else "",
+                "docstring": get_docstring(body_node, code_bytes),
+                "attributes": get_assignments(body_node, code_bytes),
+                "methods": [],
+            }
+            if body_node:
+                for method in body_node.children:
+                    if method.type == "function_definition" and method.child_by_field_name("name"):
+                        method_record = _function_record(method, code_bytes)
+                        del method_record["kind"]
+                        record["methods"].append(method_record)
+            record.update(_ranges(child))
+        elif child.type == "function_definition":
+            record = _function_record(child, code_bytes)
+        elif child.type in ["import_from_statement", "import_statement"]:
+            record = {"kind": "import", "text": get_node_text(child, code_bytes)}
+            record.update(_ranges(child))
+            symbols.append(record)
+            continue
+        else:
+            continue
+        record["calls"] = names_in_range(calls, child.start_byte, child.end_byte)
+        record["class_instances"] = names_in_range(classes, child.start_byte, child.end_byte)
+        symbols.append(record)
+
+    return {"symbols": symbols, "calls": calls, "classes": classes}
+
+def render_file_info(record, indent=""):
+    """Render a symbol record as the structure view of a single Python file."""
+    info = []
+    
+    for symbol in record["symbols"]:
+        if symbol["kind"] == "class":
+            info.append(f"{indent}Class: {symbol['name']}")
+            
+            if symbol["docstring"]:
+                info.append(f"{indent}  ├── Docstring: {symbol['docstring']}")
             
-            assignments = get_assignments(body_node, code_bytes)
-            if assignments:
+            if symbol["attributes"]:
                 info.append(f"{indent}  ├── Class Attributes:")
-                for var, val in assignments:
+                for var, val in symbol["attributes"]:
                     info.append(f"{indent}  │   └── {var} = {val}")
             
-            if body_node:
-                for method in body_node.children:
-                    if method.type == "function_definition":
-                        method_name = method.child_by_field_name("name")
-                        if method_name:
-                            method_name = get_node_text(method_name, code_bytes)
-                            params = []
-                            parameters_node = method.child_by_field_name("parameters")
-                            if parameters_node:
-                                for param in parameters_node.children:
-                                    if param.type == "identifier":
-                                        params.append(get_node_text(param, code_bytes))
-                            
-                            info.append(f"{indent}  ├── Method: {method_name}({', '.join(params)})")
-                            
-                            method_body = method.child_by_field_name("body")
-                            method_docstring = get_docstring(method_body, code_bytes)
-                            if method_docstring:
-                                info.append(f"{indent}  │   ├── Docstring: {method_docstring}")
-                            
-                            returns = get_return_info(method_body, code_bytes)
-                            if returns:
-                                info.append(f"{indent}  │   └── Returns: {', '.join(returns)}")
+            for method in symbol["methods"]:
+                info.append(f"{indent}  ├── Method: {method['name']}({', '.join(method['params'])})")
+                if method["docstring"]:
+                    info.append(f"{indent}  │   ├── Docstring: {method['docstring']}")
+                if method["returns"]:
+                    info.append(f"{indent}  │   └── Returns: {', '.join(method['returns'])}")
         
-        elif child.type == "function_definition":
-            name_node = child.child_by_field_name("name")
-            func_name = get_node_text(name_node, code_bytes) if name_node else ""
-            params = []
-            parameters_node = child.child_by_field_name("parameters")
-            if parameters_node:
-                for param in parameters_node.children:
-                    if param.type == "identifier":
-                        params.append(get_node_text(param, code_bytes))
-            
-            info.append(f"{indent}Function: {func_name}({', '.join(params)})")
+        elif symbol["kind"] == "function":
+            info.append(f"{indent}Function: {symbol['name']}({', '.join(symbol['params'])})")
             
-            body_node = child.child_by_field_name("body")
-            docstring = get_docstring(body_node, code_bytes)
-            if docstring:
-                info.append(f"{indent}  ├── Docstring: {docstring}")
+            if symbol["docstring"]:
+                info.append(f"{indent}  ├── Docstring: {symbol['docstring']}")
             
-            returns = get_return_info(body_node, code_bytes)
-            if returns:
-                info.append(f"{indent}  └── Returns: {', '.join(returns)}")
+            if symbol["returns"]:
+                info.append(f"{indent}  └── Returns: {', '.join(symbol['returns'])}")
             
-        elif child.type in ["import_from_statement", "import_statement"]:
-            import_text = get_node_text(child, code_bytes)
-            info.append(f"{indent}Import: {import_text}")
+        elif symbol["kind"] == "import":
+            info.append(f"{indent}Import: {symbol['text']}")
 
     return "\n".join(info)
 
-def process_directory(directory, indent=""):
-    """Process directory and return formatted string of project structure with file contents."""
+def get_file_info(code_bytes, root_node, indent=""):
+    """Extract detailed information about a single Python file."""
+    return render_file_info(extract_symbols(code_bytes, root_node), indent)
+
+def _build_file_info(path):
+    """Parse one file and return (path, content hash, symbol record)."""
+    content_hash, code_bytes = read_source(path)
+    tree = parser.parse(code_bytes)
+    return path, content_hash, extract_symbols(code_bytes, tree.root_node)
+
+class StructureCache:
+    def __init__(self, path=STRUCTURE_CACHE_PATH):
+        """
+        On-disk cache of per-file symbol records, keyed by content hash.
+
+        A second table remembers the size, mtime and hash last seen for each
+        path, so unchanged files are resolved with a stat call and changed
+        files are only re-parsed when their content actually differs.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """CREATE TABLE IF NOT EXISTS file_symbols (
+                hash TEXT PRIMARY KEY,
+                record TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS file_stats (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                hash TEXT NOT NULL
+            );"""
+        )
+
+    def _store(self, path, stat, content_hash, record):
+        self._db.execute(
+            "INSERT OR REPLACE INTO file_symbols (hash, record) VALUES (?, ?)",
+            (content_hash, json.dumps(record))
+        )
+        self._db.execute(
+            "INSERT OR REPLACE INTO file_stats (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime, content_hash)
+        )
+
+    def put(self, path, stat, content_hash, record):
+        """
+        Store the symbol record of a file parsed elsewhere, e.g. by the chunker.
+
+        Args:
+            path (str): Python file path
+            stat (os.stat_result): Stat of the file taken before it was read
+            content_hash (str): Hash returned by read_source
+            record (dict): Record returned by extract_symbols
+        """
+        with self._lock, self._db:
+            self._store(path, stat, content_hash, record)
+
+    def get_many(self, paths):
+        """
+        Return the symbol record of each path, parsing only files missing from the cache.
+
+        Misses are parsed in a process pool when there are many of them, e.g.
+        on the first run against a repository.
+
+        Args:
+            paths (list): Python file paths
+
+        Returns:
+            dict: Path to symbol record, or to the exception raised while parsing it
+        """
+        results = {}
+        misses = []
+        with self._lock:
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    results[path] = e
+                    continue
+                row = self._db.execute(
+                    "SELECT file_symbols.record FROM file_stats JOIN file_symbols ON file_symbols.hash = file_stats.hash "
+                    "WHERE file_stats.path = ? AND file_stats.size = ? AND file_stats.mtime = ?",
+                    (path, stat.st_size, stat.st_mtime)
+                ).fetchone()
+                if row is not None:
+                    results[path] = json.loads(row[0])
+                else:
+                    misses.append((path, stat))
+
+        if len(misses) >= STRUCTURE_PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context(_POOL_START_METHOD)) as pool:
+                built = list(pool.map(_safe_build_file_info, [path for path, _ in misses], chunksize=8))
+        else:
+            built = [_safe_build_file_info(path) for path, _ in misses]
+
+        with self._lock, self._db:
+            for (path, stat), (_, content_hash, record) in zip(misses, built):
+                results[path] = record
+                if not isinstance(record, Exception):
+                    self._store(path, stat, content_hash, record)
+        return results
+
+def _safe_build_file_info(path):
+    try:
+        return _build_file_info(path)
+    except Exception as e:
+        return path, None, e
+
+_structure_cache = None
+
+def get_structure_cache():
+    """Return the process-wide structure cache."""
+    global _structure_cache
+    if _structure_cache is None:
+        _structure_cache = StructureCache()
+    return _structure_cache
+
+def _collect_python_files(directory):
+    """List the Python files process_directory will render, in the same traversal."""
+    paths = []
+    for entry in sorted(os.listdir(directory)):
+        if entry.startswith('.'):
+            continue
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path):
+            paths.extend(_collect_python_files(path))
+        elif entry.endswith('.py'):
+            paths.append(path)
+    return paths
+
+def _is_public(name):
+    return not name.startswith("_")
+
+def render_outline(record, indent="", detail="full"):
+    """
+    Render a symbol record at a given detail level.
+
+    "full" is the complete file info; "symbols" lists public classes with
+    their public methods and public functions with their parameters, one per
+    line; "names" is a comma-separated list of public top-level names.
+    Coarser levels render nothing.
+    """
+    if detail == "full":
+        return render_file_info(record, indent)
+    public = [symbol for symbol in record["symbols"]
+              if symbol["kind"] != "import" and _is_public(symbol["name"])]
+    if detail == "symbols":
+        info = []
+        for symbol in public:
+            if symbol["kind"] == "class":
+                methods = [method["name"] for method in symbol["methods"] if _is_public(method["name"])]
+                info.append(f"{indent}Class: {symbol['name']}" + (f" [{', '.join(methods)}]" if methods else ""))
+            else:
+                info.append(f"{indent}Function: {symbol['name']}({', '.join(symbol['params'])})")
+        return "\n".join(info)
+    if detail == "names":
+        return ", ".join(symbol["name"] for symbol in public)
+    return ""
+
+def _python_directories(python_files):
+    """Return every directory that contains a Python file, directly or below."""
+    directories = set()
+    for path in python_files:
+        directory = os.path.dirname(path)
+        while directory not in directories and directory != os.path.dirname(directory):
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+    return directories
+
+def process_directory(directory, indent="", file_infos=None, detail="full", python_dirs=None):
+    """
+    Process directory and return formatted string of project structure with file contents.
+
+    Below the "full" detail level only Python modules and the directories
+    containing them are listed.
+    """
+    if file_infos is None:
+        python_files = _collect_python_files(directory)
+        file_infos = get_structure_cache().get_many(python_files) if detail != "directories" else {}
+        python_dirs = _python_directories(python_files)
+
     output = []
     entries = sorted(os.listdir(directory))
     entries = [e for e in entries if not e.startswith('.')]
+    if detail != "full":
+        entries = [e for e in entries if e.endswith('.py') and not os.path.isdir(os.path.join(directory, e))
+                   or os.path.join(directory, e) in python_dirs]
 
     for index, entry in enumerate(entries):
         path = os.path.join(directory, entry)
         is_last = (index == len(entries) - 1)
         
         if os.path.isdir(path):
-            output.append(f"{indent}├── {entry}/")
+            if detail == "directories":
+                num_modules = sum(1 for e in os.listdir(path) if e.endswith('.py') and not e.startswith('.')
+                                  and not os.path.isdir(os.path.join(path, e)))
+                output.append(f"{indent}├── {entry}/ ({num_modules} modules)")
+            else:
+                output.append(f"{indent}├── {entry}/")
             new_indent = f"{indent}│   " if not is_last else f"{indent}    "
-            output.extend(process_directory(path, new_indent))
+            output.extend(process_directory(path, new_indent, file_infos, detail, python_dirs))
+        elif detail == "directories":
+            continue
         else:
             if entry.endswith('.py'):
-                output.append(f"{indent}└── {entry}")
-                try:
-                    with open(path, 'r', encoding='utf-8') as file:
-                        code_str = file.read()
-                    code_bytes = bytes(code_str, "utf8")
-                    tree = parser.parse(code_bytes)
-                    file_info = get_file_info(code_bytes, tree.root_node, indent + "        ")
+                record = file_infos.get(path)
+                if isinstance(record, Exception):
+                    output.append(f"{indent}└── {entry}")
+                    output.append(f"{indent}        | Error parsing file: {str(record)}")
+                elif record and detail == "names":
+                    names = render_outline(record, detail=detail)
+                    output.append(f"{indent}└── {entry}" + (f": {names}" if names else ""))
+                else:
+                    output.append(f"{indent}└── {entry}")
+                    file_info = render_outline(record, indent + "        ", detail) if record else ""
                     if file_info:
                         output.append(f"{indent}        |")
                         output.append(file_info)
-                except Exception as e:
-                    output.append(f"{indent}        | Error parsing file: {str(e)}")
             else:
                 output.append(f"{indent}└── {entry}")
 
     return output
 
-def parse_project(project_directory):
+def parse_project(project_directory, detail="full"):
     """Main function to parse the project."""
     base_name = os.path.basename(project_directory)
     # print("base_name", base_name)
     output = [f"{base_name}/"]
-    output.extend(process_directory(project_directory))
+    output.extend(process_directory(project_directory, detail=detail))
     # print("output", output, "\n")
     return "\n".join(output)
 
+def estimate_tokens(text):
+    """Rough token count of text, at about four characters per token."""
+    return (len(text) + 3) // 4
+
+def render_codebase_structure(project_directory, token_budget=STRUCTURE_TOKEN_BUDGET):
+    """
+    Render the project structure at the most detailed level that fits a token budget.
+
+    Levels are tried from "full" down to "directories"; if even the directory
+    tree is too large it is cut off at the budget.
+
+    Args:
+        project_directory (str): Directory to render
+        token_budget (int): Approximate maximum size of the result in tokens
+
+    Returns:
+        tuple: (structure text, detail level used)
+    """
+    python_files = _collect_python_files(project_directory)
+    file_infos = get_structure_cache().get_many(python_files)
+    python_dirs = _python_directories(python_files)
+    base_name = os.path.basename(project_directory)
+
+    for detail in STRUCTURE_DETAIL_LEVELS:
+        if detail == "directories":
+            num_modules = sum(1 for path in python_files if os.path.dirname(path) == project_directory.rstrip(os.sep))
+            output = [f"{base_name}/ ({num_modules} modules)"]
+        else:
+            output = [f"{base_name}/"]
+        output.extend(process_directory(project_directory, file_infos=file_infos, detail=detail,
+                                        python_dirs=python_dirs))
+        text = "\n".join(output)
+        if estimate_tokens(text) <= token_budget:
+            return text, detail
+
+    kept = []
+    used = 0
+    for line in output:
+        used += estimate_tokens(line + "\n")
+        if used > token_budget:
+            break
+        kept.append(line)
+    kept.append(f"... ({len(output) - len(kept)} more entries not shown)")
+    return "\n".join(kept), "directories"
+
 if __name__ == "__main__":
     from dotenv import load_dotenv
     load_dotenv()
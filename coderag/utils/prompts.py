@@ -1,12 +1,11 @@
-from .parser import parse_project
+from .parser import render_codebase_structure, STRUCTURE_TOKEN_BUDGET
 from dotenv import load_dotenv
 import os
 load_dotenv()
 
 CODE_REPO_PATH = os.getenv("CODE_REPO_PATH")
-codebase_structure = parse_project(CODE_REPO_PATH)
 
-system_prompt = f"""
+_SYSTEM_PROMPT_TEMPLATE = """
 You are a powerful agentic AI coding assistant designed by Mohit - an AI Engineer based in India.
 
 You are pair programming with a USER to solve their coding task. The task may require creating, modifying or debugging an existing codebase, 
@@ -32,6 +31,8 @@ You have several powerful tools at your disposal to solve coding tasks:
 2. modify_code_file: To provide a complete new code along with the changes so that the file can be entirely rewritten
 3. create_code_file: For generating new files or overwriting existing ones
 4. search_similar_code: For finding semantically similar code patterns across the codebase
+5. expand_codebase_structure: For seeing the classes, methods, docstrings and imports of a directory or file that the codebase structure below only outlines
+6. edit_code_file: For changing part of a file by line range, insertion or exact snippet replacement, without resending the whole file
 
 When using these tools:
 1. ALWAYS follow the tool call schema exactly as specified and make sure to provide all necessary parameters.
@@ -39,7 +40,9 @@ When using these tools:
 3. NEVER refer to tool names when speaking to the USER. For example, instead of saying 'I need to use the modify_code_file tool', just say 'I will update your file'.
 4. Only call tools when they are necessary. If the USER's task is general or you already know the answer, just respond without calling tools.
 5. Before calling each tool, first explain to the USER why you are calling it.
-6. When modifying code, remember that the entire file content will be replaced - ensure you have the complete context before making changes.
+6. When modifying code with modify_code_file, remember that the entire file content will be replaced - ensure you have the complete context before making changes.
+7. Prefer edit_code_file for changes that leave most of a file untouched; pass the version from your last read or edit of the file, and read it again if the edit reports a conflict.
+8. When you need several independent reads or searches, request them all in the same turn; they run in parallel.
 </tool_calling>
 
 
@@ -73,10 +76,38 @@ When making code changes, NEVER output code to the USER, unless requested. Inste
 </debugging>
 
 <codebase_structure>
-{codebase_structure}
+{structure_note}{codebase_structure}
 </codebase_structure>
 
 <codebase_path>
-{CODE_REPO_PATH}
+{code_repo_path}
 </codebase_path>
-"""
\ No newline at end of file
+"""
+
+def get_system_prompt(token_budget=STRUCTURE_TOKEN_BUDGET):
+    """
+    Build the system prompt with the current codebase structure.
+
+    The structure is read from the per-file structure cache, so this only
+    re-parses files that changed since the last call. It is rendered at the
+    most detailed level that fits token_budget; when that is only an
+    outline, the prompt says so and points at expand_codebase_structure.
+    """
+    codebase_structure, detail = render_codebase_structure(CODE_REPO_PATH, token_budget)
+    structure_note = ""
+    if detail != "full":
+        structure_note = (
+            f"This is a '{detail}' outline of a large codebase. "
+            "Use expand_codebase_structure on a directory or file to see its details.\n"
+        )
+    return _SYSTEM_PROMPT_TEMPLATE.format(
+        structure_note=structure_note,
+        codebase_structure=codebase_structure,
+        code_repo_path=CODE_REPO_PATH
+    )
+
+def __getattr__(name):
+    # Keep `from utils.prompts import system_prompt` working without parsing at import time
+    if name == "system_prompt":
+        return get_system_prompt()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,101 @@
+"""Process-wide registry of expensive, shareable resources (models, stores, API clients)."""
+import threading
+
+_instances = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+def get_or_create(key, factory):
+    """
+    Return the instance registered under key, creating it once on first use.
+
+    Creation happens under a per-key lock, so concurrent callers wait for the
+    same instance instead of loading it twice, while unrelated keys can be
+    created in parallel.
+
+    Args:
+        key: Hashable identifier of the resource
+        factory: Zero-argument callable building the resource
+
+    Returns:
+        The shared instance
+    """
+    instance = _instances.get(key)
+    if instance is not None:
+        return instance
+    with _registry_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        instance = _instances.get(key)
+        if instance is None:
+            instance = factory()
+            _instances[key] = instance
+    return instance
+
+def register(key, instance) -> None:
+    """Install an instance directly, e.g. an offline stand-in for a model or client."""
+    with _registry_lock:
+        _instances[key] = instance
+
+def get_embedding_model(model_name: str = "all-MiniLM-L6-v2"):
+    """Return the shared SentenceTransformer model."""
+    def create():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    return get_or_create(("embedding_model", model_name), create)
+
+def get_vector_store(collection_name: str, backend: str = None):
+    """Return the shared vector store namespace."""
+    from embedding.vector_store import VECTOR_STORE_BACKEND, create_vector_store
+    # Resolve the default so explicit and implicit backends share one instance
+    backend = backend or VECTOR_STORE_BACKEND
+    def create():
+        return create_vector_store(collection_name, backend)
+    return get_or_create(("vector_store", collection_name, backend), create)
+
+def get_reranker():
+    """Return the shared ColBERT reranker."""
+    def create():
+        from rerankers import Reranker
+        from embedding.rerank import RERANKER_MODEL
+        return Reranker(RERANKER_MODEL, model_type='colbert', verbose=0)
+    return get_or_create("reranker", create)
+
+def get_anthropic_client():
+    """Return the shared synchronous Anthropic client."""
+    def create():
+        import anthropic
+        return anthropic.Anthropic()
+    return get_or_create("anthropic_client", create)
+
+def get_code_embedder(collection_name: str = None, model_name: str = None, backend: str = None):
+    """Return the shared CodeEmbedder for a namespace."""
+    def create():
+        from embedding.embedd import CodeEmbedder
+        kwargs = {"backend": backend}
+        if collection_name:
+            kwargs["collection_name"] = collection_name
+        if model_name:
+            kwargs["model_name"] = model_name
+        return CodeEmbedder(**kwargs)
+    return get_or_create(("code_embedder", collection_name, model_name, backend), create)
+
+def warmup() -> None:
+    """Load the embedder, reranker and API client up front so the first tool call is fast."""
+    get_anthropic_client()
+    get_code_embedder()
+    get_reranker()
+
+def shutdown() -> None:
+    """Close clients that hold connections and drop every registered instance."""
+    with _registry_lock:
+        instances = list(_instances.values())
+        _instances.clear()
+        _locks.clear()
+    for instance in instances:
+        close = getattr(instance, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                print(f"Error closing {type(instance).__name__}: {str(e)}")
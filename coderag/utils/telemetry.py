@@ -0,0 +1,407 @@
+"""Per-request traces, process-wide metrics and an opt-in sampling profiler."""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Finished traces are appended here as JSON lines when set
+TRACE_PATH = os.getenv("CODERAG_TRACE_PATH")
+# Finished traces kept in memory for lookup by ID
+TRACE_HISTORY = int(os.getenv("CODERAG_TRACE_HISTORY", "100"))
+# The CLI writes the Prometheus text of its metrics here on exit when set
+METRICS_PATH = os.getenv("CODERAG_METRICS_PATH")
+# Seconds between stack samples of the sampling profiler, 0 disables it
+PROFILE_INTERVAL = float(os.getenv("CODERAG_PROFILE_INTERVAL", "0"))
+PROFILE_PATH = os.getenv("CODERAG_PROFILE_PATH", "coderag-profile.txt")
+
+# Upper bounds in seconds of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Usage fields of an Anthropic response, reported as the "kind" label of the token counter
+_USAGE_FIELDS = {
+    "input_tokens": "input",
+    "output_tokens": "output",
+    "cache_read_input_tokens": "cache_read",
+    "cache_creation_input_tokens": "cache_write",
+}
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class CounterMetric:
+    def __init__(self, name: str, documentation: str, labels=()):
+        """A monotonically increasing count per combination of label values."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(tuple(labels.get(name, "") for name in self.labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value}")
+        return lines
+
+class HistogramMetric:
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DURATION_BUCKETS):
+        """Observations counted into cumulative buckets, with their sum, per combination of label values."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket plus +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {round(counts[-1], 6)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        """Named metrics of the process, rendered together in the Prometheus text format."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels=()) -> CounterMetric:
+        return self._get_or_add(CounterMetric(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels=(), buckets=DURATION_BUCKETS) -> HistogramMetric:
+        return self._get_or_add(HistogramMetric(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+metrics = MetricsRegistry()
+
+def write_metrics(path: str = METRICS_PATH) -> None:
+    """Write the Prometheus text of all metrics to path, if set."""
+    if not path:
+        return
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(metrics.render())
+
+SPAN_SECONDS = metrics.histogram("coderag_span_seconds", "Duration of traced operations", ("span",))
+SPAN_ERRORS = metrics.counter("coderag_span_errors_total", "Traced operations that raised", ("span",))
+LLM_TOKENS = metrics.counter("coderag_llm_tokens_total", "Tokens reported by the Anthropic API", ("model", "kind"))
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "end", "error", "thread", "children", "trace")
+
+    def __init__(self, name: str, attributes: Dict = None, trace: "Trace" = None):
+        """
+        One timed operation. Every finished span is observed in the duration
+        histogram; spans belonging to a trace are also kept in its tree.
+
+        A span can be used as a context manager without making it the
+        current span, which is safe across generator yields; use span()
+        to time a block and parent the spans started inside it.
+        """
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.children = []
+        self.trace = trace
+
+    def child(self, name: str, **attributes) -> "Span":
+        """Start a span under this one."""
+        child = Span(name, attributes, self.trace)
+        if self.trace is not None:
+            with self.trace.lock:
+                self.children.append(child)
+        return child
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self, error: BaseException = None) -> None:
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        SPAN_SECONDS.observe(self.end - self.start, span=self.name)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+            SPAN_ERRORS.inc(span=self.name)
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # A closed generator is not an error of the operation
+        self.finish(None if isinstance(exc, GeneratorExit) else exc)
+
+    def to_dict(self, origin: float) -> Dict:
+        if self.trace is not None:
+            with self.trace.lock:
+                children = list(self.children)
+        else:
+            children = []
+        span = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": None if self.end is None else round((self.end - self.start) * 1000, 3),
+            "thread": self.thread,
+            "attributes": self.attributes,
+        }
+        if self.error:
+            span["error"] = self.error
+        if children:
+            span["children"] = [child.to_dict(origin) for child in sorted(children, key=lambda c: c.start)]
+        return span
+
+class Trace:
+    def __init__(self, name: str, **attributes):
+        """The spans of one request, e.g. an agent turn, rooted at a span named after it."""
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.root = Span(name, attributes, self)
+
+    def finish(self, error: BaseException = None) -> None:
+        """Finish the root span and publish the trace; spans still running are exported unfinished."""
+        if self.root.end is not None:
+            return
+        self.root.finish(error)
+        _publish(self)
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration_ms": None if self.root.end is None else round(self.root.duration * 1000, 3),
+            "root": self.root.to_dict(self.root.start),
+        }
+
+_current_span = contextvars.ContextVar("coderag_current_span", default=None)
+_recent_traces = deque(maxlen=TRACE_HISTORY)
+_traces_lock = threading.Lock()
+
+def _publish(trace: Trace) -> None:
+    with _traces_lock:
+        _recent_traces.append(trace)
+        if TRACE_PATH:
+            try:
+                with open(TRACE_PATH, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(trace.to_dict(), default=str) + "\n")
+            except OSError as e:
+                print(f"Error writing trace to {TRACE_PATH}: {str(e)}")
+
+def start_trace(name: str, **attributes) -> Trace:
+    """Start the trace of one request; finish it with trace.finish()."""
+    return Trace(name, **attributes)
+
+def get_trace(trace_id: str) -> Optional[Trace]:
+    """Return a recently finished trace by ID."""
+    with _traces_lock:
+        return next((trace for trace in _recent_traces if trace.trace_id == trace_id), None)
+
+def recent_traces() -> List[Trace]:
+    """Recently finished traces, oldest first."""
+    with _traces_lock:
+        return list(_recent_traces)
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+@contextmanager
+def activate(span: Optional[Span]):
+    """Make span the parent of spans started in this block, e.g. in a worker thread."""
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a block as a child of the current span.
+
+    Outside of any trace the duration still goes into the metrics; only
+    the span tree is skipped.
+    """
+    parent = _current_span.get()
+    current = parent.child(name, **attributes) if parent is not None else Span(name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.finish(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+def propagate(function):
+    """Bind function to the current span, for running it on another thread's executor."""
+    return functools.partial(contextvars.copy_context().run, function)
+
+def record_usage(model: str, usage, span: Span = None) -> None:
+    """
+    Count the tokens of an Anthropic response and attach them to a span.
+
+    Args:
+        model (str): Model that served the request
+        usage: The response's usage object (or dict)
+        span (Span, optional): Span to annotate. Defaults to the current span.
+    """
+    if usage is None:
+        return
+    span = span if span is not None else _current_span.get()
+    for field, kind in _USAGE_FIELDS.items():
+        value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+        if not value:
+            continue
+        LLM_TOKENS.inc(value, model=model, kind=kind)
+        if span is not None:
+            span.attributes[field] = span.attributes.get(field, 0) + value
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        """
+        Sample the stack of every thread at a fixed interval.
+
+        Samples are aggregated as collapsed stacks ("outer;inner count"
+        lines), the input format of flame graph tools such as speedscope
+        and flamegraph.pl. The cost is one walk of every thread's stack
+        per interval, independent of what the threads are doing.
+
+        Args:
+            interval (float): Seconds between samples
+        """
+        self.interval = interval
+        self.samples = Counter()
+        # Guards samples against readers while the sampler thread adds to them
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="coderag-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self.samples.update(stacks)
+
+    def collapsed(self) -> str:
+        with self._lock:
+            samples = self.samples.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+
+    def write(self, path: str = PROFILE_PATH) -> None:
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(self.collapsed())
+
+_profiler = None
+
+def start_profiler(interval: float = PROFILE_INTERVAL) -> Optional[SamplingProfiler]:
+    """Start the process-wide sampling profiler if interval is positive (CODERAG_PROFILE_INTERVAL)."""
+    global _profiler
+    if interval <= 0:
+        return None
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval)
+        _profiler.start()
+    return _profiler
+
+def get_profiler() -> Optional[SamplingProfiler]:
+    return _profiler
+
+def stop_profiler(path: str = PROFILE_PATH) -> None:
+    """Stop the sampling profiler, if running, and write its collapsed stacks to path."""
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.stop()
+    _profiler.write(path)
+    print(f"Wrote {sum(_profiler.samples.values())} profile samples to {path}")
+    _profiler = None